@@ -0,0 +1,147 @@
+"""
+Adaptive per-account polling schedule.
+
+A min-heap of (due_at, account) plus a little state per account:
+
+• arrival rate   – EWMA of new threads per second, so busy inboxes are
+                   polled sooner (down to MIN_SEC)
+• empty streak   – consecutive polls with nothing new; dormant inboxes back
+                   off exponentially from BASE_SEC up to MAX_SEC, capped by
+                   half the time since the last change
+• error streak   – failures back off the same way, independent of activity
+
+``floors`` sets a minimum delay per provider (e.g. Slack workspaces that
+receive Events API pushes are only polled to reconcile); ``account_floor``
+one per account at poll time (e.g. Gmail mailboxes while their push watch
+is live).  ``bump(uid)``
+moves a user's accounts to the front (manual refresh, push notification).
+Pure bookkeeping – no I/O, not thread-safe; the poller drives it from the
+event loop.
+"""
+from __future__ import annotations
+import heapq, itertools, os, time
+from typing import Callable, Iterable
+
+BASE_SEC = float(os.getenv("POLL_BASE_SEC", "120"))
+MIN_SEC  = float(os.getenv("POLL_MIN_SEC", "30"))
+MAX_SEC  = float(os.getenv("POLL_MAX_SEC", "1800"))
+ALPHA    = 0.3                   # EWMA weight of the latest observation
+MAX_EXP  = 16                    # backoff exponent cap (2**16 × BASE_SEC ≫ MAX_SEC)
+
+Account = tuple[str, str]        # (UserID, ProviderKey)
+
+
+class _State:
+    __slots__ = ("rate", "last_poll", "last_change", "empty", "errors", "due")
+
+    def __init__(self, now: float):
+        self.rate        = 0.0
+        self.last_poll   = now
+        self.last_change = now
+        self.empty       = 0
+        self.errors      = 0
+        self.due         = now
+
+
+class Schedule:
+    def __init__(
+        self,
+        floors: dict[str, float] | None = None,
+        account_floor: Callable[[Account, float], float] | None = None,
+    ) -> None:
+        self.floors = floors or {}              # provider → minimum delay
+        self.account_floor = account_floor      # (account, now) → minimum delay
+        self._heap: list[tuple[float, int, Account]] = []
+        self._seq   = itertools.count()         # tie-breaker, keeps heap stable
+        self._state: dict[Account, _State] = {}
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+    def _push(self, acct: Account, due: float) -> None:
+        self._state[acct].due = due
+        heapq.heappush(self._heap, (due, next(self._seq), acct))
+
+    # —— membership ——————————————————————————————————————————
+    def refresh(self, accounts: Iterable[Account], now: float | None = None) -> None:
+        """Track exactly ``accounts``: new ones are due now, gone ones dropped."""
+        now = time.time() if now is None else now
+        wanted = set(accounts)
+        for acct in wanted - self._state.keys():
+            self._state[acct] = _State(now)
+            self._push(acct, now)
+        for acct in self._state.keys() - wanted:
+            del self._state[acct]               # heap entry is skipped lazily
+
+    # —— queue ————————————————————————————————————————————
+    def next_due(self) -> float | None:
+        while self._heap:
+            due, _, acct = self._heap[0]
+            st = self._state.get(acct)
+            if st is not None and st.due == due:
+                return due
+            heapq.heappop(self._heap)           # stale entry
+        return None
+
+    def pop_due(self, now: float | None = None, limit: int | None = None) -> list[Account]:
+        """Remove and return accounts due at ``now`` (most overdue first)."""
+        now = time.time() if now is None else now
+        out: list[Account] = []
+        while (limit is None or len(out) < limit) and (due := self.next_due()) is not None:
+            if due > now:
+                break
+            _, _, acct = heapq.heappop(self._heap)
+            self._state[acct].due = float("inf")    # in flight until record()
+            out.append(acct)
+        return out
+
+    def bump(self, uid: str, now: float | None = None) -> int:
+        """Pull every account of ``uid`` to the front; returns how many."""
+        now = time.time() if now is None else now
+        hits = 0
+        for acct, st in self._state.items():
+            if acct[0] == uid and st.due != float("inf"):
+                self._push(acct, now)
+                hits += 1
+        return hits
+
+    # —— feedback ——————————————————————————————————————————
+    def record(
+        self,
+        acct: Account,
+        new_items: int = 0,
+        *,
+        error: bool = False,
+        now: float | None = None,
+    ) -> float:
+        """Feed back one poll result; returns the delay until the next poll."""
+        now = time.time() if now is None else now
+        st = self._state.get(acct)
+        if st is None:                         # dropped while in flight
+            return 0.0
+
+        if error:
+            st.errors += 1
+            delay = min(MAX_SEC, BASE_SEC * 2 ** min(st.errors, MAX_EXP))
+        else:
+            elapsed = max(1.0, now - st.last_poll)
+            st.rate = ALPHA * (new_items / elapsed) + (1 - ALPHA) * st.rate
+            st.errors = 0
+            if new_items:
+                st.empty, st.last_change = 0, now
+            else:
+                st.empty += 1
+            # expected arrivals in one base interval shrink the delay …
+            delay = BASE_SEC / (1.0 + st.rate * BASE_SEC)
+            # … and a quiet streak stretches it exponentially, but never
+            # past half the time since mail last arrived
+            if st.empty > 1:
+                idle = max(BASE_SEC, (now - st.last_change) / 2)
+                delay = max(delay, min(BASE_SEC * 2 ** min(st.empty - 1, MAX_EXP), idle))
+            delay = max(MIN_SEC, min(MAX_SEC, delay))
+        delay = max(delay, self.floors.get(acct[1].split(":")[0], 0.0))
+        if self.account_floor is not None:
+            delay = max(delay, self.account_floor(acct, now))
+        st.last_poll = now
+        self._push(acct, now + delay)
+        return delay
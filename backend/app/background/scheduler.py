@@ -1,23 +1,213 @@
 # Background poller that keeps the cache warm.
 # Called once on startup by FastAPI (see app.main).
+#
+# All Gmail/Dynamo work is blocking (googleapiclient, boto3, token refresh),
+# so every account sync runs on a dedicated thread pool.  Concurrency is
+# bounded globally (POLL_WORKERS) and per user (POLL_PER_USER), and each
+# account gets POLL_ACCOUNT_TIMEOUT seconds before the loop moves on.
+#
+# When each account is polled is decided by the adaptive schedule in
+# app.background.adaptive: busy inboxes come round sooner, dormant or
+# failing ones back off.
+#
+# Slack workspaces ("slack" rows) share the schedule and the limits; their
+# sync is async (app.integrations.slack.service) and runs on the loop.
+# While Events API ingestion is on (opt-in, see slack.events) messages arrive by push,
+# and the poll only reconciles, at most every SLACK_RECONCILE_SEC.  Gmail
+# mailboxes with a live push watch (GMAIL_PUBSUB_TOPIC) likewise sync on
+# push (sync_pushed) and are polled at most every GMAIL_RECONCILE_SEC; a
+# failed or lapsed watch falls back to the adaptive interval.
 
-import asyncio, logging
-from app.core.db import all_gmail_tokens
-from app.integrations.gmail import service
+import asyncio, itertools, logging, os, time, weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Iterable
+from app.core.db import iter_sync_targets, list_gmail_tokens
+from app.integrations.gmail import clients, push, service
+from app.integrations.slack import events as slack_events, service as slack
+from .adaptive import Schedule
 
 log       = logging.getLogger("gmail.poller")
-POLL_SEC  = 120            # every two minutes
+POLL_SEC  = 120            # account-list refresh; per-account timing is adaptive
 
+WORKERS         = int(os.getenv("POLL_WORKERS", "8"))
+PER_USER        = int(os.getenv("POLL_PER_USER", "1"))
+ACCOUNT_TIMEOUT = float(os.getenv("POLL_ACCOUNT_TIMEOUT", "90"))
+RECONCILE_SEC   = float(os.getenv("SLACK_RECONCILE_SEC", "3600"))
+GMAIL_RECONCILE = float(os.getenv("GMAIL_RECONCILE_SEC", "1800"))
 
-async def poll_gmail_forever() -> None:
-    """Continuously sync every Gmail account in the database."""
-    await asyncio.sleep(5)     # give FastAPI a moment to start
-    while True:
-        for uid, _prov in all_gmail_tokens():       # _prov not needed any more
+# a timed-out sync keeps its thread until Google/Dynamo give up, so leave
+# head-room above WORKERS for stragglers
+_pool      = ThreadPoolExecutor(max_workers=WORKERS * 2, thread_name_prefix="gmail-sync")
+_global    = asyncio.Semaphore(WORKERS)
+_per_user: "weakref.WeakValueDictionary[str, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+_running: set[tuple[str, str]] = set()     # accounts with a sync still on a thread
+
+def _watched_floor(acct: tuple[str, str], now: float) -> float:
+    """Reconcile-only delay for a mailbox with a live push watch (never past its lapse)."""
+    until = push.watch_until(*acct) if acct[1].startswith("gmail:") else 0.0
+    return min(GMAIL_RECONCILE, until - now) if until > now else 0.0
+
+
+schedule = Schedule(
+    floors={"slack": RECONCILE_SEC} if slack_events.enabled() else {},
+    account_floor=_watched_floor,
+)
+_wake    = asyncio.Event()                 # set by bump() to re-check the heap
+
+
+def _user_sem(uid: str) -> asyncio.Semaphore:
+    sem = _per_user.get(uid)
+    if sem is None:
+        sem = _per_user[uid] = asyncio.Semaphore(PER_USER)
+    return sem
+
+
+async def sync_account(uid: str, provider_key: str, *, max_threads: int = 30) -> int:
+    """
+    Sync one gmail:<addr> row off the event loop (or a slack row on it).
+    Returns the number of new threads (0 if skipped); raises
+    asyncio.TimeoutError after ACCOUNT_TIMEOUT seconds.
+    """
+    key = (uid, provider_key)
+    user_sem = _user_sem(uid)
+    # per-user first: a user queued behind their own limit must not hold global slots
+    async with user_sem, _global:
+        if provider_key == "slack":              # cancellable, no thread to strand
+            return await asyncio.wait_for(slack.fetch_for_user(uid), ACCOUNT_TIMEOUT)
+        if key in _running:                  # previous run still stuck on a thread
+            log.info("Skipping %s %s – previous sync still running", uid, provider_key)
+            return 0
+        _running.add(key)
+        fut = asyncio.get_running_loop().run_in_executor(
+            _pool, partial(service.fetch_for_user, uid, provider_key, max_threads=max_threads)
+        )
+        fut.add_done_callback(lambda _f: _running.discard(key))
+        return await asyncio.wait_for(asyncio.shield(fut), ACCOUNT_TIMEOUT)
+
+
+async def _sync_scheduled(acct: tuple[str, str]) -> None:
+    uid, prov = acct
+    try:
+        new_ = await sync_account(uid, prov)
+    except Exception as exc:
+        log.warning("Poll failed for %s %s: %r", uid, prov, exc)
+        schedule.record(acct, error=True)
+        _wake.set()
+        return
+    if new_:
+        log.info("%s new threads added for %s (%s)", new_, uid, prov)
+    schedule.record(acct, new_)
+    _wake.set()                                 # its next due time may be sooner
+
+
+async def sync_pushed(uid: str, provider_key: str) -> None:
+    """
+    Incremental sync of one mailbox a push notification named.  A sync
+    already on a thread is waited out first, so the push is not lost to the
+    skip in sync_account.
+    """
+    acct, deadline = (uid, provider_key), time.monotonic() + ACCOUNT_TIMEOUT
+    while acct in _running and time.monotonic() < deadline:
+        await asyncio.sleep(1)
+    await _sync_scheduled(acct)
+
+
+async def sync_user(uid: str, *, max_threads: int = 30) -> int:
+    """
+    Sync every Gmail account of one user right now (used by the HTTP
+    routes) and feed the results back into the schedule.
+    """
+    rows = await asyncio.get_running_loop().run_in_executor(_pool, list_gmail_tokens, uid)
+
+    async def _one(prov: str) -> int:
+        try:
+            new_ = await sync_account(uid, prov, max_threads=max_threads)
+        except Exception as exc:
+            log.warning("Sync failed for %s %s: %s", uid, prov, exc)
+            schedule.record((uid, prov), error=True)
+            return 0
+        schedule.record((uid, prov), new_)
+        return new_
+
+    return sum(await asyncio.gather(*(_one(r["Provider"]) for r in rows)))
+
+
+def all_targets(shards: Iterable[int] | None = None) -> Iterable[tuple[str, str]]:
+    """Every active Gmail account and Slack workspace (in ``shards``)."""
+    shards = None if shards is None else list(shards)
+    return itertools.chain(iter_sync_targets("gmail", shards), iter_sync_targets("slack", shards))
+
+
+def bump(uid: str) -> int:
+    """Move a user's accounts to the front of the in-process schedule."""
+    hits = schedule.bump(uid)
+    _wake.set()
+    return hits
+
+
+async def _refresh_credentials(stop: asyncio.Event) -> None:
+    """Refresh cached OAuth tokens ahead of expiry, off the sync path."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        try:
+            if n := await loop.run_in_executor(_pool, clients.refresh_due):
+                log.debug("Refreshed %s Gmail tokens ahead of expiry", n)
+        except Exception as exc:
+            log.warning("Token refresh pass failed: %s", exc)
+        try:
+            await asyncio.wait_for(stop.wait(), clients.REFRESH_AHEAD / 2)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_schedule(
+    targets: Callable[[], Iterable[tuple[str, str]]],
+    stop: asyncio.Event | None = None,
+) -> None:
+    """
+    Drive ``schedule``: re-read the account list from ``targets`` every
+    POLL_SEC, and start each account's sync when it falls due, keeping at
+    most 2×WORKERS syncs in flight.
+    """
+    loop = asyncio.get_running_loop()
+    stop = stop or asyncio.Event()
+    inflight: set[asyncio.Task] = set()
+    next_refresh = 0.0
+    refresher = asyncio.create_task(_refresh_credentials(stop))
+
+    while not stop.is_set():
+        now = time.time()
+        if now >= next_refresh:
             try:
-                new_ = service.fetch_for_user(uid, max_threads=30)
-                if new_:
-                    log.info("%s new threads added for %s", len(new_), uid)
+                accounts = await loop.run_in_executor(_pool, lambda: list(targets()))
+                schedule.refresh(accounts)
             except Exception as exc:
-                log.warning("Poll failed for %s: %s", uid, exc)
-        await asyncio.sleep(POLL_SEC)
\ No newline at end of file
+                log.warning("Listing Gmail accounts failed: %s", exc)
+            next_refresh = now + POLL_SEC
+
+        for acct in schedule.pop_due(limit=max(0, WORKERS * 2 - len(inflight))):
+            task = asyncio.create_task(_sync_scheduled(acct))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+
+        due = schedule.next_due()
+        wait = min(next_refresh, due if due is not None else next_refresh) - time.time()
+        if len(inflight) >= WORKERS * 2:
+            wait = min(wait, 1.0)               # re-check once a slot frees up
+        _wake.clear()
+        waiters = [asyncio.ensure_future(_wake.wait()), asyncio.ensure_future(stop.wait())]
+        await asyncio.wait(waiters, timeout=max(0.0, wait),
+                           return_when=asyncio.FIRST_COMPLETED)
+        for w in waiters:
+            w.cancel()
+
+    refresher.cancel()
+    if inflight:
+        await asyncio.wait(inflight)
+
+
+async def poll_gmail_forever() -> None:
+    """Continuously sync every Gmail account and Slack workspace in the database."""
+    await asyncio.sleep(5)     # give FastAPI a moment to start
+    await run_schedule(all_targets)
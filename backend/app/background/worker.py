@@ -0,0 +1,131 @@
+"""
+Standalone Gmail sync worker.
+
+    python -m app.background.worker --workers 4
+
+Run one process per node (or several per node); together they split the
+Gmail accounts (and Slack workspaces) between them.  Accounts live in
+SYNC_SHARDS registry shards (see app.core.db) and ownership is a lease per
+shard in
+``triagely-sync-leases``: a worker only streams the accounts of shards it
+holds, renews those leases on a heartbeat, and picks up shards whose lease
+expired because their owner died.  Each worker claims at most its fair
+share (shards / --workers) so the fleet stays balanced, and every mailbox
+has exactly one owner.  Within its shards a worker polls each account on
+the adaptive schedule (app.background.adaptive).
+
+Run the API with GMAIL_POLLER=off when these workers are deployed.
+"""
+from __future__ import annotations
+import argparse, asyncio, logging, math, os, random, signal, socket, time
+
+from app.core.db import SYNC_SHARDS, acquire_lease, release_lease
+from app.background import scheduler
+from app.nlp.enrich import run_enrichment
+
+log = logging.getLogger("gmail.worker")
+
+LEASE_TTL = int(os.getenv("SYNC_LEASE_TTL", str(scheduler.POLL_SEC * 3)))
+
+
+def _lease_key(shard: int) -> str:
+    return f"shard:gmail#{shard:02d}"
+
+
+class Worker:
+    def __init__(self, worker_id: str, fleet_size: int, ttl: int = LEASE_TTL):
+        self.id     = worker_id
+        self.fleet  = max(1, fleet_size)
+        self.ttl    = ttl
+        self.owned: set[int] = set()                    # registry shards we hold
+        self._stop  = asyncio.Event()
+
+    # —— lease bookkeeping (blocking Dynamo calls, run off the loop) ——
+    def _claim(self) -> None:
+        quota = math.ceil(SYNC_SHARDS / self.fleet)
+
+        self._heartbeat_once()                          # renew / drop what we hold
+        candidates = [i for i in range(SYNC_SHARDS) if i not in self.owned]
+        random.shuffle(candidates)                      # spread contention
+        for shard in candidates:
+            if len(self.owned) >= quota:
+                break
+            if acquire_lease(_lease_key(shard), self.id, self.ttl):
+                self.owned.add(shard)
+
+    def _heartbeat_once(self) -> None:
+        for shard in list(self.owned):
+            if not acquire_lease(_lease_key(shard), self.id, self.ttl):
+                log.warning("Lost lease on shard %s", shard)
+                self.owned.discard(shard)
+
+    def _release_all(self) -> None:
+        for shard in list(self.owned):
+            release_lease(_lease_key(shard), self.id)
+        self.owned.clear()
+
+    # —— async loop ————————————————————————————————————————
+    async def _heartbeat(self) -> None:
+        """Renew leases every ttl/3 and re-balance shards every POLL_SEC."""
+        next_claim = time.monotonic() + scheduler.POLL_SEC
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() >= next_claim:
+                    await asyncio.to_thread(self._claim)
+                    next_claim = time.monotonic() + scheduler.POLL_SEC
+                else:
+                    await asyncio.to_thread(self._heartbeat_once)
+            except Exception as exc:
+                log.warning("Lease renewal failed: %s", exc)
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.ttl / 3)
+            except asyncio.TimeoutError:
+                pass
+
+    def _targets(self):
+        return scheduler.all_targets(sorted(self.owned.copy()))
+
+    async def run(self) -> None:
+        await asyncio.to_thread(self._claim)
+        log.info("%s holds shards %s", self.id, sorted(self.owned))
+        hb = asyncio.create_task(self._heartbeat())
+        enrich = asyncio.create_task(run_enrichment(self._stop))   # threads we ingest
+        try:
+            await scheduler.run_schedule(self._targets, self._stop)
+        finally:
+            self._stop.set()
+            hb.cancel()
+            await enrich
+            await asyncio.to_thread(self._release_all)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Triagely Gmail sync worker")
+    ap.add_argument("--workers", type=int, default=int(os.getenv("SYNC_WORKERS", "1")),
+                    help="number of workers in the fleet (for fair-share balancing)")
+    ap.add_argument("--id", default=os.getenv("SYNC_WORKER_ID")
+                    or f"{socket.gethostname()}-{os.getpid()}")
+    args = ap.parse_args()
+    os.environ.setdefault("SEARCH_INDEX", "off")    # the API hosts index via search.catch_up
+
+    logging.basicConfig(
+        level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO),
+        format="%(asctime)s  %(levelname)s  %(name)s: %(message)s",
+    )
+
+    async def _run():
+        w = Worker(args.id, args.workers)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, w.stop)
+        log.info("Worker %s starting (fleet of %s)", w.id, w.fleet)
+        await w.run()
+
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
 from dotenv import load_dotenv           #  add
 
-import os, time, requests
+import asyncio, hashlib, os, time
+from collections import OrderedDict
+import httpx
 from jose import jwt, JWTError
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
-load_dotenv()  
+load_dotenv()
 
 REGION      = os.getenv("AWS_REGION")
 POOL_ID     = os.getenv("COG_USER_POOL_ID")
@@ -13,49 +15,126 @@ CLIENT_ID   = os.getenv("COG_APP_CLIENT_ID")
 
 _ISSUER = f"https://cognito-idp.{REGION}.amazonaws.com/{POOL_ID}"
 _JWKS_URL = f"{_ISSUER}/.well-known/jwks.json"
-_cache, _ts, _ttl = None, 0, 60 * 60 * 6  # 6 h
 
-def _jwks():
-    global _cache, _ts
-    if not _cache or time.time() - _ts > _ttl:
-        _cache = requests.get(_JWKS_URL, timeout=5).json()["keys"]
+# ───────── JWKS: async fetch, refresh-ahead, coalesced refetch ─────────
+_ttl          = 60 * 60 * 6     # 6 h
+_refresh_ahead = 60 * 30        # start a background refetch 30 min before expiry
+_min_refetch  = 60              # unknown kid → at most one refetch per minute
+
+_keys: dict[str, dict] = {}     # kid → JWK
+_ts         = 0.0
+_jwks_lock  = asyncio.Lock()
+_bg_refresh: asyncio.Task | None = None
+_http: httpx.AsyncClient | None = None
+
+
+async def _fetch_jwks(min_age: float = 0.0) -> None:
+    """Refetch the key set unless someone else did so within ``min_age`` s."""
+    global _keys, _ts, _http
+    async with _jwks_lock:                      # concurrent callers share one fetch
+        if _keys and time.time() - _ts < min_age:
+            return
+        if _http is None:
+            _http = httpx.AsyncClient(timeout=5)
+        res = await _http.get(_JWKS_URL)
+        res.raise_for_status()
+        _keys = {k["kid"]: k for k in res.json()["keys"]}
         _ts = time.time()
-    return _cache
 
-def verify(token: str) -> dict:
-    try:
-        kid = jwt.get_unverified_header(token)["kid"]
-        key = next(k for k in _jwks() if k["kid"] == kid)
-
-        claims: dict = jwt.decode(
-            token,
-            key,
-            algorithms=["RS256"],
-            audience=CLIENT_ID,
-            issuer=_ISSUER,
-        )
 
-        # ▸▸▸ Normalise the user’s “username” so the frontend
-        # can rely on claims['username'] always existing.
-        username = (
-            claims.get("custom:username")               # if you stored it as a custom attribute
-            or claims.get("preferred_username")
-            or claims.get("cognito:username")
-            or claims.get("username")
-            or claims.get("name")
-            or claims.get("email", "").split("@")[0]    # fallback: left-hand side of the email
-        )
-        claims["username"] = username
+async def _jwk(kid: str) -> dict | None:
+    global _bg_refresh
+    age = time.time() - _ts
+    if not _keys or age > _ttl:
+        await _fetch_jwks(min_age=_ttl)         # cold / expired: must wait
+    elif age > _ttl - _refresh_ahead and (_bg_refresh is None or _bg_refresh.done()):
+        _bg_refresh = asyncio.create_task(_fetch_jwks(min_age=_ttl - _refresh_ahead))
+
+    if kid not in _keys:                        # key rotation: one shared refetch
+        await _fetch_jwks(min_age=_min_refetch)
+    return _keys.get(kid)
+
+
+# ───────── verified-claims cache (keyed by token digest, dies at exp) ──
+_CLAIMS_MAX = int(os.getenv("AUTH_CLAIMS_CACHE", "10000"))
+_claims: "OrderedDict[bytes, dict]" = OrderedDict()
+
 
-        return claims
+def _cached_claims(digest: bytes) -> dict | None:
+    claims = _claims.get(digest)
+    if claims is None:
+        return None
+    if claims.get("exp", 0) <= time.time():
+        del _claims[digest]
+        return None
+    _claims.move_to_end(digest)
+    return claims
 
-    except (StopIteration, JWTError):
+
+def _remember(digest: bytes, claims: dict) -> None:
+    _claims[digest] = claims
+    while len(_claims) > _CLAIMS_MAX:
+        _claims.popitem(last=False)
+
+
+def _decode(token: str, key: dict) -> dict:
+    claims: dict = jwt.decode(
+        token,
+        key,
+        algorithms=["RS256"],
+        audience=CLIENT_ID,
+        issuer=_ISSUER,
+    )
+
+    # ▸▸▸ Normalise the user’s “username” so the frontend
+    # can rely on claims['username'] always existing.
+    username = (
+        claims.get("custom:username")               # if you stored it as a custom attribute
+        or claims.get("preferred_username")
+        or claims.get("cognito:username")
+        or claims.get("username")
+        or claims.get("name")
+        or claims.get("email", "").split("@")[0]    # fallback: left-hand side of the email
+    )
+    claims["username"] = username
+    return claims
+
+
+async def verify(token: str) -> dict:
+    digest = hashlib.sha256(token.encode()).digest()
+    if (claims := _cached_claims(digest)) is not None:
+        return dict(claims)
+    try:
+        kid = jwt.get_unverified_header(token)["kid"]
+        key = await _jwk(kid)
+        if key is None:
+            raise JWTError(f"unknown kid {kid}")
+        claims = _decode(token, key)
+    except httpx.HTTPError:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "Auth keys unavailable")
+    except (KeyError, JWTError):
         raise HTTPException(
             status.HTTP_401_UNAUTHORIZED,
             "Invalid or expired token",
         )
+    _remember(digest, claims)
+    return dict(claims)
+
+
+def verify_sync(token: str) -> dict:
+    """Blocking wrapper for scripts / Lambdas that have no event loop."""
+    async def _run() -> dict:
+        global _http
+        try:
+            return await verify(token)
+        finally:                                # the client is tied to this loop
+            if _http is not None:
+                await _http.aclose()
+                _http = None
+    return asyncio.run(_run())
+
 
 security = HTTPBearer()
 
 async def current_user(creds: HTTPAuthorizationCredentials = Depends(security)):
-    return verify(creds.credentials)
+    return await verify(creds.credentials)
@@ -0,0 +1,111 @@
+"""
+Message body storage.
+
+Thread bodies (plain + html) are zlib-compressed JSON.  Small ones stay in
+the triagely-messages row as a Binary ``bodyZ`` attribute; anything larger
+than BODY_INLINE_MAX goes to a blob store and the row keeps ``bodyRef``
+(content-addressed, so rewrites of an unchanged body are free):
+
+    BODY_STORE=s3://bucket/prefix        S3 or any S3-compatible endpoint
+                                         (S3_ENDPOINT=http://minio:9000)
+    BODY_STORE=file:///var/triagely      local filesystem (dev / tests)
+
+Rows written before this module keep their inline ``plain`` / ``html`` and
+are read as-is.  ``load`` caches decoded bodies in a small LRU.
+"""
+from __future__ import annotations
+import hashlib, json, os, threading, zlib
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import urlparse
+
+INLINE_MAX  = int(os.getenv("BODY_INLINE_MAX", str(32 * 1024)))   # compressed bytes
+CACHE_ITEMS = int(os.getenv("BODY_CACHE_ITEMS", "512"))
+
+
+class LocalBlobs:
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self.root / key
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)                       # atomic: readers never see half a file
+
+    def get(self, key: str) -> bytes:
+        return (self.root / key).read_bytes()
+
+
+class S3Blobs:
+    def __init__(self, bucket: str, prefix: str = ""):
+        import boto3
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.s3 = boto3.client(
+            "s3",
+            region_name=os.getenv("AWS_REGION"),
+            endpoint_url=os.getenv("S3_ENDPOINT") or None,
+        )
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key: str, data: bytes) -> None:
+        self.s3.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def get(self, key: str) -> bytes:
+        return self.s3.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+
+
+def _from_url(url: str):
+    u = urlparse(url)
+    if u.scheme == "s3":
+        return S3Blobs(u.netloc, u.path)
+    if u.scheme in ("file", ""):
+        return LocalBlobs(u.netloc + u.path)        # file://rel/dir or file:///abs/dir
+    raise ValueError(f"Unsupported BODY_STORE {url!r}")
+
+
+blobs = _from_url(os.getenv("BODY_STORE", "file://.bodies"))
+
+_cache: "OrderedDict[tuple, tuple[str, str]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def pack(uid: str, plain: str, html: str) -> dict:
+    """Row attributes holding ``plain`` / ``html`` (inline or a blob pointer)."""
+    blob = zlib.compress(json.dumps({"plain": plain, "html": html}).encode(), 6)
+    if len(blob) <= INLINE_MAX:
+        return {"bodyZ": blob}
+    ref = f"{uid}/{hashlib.sha256(blob).hexdigest()}.json.z"
+    blobs.put(ref, blob)
+    return {"bodyRef": ref}
+
+
+def _unpack(blob) -> tuple[str, str]:
+    raw = getattr(blob, "value", blob)          # boto3 hands back Binary
+    data = json.loads(zlib.decompress(bytes(raw)))
+    return data.get("plain", ""), data.get("html", "")
+
+
+def load(item: dict) -> tuple[str, str]:
+    """(plain, html) for a triagely-messages row, whichever way it is stored."""
+    if "bodyZ" not in item and "bodyRef" not in item:
+        return item.get("plain") or "", item.get("html") or ""    # legacy inline row
+
+    key = (item["UserID"], item["MessageID"], item.get("dateKey"), item.get("bodyRef"))
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    body = _unpack(item["bodyZ"]) if "bodyZ" in item else _unpack(blobs.get(item["bodyRef"]))
+    with _cache_lock:
+        _cache[key] = body
+        while len(_cache) > CACHE_ITEMS:
+            _cache.popitem(last=False)
+    return body
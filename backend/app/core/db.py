@@ -3,33 +3,202 @@ Low-level Dynamo helpers shared by every integration.
 Tables:
 
     triagely-oauth     PK = UserID   SK = gmail:<addr> | slack | …
+                       historyId = Gmail sync cursor (gmail rows only)
+                       GSI sync-targets  PK = SyncShard  (sparse, see below)
     triagely-messages  PK = UserID   SK = MessageID
+                       GSI by-date  PK = Feed (<UserID>#gmail | …)  SK = dateKey
+                       (UTC ISO of the newest message → true newest-first paging)
+    triagely-sync-leases  PK = Account (shard:<provider>#<nn>)
+                       owner, expires_at = which sync worker polls it
+
+Set DYNAMODB_ENDPOINT to point at DynamoDB Local (see app.core.schema).
 """
 from __future__ import annotations
-import os, time, json, boto3
+import os, time, json, zlib, boto3, datetime as dt, email.utils
+from typing import Iterable, Iterator
+from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key, Attr
 
 REGION = os.getenv("AWS_REGION")
-ddb    = boto3.resource("dynamodb", region_name=REGION)
+ddb    = boto3.resource(
+    "dynamodb", region_name=REGION, endpoint_url=os.getenv("DYNAMODB_ENDPOINT") or None
+)
 t_oauth = ddb.Table("triagely-oauth")
 t_msg   = ddb.Table("triagely-messages")
+t_lease = ddb.Table("triagely-sync-leases")
+
+SYNC_INDEX      = "sync-targets"
+DATE_INDEX      = "by-date"
+TEAM_INDEX      = "slack-teams"
+ADDRESS_INDEX   = "gmail-address"
+SYNC_SHARDS     = int(os.getenv("SYNC_SHARDS", "16"))
+SYNC_PROVIDERS  = {"gmail", "slack"}
+
+BATCH_GET_MAX   = 100          # DynamoDB hard limits per request
+BATCH_WRITE_MAX = 25
+BATCH_RETRIES   = 8
 
 # ───────────────────────────── OAuth rows ──────────────────────────────
 def save_token(uid: str, provider_key: str, token: dict | str) -> None:
     """provider_key examples →  gmail:karthik@x.com   |   slack"""
-    t_oauth.put_item(
-        Item={
-            "UserID":       uid,
-            "Provider":     provider_key,
-            "token":        json.dumps(token) if isinstance(token, dict) else token,
-            "connected_at": int(time.time()),
-        }
-    )
+    item = {
+        "UserID":       uid,
+        "Provider":     provider_key,
+        "token":        json.dumps(token) if isinstance(token, dict) else token,
+        "connected_at": int(time.time()),
+    }
+    provider = provider_key.split(":")[0]
+    if provider in SYNC_PROVIDERS:                    # (re)connect → active sync target
+        item["SyncShard"]  = _shard_key(provider, shard_of(uid, provider_key))
+        item["SyncStatus"] = "active"
+    if provider == "slack" and (team := _slack_team(item["token"])):
+        item["SlackTeam"] = team                      # Events API → UserID lookup
+    if provider == "gmail" and ":" in provider_key:
+        item["GmailAddress"] = provider_key.split(":", 1)[1].lower()   # push → UserID
+    t_oauth.put_item(Item=item)
+    from app.core import httpcache
+    httpcache.invalidate(uid, "accounts")
 
 def get_token(uid: str, provider_key: str) -> dict | None:
     res = t_oauth.get_item(Key={"UserID": uid, "Provider": provider_key})
     return json.loads(res["Item"]["token"]) if "Item" in res else None
 
+def save_sync_cursor(uid: str, provider_key: str, history_id: str) -> None:
+    """Remember the Gmail ``historyId`` the next incremental sync starts from."""
+    t_oauth.update_item(
+        Key={"UserID": uid, "Provider": provider_key},
+        UpdateExpression="SET historyId = :h",
+        ExpressionAttributeValues={":h": str(history_id)},
+    )
+
+def save_watch(uid: str, provider_key: str, expiration_ms: int) -> None:
+    """When the mailbox's Gmail ``users.watch`` lapses (epoch milliseconds)."""
+    t_oauth.update_item(
+        Key={"UserID": uid, "Provider": provider_key},
+        UpdateExpression="SET watchExpiration = :e",
+        ExpressionAttributeValues={":e": int(expiration_ms)},
+    )
+
+def gmail_accounts_for(address: str) -> list[tuple[str, str]]:
+    """(UserID, ProviderKey) of every user who connected the mailbox ``address``."""
+    args: dict = {"IndexName": ADDRESS_INDEX,
+                  "KeyConditionExpression": Key("GmailAddress").eq(address.lower())}
+    out: list[tuple[str, str]] = []
+    while True:
+        page = t_oauth.query(**args)
+        out.extend((i["UserID"], i["Provider"]) for i in page.get("Items", []))
+        if not (start := page.get("LastEvaluatedKey")):
+            return out
+        args["ExclusiveStartKey"] = start
+
+def backfill_gmail_addresses() -> int:
+    """One-off: set GmailAddress on gmail:<addr> rows written before the index existed."""
+    done, args = 0, {
+        "ProjectionExpression": "UserID, Provider",
+        "FilterExpression": Attr("Provider").begins_with("gmail:")
+                            & Attr("GmailAddress").not_exists(),
+    }
+    while True:
+        page = t_oauth.scan(**args)
+        for i in page.get("Items", []):
+            t_oauth.update_item(
+                Key={"UserID": i["UserID"], "Provider": i["Provider"]},
+                UpdateExpression="SET GmailAddress = :a",
+                ExpressionAttributeValues={":a": i["Provider"].split(":", 1)[1].lower()},
+            )
+            done += 1
+        if not (start := page.get("LastEvaluatedKey")):
+            return done
+        args["ExclusiveStartKey"] = start
+
+# ───────────────────────────── Slack rows ──────────────────────────────
+def _slack_team(token: str) -> str | None:
+    try:
+        return json.loads(token).get("team", {}).get("id")
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+def init_slack_watermarks(uid: str) -> None:
+    """Create the (empty) per-channel watermark / name maps on the slack row."""
+    t_oauth.update_item(
+        Key={"UserID": uid, "Provider": "slack"},
+        UpdateExpression="SET channelOldest = if_not_exists(channelOldest, :empty), "
+                         "channelNames = if_not_exists(channelNames, :empty)",
+        ExpressionAttributeValues={":empty": {}},
+    )
+
+def save_slack_watermark(uid: str, channel: str, ts: str, name: str | None = None) -> None:
+    """Newest Slack ``ts`` synced for ``channel`` (next sync reads after it)."""
+    t_oauth.update_item(
+        Key={"UserID": uid, "Provider": "slack"},
+        UpdateExpression="SET channelOldest.#c = :ts, channelNames.#c = :n",
+        ExpressionAttributeNames={"#c": channel},
+        ExpressionAttributeValues={":ts": ts, ":n": name or channel},
+    )
+
+def save_slack_resume(uid: str, channel: str | None) -> None:
+    """Channel the next Slack sync starts from (None → from the top)."""
+    t_oauth.update_item(
+        Key={"UserID": uid, "Provider": "slack"},
+        **({"UpdateExpression": "SET syncFrom = :c", "ExpressionAttributeValues": {":c": channel}}
+           if channel else {"UpdateExpression": "REMOVE syncFrom"}),
+    )
+
+def slack_channels(uid: str) -> dict[str, str]:
+    """``{channel_id: name}`` of every channel the user's Slack sync covers."""
+    row = t_oauth.get_item(
+        Key={"UserID": uid, "Provider": "slack"},
+        ProjectionExpression="channelOldest, channelNames",
+    ).get("Item") or {}
+    names = row.get("channelNames") or {}
+    return {ch: names.get(ch, ch) for ch in row.get("channelOldest") or {}}
+
+def slack_team_members(team_id: str) -> list[dict]:
+    """Slack rows (UserID, channelOldest, channelNames) connected to ``team_id``."""
+    args: dict = {"IndexName": TEAM_INDEX, "KeyConditionExpression": Key("SlackTeam").eq(team_id)}
+    out: list[dict] = []
+    while True:
+        page = t_oauth.query(**args)
+        out.extend(page.get("Items", []))
+        if not (start := page.get("LastEvaluatedKey")):
+            return out
+        args["ExclusiveStartKey"] = start
+
+def backfill_slack_teams() -> int:
+    """One-off: set SlackTeam on slack rows written before the index existed."""
+    done, args = 0, {
+        "ProjectionExpression": "UserID, Provider, #t",
+        "ExpressionAttributeNames": {"#t": "token"},
+        "FilterExpression": Attr("Provider").eq("slack") & Attr("SlackTeam").not_exists(),
+    }
+    while True:
+        page = t_oauth.scan(**args)
+        for i in page.get("Items", []):
+            if team := _slack_team(i.get("token")):
+                t_oauth.update_item(
+                    Key={"UserID": i["UserID"], "Provider": "slack"},
+                    UpdateExpression="SET SlackTeam = :t",
+                    ExpressionAttributeValues={":t": team},
+                )
+                done += 1
+        if not (start := page.get("LastEvaluatedKey")):
+            return done
+        args["ExclusiveStartKey"] = start
+
+RULES_PROVIDER = "triage-rules"        # per-user urgency rules (app.nlp.rules)
+
+def get_triage_rules(uid: str) -> dict | None:
+    res = t_oauth.get_item(Key={"UserID": uid, "Provider": RULES_PROVIDER})
+    return json.loads(res["Item"]["rules"]) if "Item" in res else None
+
+def save_triage_rules(uid: str, rules: dict) -> None:
+    t_oauth.put_item(Item={
+        "UserID":     uid,
+        "Provider":   RULES_PROVIDER,
+        "rules":      json.dumps(rules),
+        "updated_at": int(time.time()),
+    })
+
 def list_gmail_tokens(uid: str) -> list[dict]:
     """
     All Gmail rows for **one** user.
@@ -42,40 +211,301 @@ def list_gmail_tokens(uid: str) -> list[dict]:
     return res.get("Items", [])
 
 
-def all_gmail_tokens() -> list[tuple[str, str]]:
+# ───────────────────────────── Sync registry ───────────────────────────
+# Every syncable row carries  SyncShard = "<provider>#<nn>"  and  SyncStatus.
+# SyncShard is the partition key of the sparse GSI  sync-targets, so the
+# poller reads only the shards it owns and disconnected rows (no SyncShard)
+# never cost a read.
+def shard_of(uid: str, provider_key: str) -> int:
+    return zlib.crc32(f"{uid}|{provider_key}".encode()) % SYNC_SHARDS
+
+def _shard_key(provider: str, shard: int) -> str:
+    return f"{provider}#{shard:02d}"
+
+def set_sync_status(uid: str, provider_key: str, status: str) -> None:
     """
-    Every Gmail row in the whole table.
-    Returns  [(UserID, ProviderKey), …]
+    ``active`` / ``error`` / ``reauth`` keep the row in the registry;
+    ``disabled`` drops it out of the index altogether.
     """
-    out, start_key = [], None
-    while True:
-        scan_args = {
-            "ProjectionExpression": "UserID, Provider",
-            "FilterExpression":     Key("Provider").begins_with("gmail:"),  # SK prefix
+    if status == "disabled":
+        update = "SET SyncStatus = :s REMOVE SyncShard"
+        values = {":s": status}
+    else:
+        update = "SET SyncStatus = :s, SyncShard = :k"
+        values = {":s": status,
+                  ":k": _shard_key(provider_key.split(":")[0], shard_of(uid, provider_key))}
+    t_oauth.update_item(
+        Key={"UserID": uid, "Provider": provider_key},
+        UpdateExpression=update,
+        ExpressionAttributeValues=values,
+    )
+
+def iter_sync_targets(
+    provider: str = "gmail",
+    shards: Iterable[int] | None = None,
+    status: str | None = "active",
+) -> Iterator[tuple[str, str]]:
+    """
+    Stream  (UserID, ProviderKey)  for every registered account of
+    ``provider`` in ``shards`` (default: all), one GSI page at a time.
+    """
+    for shard in (range(SYNC_SHARDS) if shards is None else shards):
+        args: dict = {
+            "IndexName":              SYNC_INDEX,
+            "KeyConditionExpression": Key("SyncShard").eq(_shard_key(provider, shard)),
         }
-        if start_key:                            # ← only present after 1st page
-            scan_args["ExclusiveStartKey"] = start_key
-        page = t_oauth.scan(**scan_args)
-        out.extend((i["UserID"], i["Provider"]) for i in page.get("Items", []))
-        start_key = page.get("LastEvaluatedKey")
-        if not start_key:
-            break
-    return out
+        if status:
+            args["FilterExpression"] = Attr("SyncStatus").eq(status)
+        while True:
+            page = t_oauth.query(**args)
+            for i in page.get("Items", []):
+                yield i["UserID"], i["Provider"]
+            if not (start := page.get("LastEvaluatedKey")):
+                break
+            args["ExclusiveStartKey"] = start
+
+def backfill_sync_registry() -> int:
+    """One-off: register token rows written before the registry existed."""
+    done, args = 0, {
+        "ProjectionExpression": "UserID, Provider",
+        "FilterExpression":     Attr("SyncShard").not_exists(),
+    }
+    while True:
+        page = t_oauth.scan(**args)
+        for i in page.get("Items", []):
+            if i["Provider"].split(":")[0] in SYNC_PROVIDERS:
+                set_sync_status(i["UserID"], i["Provider"], "active")
+                done += 1
+        if not (start := page.get("LastEvaluatedKey")):
+            return done
+        args["ExclusiveStartKey"] = start
 
 # ───────────────────────────── Messages table ──────────────────────────
-def put_msg(uid: str, msg_id: str, body: dict) -> None:
+def _chunks(seq: list, n: int):
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
+
+def _projection(fields: str) -> dict:
+    """ "a, b" → ProjectionExpression with placeholders (dodges reserved words)."""
+    names = {f"#f{i}": f.strip() for i, f in enumerate(fields.split(","))}
+    return {"ProjectionExpression": ", ".join(names), "ExpressionAttributeNames": names}
+
+def _backoff(attempt: int) -> None:
+    time.sleep(min(0.05 * 2 ** attempt, 2.0))
+
+def date_key(iso: str | None) -> str:
+    """Any ISO-8601 timestamp → fixed-width UTC string that sorts by time."""
+    try:
+        d = dt.datetime.fromisoformat(iso)
+        if d.tzinfo is None:                     # naive values are UTC already
+            d = d.replace(tzinfo=dt.timezone.utc)
+        return d.astimezone(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    except (TypeError, ValueError):
+        return "0000-00-00T00:00:00Z"           # undated rows sort last
+
+def _msg_item(uid: str, msg_id: str, body: dict, source: str) -> dict:
+    """Full row incl. the by-date index keys."""
+    item = {"UserID": uid, "MessageID": msg_id, **body}
+    item.setdefault("Feed", f"{uid}#{source}")
+    item.setdefault("dateKey", date_key(body.get("dateISO")))
+    return item
+
+def _index(items: list[dict]) -> None:
+    """Mirror freshly written rows into the search index and stale cached lists."""
+    if items:
+        from app.core import httpcache
+        from app.search import index                  # lazy: keeps db import-light
+        index.index_items(items[0]["UserID"], items)
+        httpcache.invalidate(items[0]["UserID"], "messages")
+
+def put_msg(uid: str, msg_id: str, body: dict, source: str = "gmail") -> bool:
     """
     Write exactly once: the ConditionExpression guarantees we never
     create a duplicate row for the same (UserID , MessageID).
+    Returns True if the row was inserted, False if it already existed.
+    """
+    item = _msg_item(uid, msg_id, body, source)
+    try:
+        t_msg.put_item(
+            Item=item,
+            ConditionExpression="attribute_not_exists(MessageID)",   # 👈 NEW
+        )
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
+    _index([item])
+    return True
+
+def get_msgs(uid: str, msg_ids: Iterable[str], fields: str | None = None) -> dict[str, dict]:
+    """
+    ``{MessageID: item}`` for those of ``msg_ids`` that are cached.
+    One BatchGetItem per 100 keys; unprocessed keys are retried.
+    ``fields`` is an optional comma-separated projection.
     """
-    t_msg.put_item(
-        Item={"UserID": uid, "MessageID": msg_id, **body},
-        ConditionExpression="attribute_not_exists(MessageID)",   # 👈 NEW
+    found: dict[str, dict] = {}
+    for chunk in _chunks(list(dict.fromkeys(msg_ids)), BATCH_GET_MAX):
+        spec: dict = {"Keys": [{"UserID": uid, "MessageID": m} for m in chunk]}
+        if fields:
+            spec.update(_projection(fields))
+        req = {t_msg.name: spec}
+        for attempt in range(BATCH_RETRIES):
+            res = ddb.batch_get_item(RequestItems=req)
+            found.update((i["MessageID"], i) for i in res["Responses"].get(t_msg.name, []))
+            req = res.get("UnprocessedKeys") or {}
+            if not req:
+                break
+            _backoff(attempt)
+        else:
+            raise RuntimeError(f"BatchGetItem left {len(req[t_msg.name]['Keys'])} keys unprocessed")
+    return found
+
+def existing_msg_ids(uid: str, msg_ids: Iterable[str]) -> set[str]:
+    """Which of ``msg_ids`` are already cached for ``uid``."""
+    return set(get_msgs(uid, msg_ids, "MessageID"))
+
+def put_msgs(uid: str, rows: dict[str, dict], source: str = "gmail") -> int:
+    """
+    Bulk write ``{MessageID: body}`` with BatchWriteItem (25 per request),
+    retrying unprocessed items.  Rows are written unconditionally, so
+    callers dedup with ``existing_msg_ids`` first.  ``source`` picks the
+    by-date feed unless a body sets ``Feed`` itself.
+    Rows are mirrored into the search index once written.
+    Returns the number of rows written.
+    """
+    written = 0
+    items = [_msg_item(uid, k, v, source) for k, v in rows.items()]
+    for chunk in _chunks(items, BATCH_WRITE_MAX):
+        pending = [{"PutRequest": {"Item": i}} for i in chunk]
+        for attempt in range(BATCH_RETRIES):
+            res = ddb.batch_write_item(RequestItems={t_msg.name: pending})
+            left = res.get("UnprocessedItems", {}).get(t_msg.name, [])
+            written += len(pending) - len(left)
+            pending = left
+            if not pending:
+                break
+            _backoff(attempt)
+        else:
+            raise RuntimeError(f"BatchWriteItem left {len(pending)} items unprocessed")
+    _index(items)
+    return written
+
+# envelope only – what a list view needs, without the plain / html bodies
+ENVELOPE_FIELDS = "MessageID, subject, snippet, sender, dateISO, urgent"
+LIST_FIELDS     = {"subject", "snippet", "sender", "dateISO", "urgent"}
+
+def page_msgs(
+    uid: str,
+    limit: int = 50,
+    start_key: dict | None = None,
+    fields: str | None = ENVELOPE_FIELDS,
+    source: str = "gmail",
+    until: str | None = None,
+) -> tuple[list[dict], dict | None]:
+    """
+    One newest-first page of a user's ``source`` feed, served by the
+    by-date index → (items, LastEvaluatedKey or None).  ``until`` (a
+    dateKey, inclusive) starts the page at that time instead of the top.
+    """
+    cond = Key("Feed").eq(f"{uid}#{source}")
+    if until:
+        cond &= Key("dateKey").lte(until)
+    args: dict = {
+        "IndexName":              DATE_INDEX,
+        "KeyConditionExpression": cond,
+        "Limit":                  limit,
+        "ScanIndexForward":       False,
+    }
+    if fields:
+        args.update(_projection(fields))
+    if start_key:
+        args["ExclusiveStartKey"] = start_key
+    res = t_msg.query(**args)
+    return res.get("Items", []), res.get("LastEvaluatedKey")
+
+def get_msg(uid: str, msg_id: str) -> dict | None:
+    return t_msg.get_item(Key={"UserID": uid, "MessageID": msg_id}).get("Item")
+
+def update_msg(uid: str, msg_id: str, fields: dict) -> None:
+    """SET a few attributes on an existing row (never creates one)."""
+    names = {f"#a{i}": k for i, k in enumerate(fields)}
+    t_msg.update_item(
+        Key={"UserID": uid, "MessageID": msg_id},
+        UpdateExpression="SET " + ", ".join(f"{n} = :v{i}" for i, n in enumerate(names)),
+        ConditionExpression="attribute_exists(MessageID)",
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues={f":v{i}": v for i, v in enumerate(fields.values())},
     )
+    if LIST_FIELDS & fields.keys():                   # e.g. enrichment flips ``urgent``
+        from app.core import httpcache
+        httpcache.invalidate(uid, "messages")
+
+def _legacy_date(item: dict) -> str | None:
+    """dateISO for rows written before it existed (Date header in ``raw``)."""
+    try:
+        thread = json.loads(item.get("raw", "{}"))
+        first  = (thread.get("messages") or [thread])[0]
+        for h in first.get("payload", {}).get("headers", []):
+            if h["name"].lower() == "date":
+                return email.utils.parsedate_to_datetime(h["value"]).isoformat()
+    except Exception:
+        pass
+    return None
+
+def backfill_date_index() -> int:
+    """One-off: add Feed / dateKey to rows that predate the by-date index."""
+    done, args = 0, {"FilterExpression": Attr("dateKey").not_exists()}
+    while True:
+        page = t_msg.scan(**args)
+        for i in page.get("Items", []):
+            iso = i.get("dateISO") or _legacy_date(i)
+            source = "slack" if i["MessageID"].startswith("slack-") else "gmail"
+            update, values = "SET Feed = :f, dateKey = :d", {
+                ":f": f"{i['UserID']}#{source}", ":d": date_key(iso),
+            }
+            if iso and not i.get("dateISO"):
+                update += ", dateISO = :i"
+                values[":i"] = iso
+            t_msg.update_item(
+                Key={"UserID": i["UserID"], "MessageID": i["MessageID"]},
+                UpdateExpression=update,
+                ExpressionAttributeValues=values,
+            )
+            done += 1
+        if not (start := page.get("LastEvaluatedKey")):
+            return done
+        args["ExclusiveStartKey"] = start
+
+# ───────────────────────────── Sync leases ─────────────────────────────
+def acquire_lease(account: str, owner: str, ttl: int) -> bool:
+    """
+    Take or renew the lease on one account (or shard) for ``ttl`` seconds.
+    Succeeds if the lease is free, already ours, or expired (dead owner).
+    """
+    now = int(time.time())
+    try:
+        t_lease.update_item(
+            Key={"Account": account},
+            UpdateExpression="SET #o = :me, expires_at = :exp, heartbeat = :now",
+            ConditionExpression="attribute_not_exists(#o) OR #o = :me OR expires_at < :now",
+            ExpressionAttributeNames={"#o": "owner"},
+            ExpressionAttributeValues={":me": owner, ":exp": now + ttl, ":now": now},
+        )
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
+    return True
 
-def list_msgs(uid: str, limit: int = 50) -> list[dict]:
-    return t_msg.query(
-        KeyConditionExpression=Key("UserID").eq(uid),
-        Limit=limit,
-        ScanIndexForward=False,       # newest-first
-    )["Items"]
\ No newline at end of file
+def release_lease(account: str, owner: str) -> None:
+    """Give an account back (only if we still own it)."""
+    try:
+        t_lease.delete_item(
+            Key={"Account": account},
+            ConditionExpression="#o = :me",
+            ExpressionAttributeNames={"#o": "owner"},
+            ExpressionAttributeValues={":me": owner},
+        )
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
@@ -0,0 +1,153 @@
+"""
+Per-user response cache for the list / account endpoints.
+
+``cached_json`` serves a route from an in-process cache of its serialised
+JSON body (plus headers such as X-Next-Cursor), keyed by user, scope and
+query.  Every response carries a weak ETag (hash of the body); a request
+whose If-None-Match matches gets ``304 Not Modified`` without a body.
+
+Scopes are invalidated precisely by the writes that change them:
+
+    "messages"   db.put_msg / put_msgs, and update_msg of list-visible fields
+    "accounts"   db.save_token
+
+Writes made by another process (standalone sync workers) are not seen
+here, so entries also expire after RESPONSE_CACHE_TTL seconds.  Memory is
+bounded by RESPONSE_CACHE_MB; least recently used bodies go first.
+Generations are kept for the RESPONSE_CACHE_GENS most recently
+invalidated scopes; when older ones are forgotten, every untracked scope
+moves to the newest forgotten generation (a one-off miss, never a stale hit).
+Bodies are serialised with orjson when it is installed.
+"""
+from __future__ import annotations
+import hashlib, json, os, threading, time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Callable
+
+try:
+    import orjson
+except ImportError:                                   # optional speed-up
+    orjson = None
+
+MAX_BYTES = int(float(os.getenv("RESPONSE_CACHE_MB", "64")) * 1024 * 1024)
+TTL       = float(os.getenv("RESPONSE_CACHE_TTL", "30"))
+GEN_MAX   = int(os.getenv("RESPONSE_CACHE_GENS", "65536"))
+
+
+def _default(obj: Any):
+    if isinstance(obj, Decimal):                      # boto3 numbers
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    raise TypeError(f"{type(obj).__name__} is not JSON serialisable")
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def etag(body: bytes) -> str:
+    return f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+class _Entry:
+    __slots__ = ("gen", "expires", "body", "etag", "headers")
+
+    def __init__(self, gen: int, body: bytes, headers: dict[str, str]):
+        self.gen, self.expires = gen, time.monotonic() + TTL
+        self.body, self.etag, self.headers = body, etag(body), headers
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int = MAX_BYTES, max_gens: int = GEN_MAX):
+        self.max_bytes = max_bytes
+        self.max_gens  = max_gens
+        self.size  = 0
+        self._data: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        self._gen: "OrderedDict[tuple[str, str], int]" = OrderedDict()  # (uid, scope) → generation
+        self._clock = 0                               # last generation handed out
+        self._floor = 0                               # generation of scopes not in _gen
+        self._lock = threading.Lock()
+
+    def _current(self, uid: str, scope: str) -> int:
+        return self._gen.get((uid, scope), self._floor)
+
+    def generation(self, uid: str, scope: str) -> int:
+        with self._lock:
+            return self._current(uid, scope)
+
+    def get(self, key: tuple) -> _Entry | None:
+        uid, scope = key[:2]
+        with self._lock:
+            e = self._data.get(key)
+            if e is None:
+                return None
+            if e.gen != self._current(uid, scope) or e.expires < time.monotonic():
+                self._drop(key)
+                return None
+            self._data.move_to_end(key)
+            return e
+
+    def put(self, key: tuple, gen: int, body: bytes, headers: dict[str, str]) -> _Entry:
+        e = _Entry(gen, body, headers)
+        if len(body) > self.max_bytes // 8:           # one page never crowds out the rest
+            return e
+        with self._lock:
+            if gen != self._current(*key[:2]):        # invalidated while it was built
+                return e
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = e
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self._data)))
+        return e
+
+    def _drop(self, key: tuple) -> None:
+        self.size -= len(self._data.pop(key).body)
+
+    def invalidate(self, uid: str, scope: str) -> None:
+        """Stale every cached response of ``uid`` in ``scope`` (entries go lazily)."""
+        with self._lock:
+            self._clock += 1
+            self._gen[(uid, scope)] = self._clock
+            self._gen.move_to_end((uid, scope))
+            if len(self._gen) > self.max_gens:        # forget the oldest quarter at once
+                for _ in range(max(1, self.max_gens // 4)):
+                    self._floor = max(self._floor, self._gen.popitem(last=False)[1])
+
+
+cache = ResponseCache()
+
+
+def invalidate(uid: str, scope: str) -> None:
+    cache.invalidate(uid, scope)
+
+
+async def cached_json(
+    request,
+    uid: str,
+    scope: str,
+    build: Callable[[], tuple[Any, dict[str, str]]],
+):
+    """
+    JSON response for ``request`` from the cache, or from ``build()`` (run
+    on the thread pool; returns ``(payload, extra headers)``) on a miss.
+    """
+    from fastapi.concurrency import run_in_threadpool
+    from fastapi.responses import Response
+
+    key = (uid, scope, request.url.path, str(request.query_params))
+    entry = cache.get(key)
+    if entry is None:
+        gen = cache.generation(uid, scope)
+        payload, headers = await run_in_threadpool(build)
+        entry = cache.put(key, gen, await run_in_threadpool(dumps, payload), headers)
+
+    headers = {**entry.headers, "ETag": entry.etag, "Cache-Control": "private, no-cache"}
+    if entry.etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
@@ -0,0 +1,127 @@
+"""
+Table definitions for the Dynamo tables in app.core.db.
+
+Production tables are managed outside this repo; this module exists so a
+local stand-in (DynamoDB Local, moto server) can be brought up with the
+same keys and indexes:
+
+    docker run -p 8001:8000 amazon/dynamodb-local
+    DYNAMODB_ENDPOINT=http://localhost:8001 python -m app.core.schema
+
+One-off migrations for rows that predate an index:
+
+    python -m app.core.schema backfill-registry         # sync-targets
+    python -m app.core.schema backfill-dates            # by-date
+    python -m app.core.schema backfill-slack-teams      # slack-teams
+    python -m app.core.schema backfill-gmail-addresses  # gmail-address
+"""
+from __future__ import annotations
+import sys
+from botocore.exceptions import ClientError
+from app.core.db import (
+    backfill_date_index, backfill_gmail_addresses, backfill_slack_teams, backfill_sync_registry, ddb,
+)
+
+TABLES: list[dict] = [
+    {
+        "TableName": "triagely-oauth",
+        "KeySchema": [
+            {"AttributeName": "UserID",   "KeyType": "HASH"},
+            {"AttributeName": "Provider", "KeyType": "RANGE"},
+        ],
+        "AttributeDefinitions": [
+            {"AttributeName": "UserID",       "AttributeType": "S"},
+            {"AttributeName": "Provider",     "AttributeType": "S"},
+            {"AttributeName": "SyncShard",    "AttributeType": "S"},
+            {"AttributeName": "SlackTeam",    "AttributeType": "S"},
+            {"AttributeName": "GmailAddress", "AttributeType": "S"},
+        ],
+        "GlobalSecondaryIndexes": [
+            {
+                "IndexName": "sync-targets",
+                "KeySchema": [
+                    {"AttributeName": "SyncShard", "KeyType": "HASH"},
+                    {"AttributeName": "UserID",    "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "INCLUDE",
+                               "NonKeyAttributes": ["SyncStatus"]},
+            },
+            {
+                # Events API: workspace → the users who connected it
+                "IndexName": "slack-teams",
+                "KeySchema": [
+                    {"AttributeName": "SlackTeam", "KeyType": "HASH"},
+                    {"AttributeName": "UserID",    "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "INCLUDE",
+                               "NonKeyAttributes": ["channelOldest", "channelNames"]},
+            },
+            {
+                # Gmail push notifications name a mailbox, not a user
+                "IndexName": "gmail-address",
+                "KeySchema": [
+                    {"AttributeName": "GmailAddress", "KeyType": "HASH"},
+                    {"AttributeName": "UserID",       "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "KEYS_ONLY"},
+            },
+        ],
+    },
+    {
+        "TableName": "triagely-messages",
+        "KeySchema": [
+            {"AttributeName": "UserID",    "KeyType": "HASH"},
+            {"AttributeName": "MessageID", "KeyType": "RANGE"},
+        ],
+        "AttributeDefinitions": [
+            {"AttributeName": "UserID",    "AttributeType": "S"},
+            {"AttributeName": "MessageID", "AttributeType": "S"},
+            {"AttributeName": "Feed",      "AttributeType": "S"},
+            {"AttributeName": "dateKey",   "AttributeType": "S"},
+        ],
+        "GlobalSecondaryIndexes": [
+            {
+                "IndexName": "by-date",
+                "KeySchema": [
+                    {"AttributeName": "Feed",    "KeyType": "HASH"},
+                    {"AttributeName": "dateKey", "KeyType": "RANGE"},
+                ],
+                # envelope only, so list pages never touch the bodies
+                "Projection": {"ProjectionType": "INCLUDE",
+                               "NonKeyAttributes": ["subject", "snippet", "sender",
+                                                    "dateISO", "urgent"]},
+            },
+        ],
+    },
+    {
+        "TableName": "triagely-sync-leases",
+        "KeySchema": [{"AttributeName": "Account", "KeyType": "HASH"}],
+        "AttributeDefinitions": [{"AttributeName": "Account", "AttributeType": "S"}],
+    },
+]
+
+
+def create_tables() -> list[str]:
+    """Create every missing table; returns the names that were created."""
+    made = []
+    for spec in TABLES:
+        try:
+            ddb.create_table(BillingMode="PAY_PER_REQUEST", **spec).wait_until_exists()
+            made.append(spec["TableName"])
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] != "ResourceInUseException":
+                raise
+    return made
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["backfill-registry"]:
+        print("registered:", backfill_sync_registry())
+    elif sys.argv[1:] == ["backfill-dates"]:
+        print("indexed:", backfill_date_index())
+    elif sys.argv[1:] == ["backfill-slack-teams"]:
+        print("indexed:", backfill_slack_teams())
+    elif sys.argv[1:] == ["backfill-gmail-addresses"]:
+        print("indexed:", backfill_gmail_addresses())
+    else:
+        print("created:", create_tables() or "nothing (all tables exist)")
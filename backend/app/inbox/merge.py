@@ -0,0 +1,121 @@
+"""
+Unified inbox: a lazy k-way merge over the user's by-date feeds.
+
+Every source is its own newest-first stream out of the by-date index –
+``gmail`` (all Gmail accounts of the user share that feed, already merged
+by the index) and ``slack:<channel>`` for each synced Slack channel.  The
+heads of the streams sit in a min-heap keyed on −time; popping the newest
+head and refilling from that stream yields the merged order.
+
+Streams are read on demand: the first query of each asks for a fair share
+of the page (limit / k + 1), later ones for just what the page still
+needs, so a page of ``limit`` rows costs about ``limit + k`` reads rather
+than ``limit × k``.
+
+The cursor records, per stream, the last row the page consumed (or that
+the stream is exhausted) plus the time of the last row returned, so one
+opaque string resumes every stream at once.  A stream nothing was taken
+from yet (or a newly synced channel) rejoins at that time, inclusive:
+dateKeys only have second resolution, and its rows sharing the last
+returned second must not be skipped – none of them was returned, so
+none is repeated.
+"""
+from __future__ import annotations
+import base64, heapq, json
+from collections import deque
+from typing import Iterable
+
+from app.core.db import page_msgs
+
+FIELDS = "MessageID, subject, snippet, sender, dateISO, urgent, Feed, dateKey"
+
+_TOP, _DONE = None, 0                           # cursor states besides a position
+
+
+def _order(item: dict) -> int:
+    """−seconds of a dateKey (``YYYY-MM-DDTHH:MM:SSZ``) – heap order = newest first."""
+    k = item.get("dateKey") or "0000-00-00T00:00:00Z"
+    return -int(k[0:4] + k[5:7] + k[8:10] + k[11:13] + k[14:16] + k[17:19])
+
+
+class Feed:
+    """One source's rows, newest first, fetched from the by-date index on demand."""
+
+    def __init__(self, uid: str, source: str, state=_TOP, until: str | None = None):
+        self.uid, self.source = uid, source
+        self.buf: deque[dict] = deque()
+        self.more   = state != _DONE
+        self.until  = until if state is _TOP else None
+        self.start  = self._key(*state) if isinstance(state, list) else None
+        self.state  = state                     # where the next page resumes
+
+    def _key(self, date_key: str, msg_id: str) -> dict:
+        return {"UserID": self.uid, "MessageID": msg_id,
+                "Feed": f"{self.uid}#{self.source}", "dateKey": date_key}
+
+    def head(self, want: int) -> dict | None:
+        while not self.buf and self.more:
+            items, self.start = page_msgs(self.uid, max(1, want), self.start,
+                                          FIELDS, self.source, self.until)
+            self.buf.extend(items)
+            self.more = self.start is not None
+        return self.buf[0] if self.buf else None
+
+    def pop(self) -> dict:
+        item = self.buf.popleft()
+        self.state = [item.get("dateKey"), item["MessageID"]]
+        return item
+
+    def resume(self):
+        """Cursor state after this page."""
+        return _DONE if not self.buf and not self.more else self.state
+
+
+def merge_page(feeds: list[Feed], limit: int) -> list[tuple[Feed, dict]]:
+    """The newest ``limit`` rows across ``feeds``, reading each only as far as needed."""
+    first = limit // max(1, len(feeds)) + 1
+    heap: list[tuple[int, int]] = []
+    for i, f in enumerate(feeds):
+        if (h := f.head(first)) is not None:
+            heap.append((_order(h), i))
+    heapq.heapify(heap)
+
+    out: list[tuple[Feed, dict]] = []
+    while heap and len(out) < limit:
+        _, i = heapq.heappop(heap)
+        out.append((feeds[i], feeds[i].pop()))
+        if len(out) < limit and (h := feeds[i].head(limit - len(out))) is not None:
+            heapq.heappush(heap, (_order(h), i))
+    return out
+
+
+# ───────────────────────── cursor ─────────────────────────────────
+def encode_cursor(feeds: Iterable[Feed], at: str | None) -> str | None:
+    states = {f.source: f.resume() for f in feeds}
+    if all(s == _DONE for s in states.values()):
+        return None
+    raw = json.dumps({"at": at, "s": states}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str | None) -> tuple[dict, str | None]:
+    """→ ({source: state}, at); ValueError if it is not one of ours."""
+    if not cursor:
+        return {}, None
+    data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    states, at = data["s"], data.get("at")
+    if not isinstance(states, dict) or not all(
+            s is _TOP or s == _DONE or (isinstance(s, list) and len(s) == 2
+                                       and all(isinstance(x, str) for x in s))
+            for s in states.values()):
+        raise ValueError("bad cursor")
+    return states, at
+
+
+def open_feeds(uid: str, sources: Iterable[str], cursor: str | None) -> list[Feed]:
+    """
+    One Feed per source, positioned where ``cursor`` left off; streams
+    nothing was taken from (or new since the first page) join at ``at``.
+    """
+    states, at = decode_cursor(cursor)
+    return [Feed(uid, src, states.get(src, _TOP), until=at) for src in sources]
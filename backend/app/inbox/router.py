@@ -0,0 +1,66 @@
+"""
+Unified inbox across every connected source.
+
+GET /inbox → newest-first page merging the Gmail feed and each synced
+             Slack channel (see app.inbox.merge); paged via X-Next-Cursor
+"""
+from __future__ import annotations
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+
+from app.core import httpcache
+from app.core.auth import current_user
+from app.core.db import slack_channels
+from app.nlp import jobs
+from .merge import encode_cursor, merge_page, open_feeds
+from .schemas import InboxItem
+
+router = APIRouter(prefix="/inbox", tags=["inbox"])
+
+
+def _page(uid: str, limit: int, cursor: str | None) -> tuple[list[InboxItem], str | None]:
+    sources = ["gmail", *(f"slack:{ch}" for ch in slack_channels(uid))]
+    try:
+        feeds = open_feeds(uid, sources, cursor)
+    except Exception:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid cursor")
+
+    rows = merge_page(feeds, limit)
+    out = [
+        InboxItem(
+            MessageID = item["MessageID"],
+            source    = feed.source.split(":")[0],
+            channel   = feed.source.partition(":")[2] or None,
+            subject   = item.get("subject") or "(No subject)",
+            snippet   = item.get("snippet", ""),
+            sender    = item.get("sender", ""),
+            dateISO   = item.get("dateISO"),
+            urgent    = item.get("urgent", False),
+        )
+        for feed, item in rows
+    ]
+    at = rows[-1][1].get("dateKey") if rows else None
+    return out, encode_cursor(feeds, at) if rows else None
+
+
+@router.get("", response_model=List[InboxItem])
+async def inbox(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = None,
+    user=Depends(current_user),
+):
+    """
+    Envelope-only page of Gmail threads and Slack messages, newest first.
+    If more rows exist the opaque ``X-Next-Cursor`` response header holds
+    the value to pass back as ``?cursor=`` for the next page.  Pages are
+    served from the per-user response cache, with ETags.
+    """
+    def build():
+        out, nxt = _page(user["sub"], limit, cursor)
+        return [i.model_dump() for i in out], {"X-Next-Cursor": nxt} if nxt else {}
+
+    await run_in_threadpool(jobs.mark_active, user["sub"])   # their enrichment jobs go first
+    return await httpcache.cached_json(request, user["sub"], "messages", build)
@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+from typing import Optional
+
+
+class InboxItem(BaseModel):
+    """One row of the unified inbox (envelope only; open it via its source's detail route)."""
+
+    MessageID: str
+    source: str                       # "gmail" | "slack"
+    channel: Optional[str] = None     # Slack channel ID
+
+    subject: str = "(No subject)"
+    snippet: str = ""
+    sender: str = ""
+    dateISO: Optional[str] = None
+    urgent: bool = False
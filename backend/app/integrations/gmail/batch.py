@@ -0,0 +1,121 @@
+"""
+Batched Gmail thread / message fetches.
+
+Groups ``threads.get`` / ``messages.get`` calls into multipart batch
+requests (one HTTP round trip per ``GMAIL_BATCH_SIZE`` items).  Items that
+fail inside a batch with a rate-limit or server error are retried in a
+later, smaller batch with exponential backoff; anything else is logged
+and skipped.  IDs that can never be fetched (400 / 404 – a deleted thread,
+a draft) are reported through ``gone`` so callers can tell them from
+items still worth retrying on the next sync.
+"""
+from __future__ import annotations
+import logging, os, random, time
+from googleapiclient.errors import HttpError
+
+log = logging.getLogger("gmail.batch")
+
+BATCH_SIZE  = int(os.getenv("GMAIL_BATCH_SIZE", "25"))   # Google suggests ≤ 50
+MAX_RETRIES = int(os.getenv("GMAIL_BATCH_RETRIES", "4"))
+
+_RETRY_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "backendError"}
+_PERMANENT     = {400, 404}
+
+
+def _retryable(exc: Exception) -> bool:
+    if not isinstance(exc, HttpError):
+        return False
+    if exc.resp.status == 429 or exc.resp.status >= 500:
+        return True
+    if exc.resp.status == 403:
+        return any(d.get("reason") in _RETRY_REASONS for d in (exc.error_details or []))
+    return False
+
+
+def _batch_get(
+    g, ids: list[str], build, what: str, batch_size: int, http=None,
+    gone: set[str] | None = None,
+) -> dict[str, dict]:
+    """
+    ``{id: response}`` for every ID whose ``build(id)`` request succeeded;
+    IDs that failed permanently are added to ``gone``.  ``http`` overrides
+    the transport of ``g`` (see clients.fresh_http).
+    """
+    out: dict[str, dict] = {}
+    pending = list(dict.fromkeys(ids))
+
+    for attempt in range(MAX_RETRIES + 1):
+        retry: list[str] = []
+
+        def _done(request_id, response, exception):
+            if exception is None:
+                out[request_id] = response
+            elif _retryable(exception):
+                retry.append(request_id)
+            else:
+                log.warning("%s.get(%s) failed: %s", what, request_id, exception)
+                if gone is not None and isinstance(exception, HttpError) \
+                        and exception.resp.status in _PERMANENT:
+                    gone.add(request_id)
+
+        for i in range(0, len(pending), batch_size):
+            chunk = pending[i:i + batch_size]
+            batch = g.new_batch_http_request(callback=_done)
+            for rid in chunk:
+                batch.add(build(rid), request_id=rid)
+            try:
+                batch.execute(http=http)
+            except Exception as exc:          # whole batch lost – try it again
+                log.warning("batch of %s %s failed: %s", len(chunk), what, exc)
+                retry.extend(r for r in chunk if r not in out and r not in retry)
+
+        if not retry:
+            break
+        if attempt == MAX_RETRIES:
+            log.warning("giving up on %s %s after %s retries", len(retry), what, MAX_RETRIES)
+            break
+        time.sleep(min(2 ** attempt + random.random(), 30))
+        pending, batch_size = retry, max(1, batch_size // 2)   # back off on size too
+
+    return out
+
+
+def fetch_threads(
+    g,
+    thread_ids: list[str],
+    *,
+    fmt: str = "full",
+    metadata_headers: list[str] | None = None,
+    batch_size: int = BATCH_SIZE,
+    gone: set[str] | None = None,
+) -> dict[str, dict]:
+    """
+    ``{threadId: thread}`` for every ID that could be fetched.
+    ``g`` is a ready Gmail service object; ``fmt`` is the threads.get format
+    (with ``metadata_headers`` limiting the headers of ``"metadata"``);
+    IDs that no longer exist are added to ``gone``.
+    """
+    extra = {"metadataHeaders": metadata_headers} if metadata_headers else {}
+    return _batch_get(
+        g, thread_ids,
+        lambda tid: g.users().threads().get(userId="me", id=tid, format=fmt, **extra),
+        "threads", batch_size, gone=gone,
+    )
+
+
+def fetch_messages(
+    g,
+    message_ids: list[str],
+    *,
+    fmt: str = "full",
+    fields: str | None = None,
+    batch_size: int = BATCH_SIZE,
+    http=None,
+) -> dict[str, dict]:
+    """``{messageId: message}``; ``fields`` is a partial-response mask."""
+    extra = {"fields": fields} if fields else {}
+    return _batch_get(
+        g, message_ids,
+        lambda mid: g.users().messages().get(userId="me", id=mid, format=fmt, **extra),
+        "messages", batch_size, http,
+    )
@@ -0,0 +1,150 @@
+"""
+Process-wide cache of ready Gmail service objects + OAuth credentials.
+
+Keyed by (UserID, Provider).  Building a discovery client and refreshing a
+token are the expensive parts of polling a small inbox, so both happen at
+most once per account per CLIENT_TTL:
+
+• credentials are refreshed REFRESH_AHEAD seconds *before* ``expires_at``
+  (``refresh_due`` does it in the background), and the new token is
+  written back to triagely-oauth
+• concurrent callers needing the same refresh share one refresh
+• entries are LRU-evicted past MAX_CLIENTS and rebuilt after CLIENT_TTL
+
+googleapiclient objects are not thread-safe (httplib2 underneath): the
+scheduler never runs two syncs of the same account at once, so the sync
+owns the cached service's transport.  Anything else talking to Gmail
+concurrently (body fills from the detail route or enrichment) sends its
+requests over its own transport from ``fresh_http``.
+"""
+from __future__ import annotations
+import datetime as dt, json, os, threading, time
+from collections import OrderedDict
+import google_auth_httplib2, httplib2
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+from app.core.db import t_oauth
+
+MAX_CLIENTS   = int(os.getenv("GMAIL_CLIENT_CACHE", "1024"))
+CLIENT_TTL    = int(os.getenv("GMAIL_CLIENT_TTL", str(6 * 3600)))
+REFRESH_AHEAD = int(os.getenv("GMAIL_REFRESH_AHEAD", "300"))
+
+Key = tuple[str, str]
+
+
+class _Entry:
+    __slots__ = ("creds", "tok", "service", "built_at", "lock")
+
+    def __init__(self, creds: Credentials, tok: dict, service):
+        self.creds    = creds
+        self.tok      = tok
+        self.service  = service
+        self.built_at = time.time()
+        self.lock     = threading.Lock()        # single-flight refresh
+
+    def expires_in(self) -> float:
+        exp = self.tok.get("expires_at")
+        return float(exp) - time.time() if exp else 0.0
+
+
+_cache: "OrderedDict[Key, _Entry]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _creds_from_token(tok: dict) -> Credentials:
+    creds = Credentials(
+        tok.get("access_token"),
+        refresh_token = tok.get("refresh_token"),
+        token_uri     = tok.get("token_uri", "https://oauth2.googleapis.com/token"),
+        client_id     = tok.get("client_id"),
+        client_secret = tok.get("client_secret"),
+        scopes        = tok.get("scopes", ["https://www.googleapis.com/auth/gmail.readonly"]),
+    )
+    if tok.get("expires_at"):                   # google-auth wants naive UTC
+        creds.expiry = dt.datetime.utcfromtimestamp(int(tok["expires_at"]))
+    return creds
+
+
+def _refresh(key: Key, entry: _Entry, ahead: int = REFRESH_AHEAD) -> None:
+    """Refresh ``entry`` unless another caller just did; persist the token."""
+    with entry.lock:
+        if entry.expires_in() > ahead or not entry.creds.refresh_token:
+            return                              # someone else won the race
+        entry.creds.refresh(Request())
+        entry.tok["access_token"] = entry.creds.token
+        if entry.creds.expiry:
+            entry.tok["expires_at"] = int(
+                entry.creds.expiry.replace(tzinfo=dt.timezone.utc).timestamp()
+            )
+        t_oauth.update_item(                    # persist fresh access token
+            Key={"UserID": key[0], "Provider": key[1]},
+            UpdateExpression="SET token = :t",
+            ExpressionAttributeValues={":t": json.dumps(entry.tok)},
+        )
+
+
+def get_service(row: dict):
+    """
+    Ready-to-use Gmail client for one triagely-oauth row.
+    Raises google.auth.exceptions.RefreshError if the grant was revoked.
+    """
+    key = (row["UserID"], row["Provider"])
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and time.time() - entry.built_at < CLIENT_TTL:
+            _cache.move_to_end(key)
+        else:
+            entry = None
+
+    if entry is None:
+        tok = json.loads(row["token"])
+        creds = _creds_from_token(tok)
+        entry = _Entry(creds, tok, build("gmail", "v1", credentials=creds, cache_discovery=False))
+        with _cache_lock:
+            cur = _cache.get(key)
+            if cur and time.time() - cur.built_at < CLIENT_TTL:
+                entry = cur                     # another thread built it meanwhile
+            else:
+                _cache[key] = entry
+            _cache.move_to_end(key)
+            while len(_cache) > MAX_CLIENTS:
+                _cache.popitem(last=False)
+
+    if entry.expires_in() <= REFRESH_AHEAD:
+        _refresh(key, entry)
+    return entry.service
+
+
+def fresh_http(row: dict) -> google_auth_httplib2.AuthorizedHttp:
+    """
+    A private authorised transport for one caller, sharing the cached
+    (refreshed) credentials but not the cached service's httplib2 object.
+    Pass it as ``http=`` to ``execute()`` of requests built on get_service.
+    """
+    get_service(row)                            # builds / refreshes the entry
+    with _cache_lock:
+        entry = _cache.get((row["UserID"], row["Provider"]))
+    creds = entry.creds if entry else _creds_from_token(json.loads(row["token"]))
+    return google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=60))
+
+
+def refresh_due() -> int:
+    """Refresh every cached credential that expires within 2×REFRESH_AHEAD."""
+    with _cache_lock:
+        due = [(k, e) for k, e in _cache.items() if e.expires_in() <= 2 * REFRESH_AHEAD]
+    done = 0
+    for key, entry in due:
+        try:
+            _refresh(key, entry, ahead=2 * REFRESH_AHEAD)
+            done += 1
+        except Exception:
+            evict(*key)                         # next get_service surfaces the error
+    return done
+
+
+def evict(uid: str, provider_key: str) -> None:
+    """Forget an account (token replaced on reconnect, or refresh failed)."""
+    with _cache_lock:
+        _cache.pop((uid, provider_key), None)
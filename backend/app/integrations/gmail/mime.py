@@ -0,0 +1,69 @@
+"""
+Bounded MIME body extraction for Gmail ``format="full"`` payloads.
+
+Walks the part tree iteratively (no recursion limit to hit), in document
+order, and
+
+• skips attachments (anything with a filename or ``Content-Disposition:
+  attachment``) and binary parts (image/, audio/, video/, application/…)
+  without touching their data
+• base64-decodes only the first text/plain and first text/html part,
+  stopping as soon as both are found
+• never decodes more than GMAIL_BODY_MAX bytes of a part (the base64
+  input is sliced before decoding)
+"""
+from __future__ import annotations
+import base64, codecs, os
+
+BODY_MAX = int(os.getenv("GMAIL_BODY_MAX", str(256 * 1024)))    # decoded bytes per part
+
+_BINARY = ("image/", "audio/", "video/", "application/", "font/", "model/")
+
+
+def _headers(part: dict) -> dict[str, str]:
+    return {h["name"].lower(): h["value"] for h in part.get("headers", [])}
+
+
+def _charset(content_type: str) -> str:
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "charset":
+            value = value.strip('"\' ')
+            try:
+                return codecs.lookup(value).name
+            except LookupError:
+                break
+    return "utf-8"
+
+
+def _decode(data: str, max_bytes: int, charset: str) -> str:
+    data = data[: (max_bytes + 2) // 3 * 4]          # base64 chars covering max_bytes
+    raw  = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    return raw[:max_bytes].decode(charset, errors="ignore")
+
+
+def extract_bodies(payload: dict, max_bytes: int = BODY_MAX) -> tuple[str, str]:
+    """(plain, html) of one message payload; '' for whichever is missing."""
+    found: dict[str, str] = {}
+    stack = [payload]
+    while stack and len(found) < 2:
+        part = stack.pop()
+        mime = part.get("mimeType", "").lower()
+        if part.get("filename") or mime.startswith(_BINARY):
+            continue
+        hdrs = _headers(part)
+        if hdrs.get("content-disposition", "").lower().startswith("attachment"):
+            continue
+        if part.get("parts"):                           # multipart/* and message/rfc822
+            stack.extend(reversed(part["parts"]))       # pop() then yields document order
+            continue
+
+        kind = "plain" if mime == "text/plain" else "html" if mime == "text/html" else None
+        data = part.get("body", {}).get("data")
+        if kind is None or kind in found or not data:
+            continue
+        try:
+            found[kind] = _decode(data, max_bytes, _charset(hdrs.get("content-type", "")))
+        except (ValueError, TypeError):                 # corrupt base64 – skip the part
+            continue
+    return found.get("plain", ""), found.get("html", "")
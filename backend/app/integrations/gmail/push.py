@@ -0,0 +1,163 @@
+"""
+Gmail push notifications (``users.watch`` → Cloud Pub/Sub → webhook).
+
+• ``watch`` registers a mailbox with GMAIL_PUBSUB_TOPIC when it is
+  connected; ``renew_if_due`` re-registers it from the sync path once the
+  watch is within GMAIL_WATCH_RENEW_SEC of lapsing (Google lets watches
+  expire after 7 days).
+• ``POST /gmail/push?token=…`` (see router) receives the Pub/Sub push
+  envelope.  ``decode`` pulls out ``emailAddress`` and the mailbox is
+  handed to ``PushCollapser``: every push for the same address within
+  GMAIL_PUSH_DEBOUNCE seconds becomes ONE incremental (history.list) sync
+  of just that mailbox; a push that lands while it is syncing queues
+  exactly one follow-up run.
+• A mailbox whose watch is live (``watch_until``) is polled only as
+  reconciliation (GMAIL_RECONCILE_SEC) – Pub/Sub delivery is
+  at-least-once, not guaranteed-timely.  One whose watch failed or lapsed
+  keeps the normal adaptive polling.
+
+Local stand-in for Pub/Sub (no Google project needed):
+
+    python -m app.integrations.gmail.push me@example.com --url http://localhost:8000
+"""
+from __future__ import annotations
+import argparse, asyncio, base64, datetime as dt, hmac, json, logging, os, time, uuid
+from typing import Awaitable, Callable
+
+from app.core.db import gmail_accounts_for, save_watch
+
+log = logging.getLogger("gmail.push")
+
+TOPIC         = os.getenv("GMAIL_PUBSUB_TOPIC")             # projects/<p>/topics/<t>
+PUSH_TOKEN    = os.getenv("GMAIL_PUSH_TOKEN")               # ?token= on the subscription URL
+DEBOUNCE_SEC  = float(os.getenv("GMAIL_PUSH_DEBOUNCE", "3"))
+RENEW_SEC     = int(os.getenv("GMAIL_WATCH_RENEW_SEC", str(24 * 3600)))
+
+
+_watching: dict[tuple[str, str], float] = {}   # (uid, provider key) → watch lapses (epoch s)
+
+
+def enabled() -> bool:
+    return bool(TOPIC)
+
+
+def watch_until(uid: str, provider_key: str) -> float:
+    """When this process last saw the account's watch lapse; 0 if it has none."""
+    return _watching.get((uid, provider_key), 0.0)
+
+
+# ───────────────────────── watch registration ────────────────────────
+def watch(g, uid: str, provider_key: str) -> int | None:
+    """(Re)register the mailbox behind ``g``; returns the expiry (epoch ms)."""
+    if not TOPIC:
+        return None
+    resp = g.users().watch(userId="me", body={"topicName": TOPIC}).execute()
+    expiration = int(resp["expiration"])
+    save_watch(uid, provider_key, expiration)
+    _watching[(uid, provider_key)] = expiration / 1000
+    return expiration
+
+
+def renew_if_due(g, uid: str, row: dict) -> None:
+    """Renew the watch on ``row`` if it is missing or about to lapse (never raises)."""
+    if not TOPIC:
+        return
+    if (expiration := int(row.get("watchExpiration", 0))) > (time.time() + RENEW_SEC) * 1000:
+        _watching[(uid, row["Provider"])] = expiration / 1000
+        return
+    try:
+        watch(g, uid, row["Provider"])
+    except Exception as exc:                          # polling still covers the mailbox
+        _watching[(uid, row["Provider"])] = expiration / 1000     # until the old one lapses
+        log.warning("users.watch failed for %s %s: %s", uid, row["Provider"], exc)
+
+
+# ───────────────────────── webhook ──────────────────────────────────
+def check_token(token: str) -> bool:
+    return bool(PUSH_TOKEN) and hmac.compare_digest(token.encode(), PUSH_TOKEN.encode())
+
+
+def decode(envelope: dict) -> dict:
+    """``{"emailAddress", "historyId"}`` of a Pub/Sub push body; ValueError if malformed."""
+    try:
+        data = json.loads(base64.b64decode(envelope["message"]["data"]))
+        data["emailAddress"] = data["emailAddress"].lower()
+        return data
+    except (KeyError, TypeError, ValueError) as exc:
+        raise ValueError(f"not a Gmail push notification: {exc}") from None
+
+
+class PushCollapser:
+    """Turns a burst of pushes for one mailbox into one sync per account."""
+
+    def __init__(self, sync: Callable[[str, str], Awaitable[object]], delay: float = DEBOUNCE_SEC):
+        self._sync    = sync
+        self.delay    = delay
+        self._waiting: set[str] = set()             # sync scheduled, not started
+        self._running: set[str] = set()
+        self._again:   set[str] = set()             # pushed while running → one more run
+        self._tasks:   set[asyncio.Task] = set()
+
+    def notify(self, address: str) -> bool:
+        """Schedule a sync of ``address``; False if folded into one already queued."""
+        if address in self._waiting:
+            return False
+        if address in self._running:
+            self._again.add(address)
+            return False
+        self._waiting.add(address)
+        task = asyncio.create_task(self._run(address))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, address: str) -> None:
+        while True:
+            await asyncio.sleep(self.delay)
+            self._waiting.discard(address)
+            self._running.add(address)
+            try:
+                accounts = await asyncio.to_thread(gmail_accounts_for, address)
+                await asyncio.gather(*(self._sync(uid, prov) for uid, prov in accounts))
+            except Exception as exc:
+                log.warning("Push sync of %s failed: %s", address, exc)
+            finally:
+                self._running.discard(address)
+            if address not in self._again:
+                return
+            self._again.discard(address)
+            self._waiting.add(address)
+
+
+# ───────────────────────── local push stand-in ──────────────────────
+def envelope(address: str, history_id: int | str = 0) -> dict:
+    """A Pub/Sub push body shaped like the ones Gmail notifications arrive in."""
+    data = json.dumps({"emailAddress": address, "historyId": int(history_id)})
+    return {
+        "message": {
+            "data":        base64.b64encode(data.encode()).decode(),
+            "messageId":   uuid.uuid4().hex,
+            "publishTime": dt.datetime.now(dt.timezone.utc).isoformat(),
+        },
+        "subscription": "projects/local/subscriptions/gmail-push",
+    }
+
+
+def simulate(url: str, address: str, *, count: int = 1, history_id: int = 0) -> list[int]:
+    """POST ``count`` notifications for ``address`` to ``url``; returns the status codes."""
+    import httpx
+    with httpx.Client(timeout=10) as client:
+        return [client.post(url, params={"token": PUSH_TOKEN or ""},
+                            json=envelope(address, history_id + i)).status_code
+                for i in range(count)]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Deliver fake Gmail push notifications")
+    ap.add_argument("address", help="mailbox the notification is for")
+    ap.add_argument("--url", default="http://localhost:8000", help="API base URL")
+    ap.add_argument("--count", type=int, default=1, help="notifications in the burst")
+    ap.add_argument("--history-id", type=int, default=0)
+    args = ap.parse_args()
+    print(simulate(f"{args.url.rstrip('/')}/gmail/push", args.address,
+                   count=args.count, history_id=args.history_id))
@@ -7,28 +7,37 @@ Endpoints
 GET  /gmail/connect     → Google consent URL  
 GET  /gmail/callback    → stores token under  gmail:<addr>  
 POST /gmail/fetch       → pulls newest threads for *all* Gmail accounts  
-GET  /gmail/messages    → merged cached view (for React list)  
+GET  /gmail/messages    → merged cached view (for React list), paged via X-Next-Cursor  
+GET  /gmail/messages/{id} → one cached thread with bodies (detail view)  
 GET  /gmail/accounts    → list of addresses  ["me@x", "other@y"]
+POST /gmail/push        → Pub/Sub push webhook (users.watch notifications)
 """
 from __future__ import annotations
 
-import json, os
+import base64, json, os
 from email.utils import parsedate_to_datetime
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import RedirectResponse
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
 
+from app.background import scheduler
+from app.core import bodies, httpcache
 from app.core.auth import current_user
 from app.core.db   import (
-    list_msgs,
+    get_msg,
+    get_msgs,
+    page_msgs,
     save_token,
     list_gmail_tokens,
 )
 from app.core.secrets import get as get_secret
-from . import service
+from app.nlp import jobs
+from . import clients, push
+from .service import ensure_body
 from .schemas import GmailMessage
 
 router = APIRouter(prefix="/gmail", tags=["gmail"])
@@ -72,6 +81,41 @@ def _hdrs_to_dict(h: list[dict]) -> dict[str, str]:
     return {i["name"].lower(): i["value"] for i in h}
 
 
+def _store_account(uid: str, creds) -> str:
+    """Look up the address behind ``creds`` and save its token row."""
+    # —— determine the primary Gmail address ————————————————
+    email_addr = None
+    try:
+        gsvc = build("gmail", "v1", credentials=creds, cache_discovery=False)
+        email_addr = gsvc.users().getProfile(userId="me").execute().get("emailAddress")
+    except Exception:
+        pass
+
+    provider_key = f"gmail:{email_addr}" if email_addr else "gmail"
+
+    clients.evict(uid, provider_key)             # drop any client built on the old token
+    save_token(
+        uid,
+        provider_key,
+        {
+            "refresh_token": creds.refresh_token,
+            "access_token":  creds.token,
+            "expires_at":    int(creds.expiry.timestamp()),
+            "token_uri":     creds.token_uri,
+            "client_id":     SECRET["client_id"],
+            "client_secret": SECRET["client_secret"],
+            "scopes":        creds.scopes,
+            "email":         email_addr,
+        },
+    )
+    if email_addr and push.enabled():
+        try:
+            push.watch(gsvc, uid, provider_key)
+        except Exception as exc:                 # the sync path retries (renew_if_due)
+            print(f"[gmail] users.watch failed for {email_addr}: {exc}")
+    return provider_key
+
+
 # ───────────────────────── OAuth endpoints ───────────────────────
 @router.get("/connect")
 async def connect(user=Depends(current_user)):
@@ -93,39 +137,14 @@ async def callback(request: Request, state: str = "", code: str = ""):
     """
     flow = _flow(state)
     try:
-        flow.fetch_token(code=code)
+        await run_in_threadpool(flow.fetch_token, code=code)
     except Exception as exc:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Token exchange failed: {exc}")
 
-    creds = flow.credentials
-
-    # —— determine the primary Gmail address ————————————————
-    email_addr = None
-    try:
-        gsvc = build("gmail", "v1", credentials=creds, cache_discovery=False)
-        email_addr = gsvc.users().getProfile(userId="me").execute().get("emailAddress")
-    except Exception:
-        pass
-
-    provider_key = f"gmail:{email_addr}" if email_addr else "gmail"
-
-    save_token(
-        state,
-        provider_key,
-        {
-            "refresh_token": creds.refresh_token,
-            "access_token":  creds.token,
-            "expires_at":    int(creds.expiry.timestamp()),
-            "token_uri":     creds.token_uri,
-            "client_id":     SECRET["client_id"],
-            "client_secret": SECRET["client_secret"],
-            "scopes":        creds.scopes,
-            "email":         email_addr,
-        },
-    )
+    await run_in_threadpool(_store_account, state, flow.credentials)
 
     # —— prime the cache for *all* Gmail accounts of this user ————
-    service.fetch_for_user(state, max_threads=40)
+    await scheduler.sync_user(state, max_threads=40)
 
     fe = os.getenv("FRONTEND_URL", "http://localhost:3000")
     return RedirectResponse(f"{fe.rstrip('/')}/connected?provider=gmail")
@@ -138,63 +157,144 @@ async def fetch_now(limit: int | None = 30, user=Depends(current_user)):
     Hit Google for each connected account, store unseen threads,
     return the number of genuinely-new rows inserted.
     """
-    new_threads = service.fetch_for_user(user["sub"], max_threads=limit or 30)
-    return {"fetched": len(new_threads)}
+    new_threads = await scheduler.sync_user(user["sub"], max_threads=limit or 30)
+    return {"fetched": new_threads}
 
 
 # ───────────────────────── cached list view ───────────────────────
+def _encode_cursor(key: dict | None) -> str | None:
+    if not key:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str | None, uid: str) -> dict | None:
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(key, dict) or key.get("UserID") != uid:
+            raise ValueError
+    except Exception:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid cursor")
+    return key
+
+
+def _to_message(itm: dict, raw: str | None = None, with_body: bool = False) -> GmailMessage:
+    subject  = itm.get("subject") or "(No subject)"
+    sender   = itm.get("sender", "")
+    date_iso = itm.get("dateISO")
+
+    if not (sender and date_iso):                       # repair legacy rows
+        try:
+            thread = json.loads(raw or itm.get("raw", "{}"))
+            first  = (thread.get("messages") or thread.get("payload") or [])[0]
+            hdrs   = _hdrs_to_dict(first.get("payload", {}).get("headers", []))
+            sender  = sender  or hdrs.get("from", sender)
+            subject = subject or hdrs.get("subject", subject)
+            if not date_iso and (d := hdrs.get("date")):
+                date_iso = parsedate_to_datetime(d).isoformat()
+        except Exception:
+            pass
+
+    plain, html = bodies.load(itm) if with_body else (None, None)
+    return GmailMessage(
+        MessageID   = itm["MessageID"],
+        snippet     = itm.get("snippet", ""),
+        subject     = subject,
+        sender      = sender,
+        senderEmail = sender.split("<")[-1].strip("> ") if "<" in sender else sender,
+        dateISO     = date_iso,
+        plain       = plain,
+        html        = html,
+        urgent      = itm.get("urgent", False),
+        aiSummary   = itm.get("aiSummary", []),
+        aiChecklist = itm.get("aiChecklist", []),
+    )
+
+
+def _list_page(uid: str, limit: int, start_key: dict | None) -> tuple[list[GmailMessage], dict | None]:
+    items, next_key = page_msgs(uid, limit, start_key)
+    # legacy rows lack envelope fields → fetch just their raw JSON, in one batch
+    legacy = [i["MessageID"] for i in items if not (i.get("sender") and i.get("dateISO"))]
+    raws = get_msgs(uid, legacy, "MessageID, raw") if legacy else {}
+    out = [_to_message(i, raws.get(i["MessageID"], {}).get("raw")) for i in items]
+    return out, next_key
+
+
 @router.get("/messages", response_model=List[GmailMessage])
-async def list_messages(limit: int = 50, user=Depends(current_user)):
-    raw = list_msgs(user["sub"], limit)
-    out: list[GmailMessage] = []
-
-    for itm in raw:
-        subject  = itm.get("subject") or "(No subject)"
-        sender   = itm.get("sender", "")
-        date_iso = itm.get("dateISO")
-
-        if not (sender and date_iso):                       # repair legacy rows
-            try:
-                thread = json.loads(itm.get("raw", "{}"))
-                first  = (thread.get("messages") or thread.get("payload") or [])[0]
-                hdrs   = _hdrs_to_dict(first.get("payload", {}).get("headers", []))
-                sender  = sender  or hdrs.get("from", sender)
-                subject = subject or hdrs.get("subject", subject)
-                if not date_iso and (d := hdrs.get("date")):
-                    date_iso = parsedate_to_datetime(d).isoformat()
-            except Exception:
-                pass
-
-        out.append(
-            GmailMessage(
-                MessageID   = itm["MessageID"],
-                snippet     = itm.get("snippet", ""),
-                subject     = subject,
-                sender      = sender,
-                senderEmail = sender.split("<")[-1].strip("> ") if "<" in sender else sender,
-                dateISO     = date_iso,
-                plain       = itm.get("plain"),
-                html        = itm.get("html"),
-                urgent      = itm.get("urgent", False),
-                aiSummary   = itm.get("aiSummary", []),
-                aiChecklist = itm.get("aiChecklist", []),
-            )
-        )
-
-    out.sort(key=lambda m: m.dateISO or "", reverse=True)
-    return out
+async def list_messages(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = None,
+    user=Depends(current_user),
+):
+    """
+    Envelope-only page of cached threads (no plain / html bodies), newest
+    first across every connected account.
+    If more rows exist the opaque ``X-Next-Cursor`` response header holds
+    the value to pass back as ``?cursor=`` for the next page.  Pages are
+    served from the per-user response cache, with ETags.
+    """
+    uid = user["sub"]
+    start_key = _decode_cursor(cursor, uid)
+
+    def build():
+        out, next_key = _list_page(uid, limit, start_key)
+        nxt = _encode_cursor(next_key)
+        return ([m.model_dump() for m in out],          # already newest-first (by-date index)
+                {"X-Next-Cursor": nxt} if nxt else {})
+
+    await run_in_threadpool(jobs.mark_active, uid)   # their enrichment jobs go first
+    return await httpcache.cached_json(request, uid, "messages", build)
+
+
+@router.get("/messages/{message_id}", response_model=GmailMessage)
+async def get_message(message_id: str, user=Depends(current_user)):
+    """
+    Detail view: one cached thread including bodies and AI meta.  A body
+    the sync has not fetched yet is loaded from Gmail now.
+    """
+    itm = await run_in_threadpool(get_msg, user["sub"], message_id)
+    if itm is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Message not found")
+    try:
+        itm = await run_in_threadpool(ensure_body, user["sub"], itm)
+    except Exception as exc:                    # Gmail unreachable → envelope + snippet
+        print(f"[gmail] body fetch failed for {message_id}: {exc}")
+    return await run_in_threadpool(_to_message, itm, None, True)   # may hit the blob store
 
 
 # ───────────────────────── sidebar helper ─────────────────────────
 @router.get("/accounts")
-async def list_accounts(user=Depends(current_user)):
+async def list_accounts(request: Request, user=Depends(current_user)):
     """
-    Return every Gmail address the user attached – uses cached values
-    stored in triagely-oauth.
+    Return every Gmail address the user attached – read off the
+    ``gmail:<addr>`` sort keys (no token decoding), response-cached.
     """
-    addrs: list[str] = []
-    for tok in list_gmail_tokens(user["sub"]):
-        data = json.loads(tok["token"])
-        if data.get("email"):
-            addrs.append(data["email"])
-    return addrs
\ No newline at end of file
+    def build():
+        addrs = (r["Provider"].split(":", 1)[1] for r in list_gmail_tokens(user["sub"]))
+        return [a for a in addrs if a], {}
+
+    return await httpcache.cached_json(request, user["sub"], "accounts", build)
+
+
+# ───────────────────────── push notifications ─────────────────────
+_pushes = push.PushCollapser(scheduler.sync_pushed)
+
+
+@router.post("/push", status_code=status.HTTP_204_NO_CONTENT)
+async def push_notification(request: Request, token: str = ""):
+    """
+    Pub/Sub push endpoint for ``users.watch``.  Acknowledges at once; bursts
+    for one mailbox are collapsed into a single incremental sync of it.
+    """
+    if not push.check_token(token):
+        raise HTTPException(status.HTTP_403_FORBIDDEN, "Bad push token")
+    try:
+        note = push.decode(await request.json())
+    except ValueError as exc:                   # ack anyway – a retry would not help
+        print(f"[gmail] ignoring push: {exc}")
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    _pushes.notify(note["emailAddress"])
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
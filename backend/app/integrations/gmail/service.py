@@ -1,64 +1,105 @@
 """
 Triagely · Gmail service layer (multi-account aware)
 Fetches threads, stores unseen ones, returns # inserted.
+
+Ingest is two-tier: the sync pulls ``format="metadata"`` (envelope +
+snippet) only and marks rows ``bodyPending``; ``fill_bodies`` fetches the
+opening message's body later – from background enrichment, or on demand
+when a thread is opened or summarised.
 """
 from __future__ import annotations
-import base64, datetime as dt, email, json, os, re
-from typing import Any, List
-import boto3
+import datetime as dt, email
+from typing import List
 from botocore.exceptions import ClientError
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from google.auth.exceptions import RefreshError
+from googleapiclient.errors import HttpError
 from boto3.dynamodb.conditions import Key, Attr
-from app.core.db import put_msg, list_gmail_tokens, save_token       # helpers
-
-dynamodb   = boto3.resource("dynamodb", region_name=os.getenv("AWS_REGION"))
-tbl_oauth  = dynamodb.Table("triagely-oauth")
+from app.core.db import (                                              # helpers
+    date_key, get_msgs, put_msgs, list_gmail_tokens, save_token, save_sync_cursor,
+    set_sync_status, get_msg, update_msg,
+    t_oauth as tbl_oauth,
+)
+from app.core import bodies
+from app.nlp import jobs, rules
+from app.search import index as search
+from .batch import fetch_messages, fetch_threads
+from .clients import evict, fresh_http, get_service
+from .mime import extract_bodies
+from .push import renew_if_due
 
-URGENT_RE   = re.compile(r"\b(urgent|overdrawn|asap|immediately|action required)\b", re.I)
-B64URLPAD   = lambda s: s + "=" * (4 - len(s) % 4)
+ENVELOPE_HEADERS = ["Subject", "From", "Date"]
+BODY_FIELDS      = "id,payload(mimeType,filename,headers,body/data,parts)"   # partial response
 
 # ─────────────────────────────────────────────────────────────────────────────
-def _get_creds(row: dict) -> Credentials:
-    tok = json.loads(row["token"])
-    creds = Credentials(
-        tok.get("access_token"),
-        refresh_token = tok.get("refresh_token"),
-        token_uri     = tok.get("token_uri", "https://oauth2.googleapis.com/token"),
-        client_id     = tok.get("client_id"),
-        client_secret = tok.get("client_secret"),
-        scopes        = tok.get("scopes", ["https://www.googleapis.com/auth/gmail.readonly"]),
-    )
-    if creds.expired and creds.refresh_token:
-        creds.refresh(Request())
-        tok["access_token"] = creds.token
-        tbl_oauth.update_item(                     # persist fresh access token
-            Key={"UserID": row["UserID"], "Provider": row["Provider"]},
-            UpdateExpression="SET token = :t",
-            ExpressionAttributeValues={":t": json.dumps(tok)},
+def _thread_row(meta: dict, account: str) -> dict:
+    """Envelope of one ``threads.get(format="metadata")`` response."""
+    msgs = meta["messages"]
+    msg0, last = msgs[0], msgs[-1]
+    hdr  = {h["name"]: h["value"] for h in msg0["payload"].get("headers", [])}
+    lhdr = {h["name"]: h["value"] for h in last["payload"].get("headers", [])}
+    subj = hdr.get("Subject", "(no subject)")
+    sender = hdr.get("From", "(unknown)")
+    try:                                           # newest message dates the thread
+        date_iso = email.utils.parsedate_to_datetime(lhdr.get("Date", "")).isoformat()
+    except Exception:
+        date_iso = dt.datetime.utcnow().isoformat()
+
+    return {
+        "subject":   subj,
+        "snippet":   last.get("snippet", ""),
+        "sender":    sender,
+        "dateISO":   date_iso,
+        "urgent":    False,                        # scored per batch in fetch_for_user
+        "msgCount":  len(msgs),
+        "account":   account,                      # oauth Provider key, for fill_bodies
+        "bodyMsgId": msg0["id"],                   # body = the opening message's
+        "bodyPending": True,
+        "aiSummary": [],
+        "aiChecklist": [],
+    }
+
+
+def _refresh_envelopes(user_id: str, updated: dict[str, dict], cached: dict[str, dict]) -> list[str]:
+    """
+    Update the envelope of threads already cached – their body, AI fields
+    and cache keys stay.  A thread that gained messages is re-scored and
+    its body marked pending.  Returns the keys of those threads.
+    """
+    grown: list[str] = []
+    for msg_key, env in updated.items():
+        fields = {"snippet": env["snippet"], "dateISO": env["dateISO"],
+                  "dateKey": date_key(env["dateISO"])}
+        if env["msgCount"] != cached[msg_key].get("msgCount"):
+            fields.update(msgCount=env["msgCount"], urgent=env["urgent"], bodyPending=True)
+            grown.append(msg_key)
+        try:
+            update_msg(user_id, msg_key, fields)
+        except ClientError:                          # row deleted meanwhile
+            continue
+    return grown
+
+
+def _history_thread_ids(g, start_id: str) -> tuple[set[str], str]:
+    """
+    Thread IDs that received messages since ``start_id`` plus the mailbox's
+    current historyId.  Raises HttpError(404) once the cursor has expired.
+    """
+    tids, latest, page = set(), start_id, None
+    while True:
+        resp = (
+            g.users()
+             .history()
+             .list(userId="me", startHistoryId=start_id,
+                   historyTypes="messageAdded", pageToken=page)
+             .execute()
         )
-    return creds
-
-def _mime_parts(payload: dict[str, Any]) -> tuple[str, str]:
-    plain, html = "", ""
-    def walk(p):
-        nonlocal plain, html
-        mt = p.get("mimeType", "")
-        data = p.get("body", {}).get("data")
-        if data:
-            try:
-                decoded = base64.urlsafe_b64decode(B64URLPAD(data)).decode("utf-8", errors="ignore")
-            except Exception:
-                decoded = ""
-            if mt.startswith("text/plain") and not plain:
-                plain = decoded
-            elif mt.startswith("text/html") and not html:
-                html = decoded
-        for sub in p.get("parts", []):
-            walk(sub)
-    walk(payload)
-    return plain, html
+        for h in resp.get("history", []):
+            for added in h.get("messagesAdded", []):
+                tids.add(added["message"]["threadId"])
+        latest = resp.get("historyId", latest)
+        if not (page := resp.get("nextPageToken")):
+            return tids, latest
+
 
 # --------------------------------------------------------------------------- #
 # Public: fetch_for_user                                                      #
@@ -73,6 +114,11 @@ def fetch_for_user(
     • If provider_key is None → poll *every* gmail:<addr> the user has.  
     • Else                        → poll just that one account.
 
+    Accounts with a stored ``historyId`` are synced incrementally through
+    ``history.list``; the rest (or an expired cursor) get a full resync of
+    the newest ``max_threads`` threads.  Listing / token errors are skipped
+    per account when polling all of them, raised for a single account.
+
     Returns **number of brand-new threads inserted**.
     """
     if provider_key:
@@ -85,78 +131,138 @@ def fetch_for_user(
     new_rows = 0
 
     for row in token_rows:
-        creds = _get_creds(row)
+        try:
+            g = get_service(row)                     # cached client + fresh token
+        except RefreshError as exc:                  # revoked / expired grant
+            print(f"[gmail] token refresh failed for {row['Provider']}: {exc}")
+            evict(user_id, row["Provider"])
+            set_sync_status(user_id, row["Provider"], "reauth")
+            if provider_key:                         # single-account poll → let the scheduler back off
+                raise
+            continue
         address = row["Provider"].split("gmail:")[-1] or "unknown"
-        g = build("gmail", "v1", credentials=creds, cache_discovery=False)
+        renew_if_due(g, user_id, row)                # push watch lapses after 7 days
 
+        changed: set[str] = set()                    # cached threads with new replies
+        cursor = row.get("historyId")
         try:
-            resp = (
-                g.users()
-                 .threads()
-                 .list(userId="me", maxResults=max_threads, q="in:anywhere")
-                 .execute()
-            )
+            if cursor:
+                try:
+                    tids, cursor = _history_thread_ids(g, cursor)
+                except HttpError as exc:
+                    if exc.resp.status != 404:
+                        raise
+                    print(f"[gmail] historyId expired for {address}, full resync")
+                    cursor = None
+            if not cursor:
+                # read the cursor *before* listing so nothing slips in between
+                cursor = g.users().getProfile(userId="me").execute()["historyId"]
+                resp = (
+                    g.users()
+                     .threads()
+                     .list(userId="me", maxResults=max_threads, q="in:anywhere")
+                     .execute()
+                )
+                tids = [th["id"] for th in resp.get("threads", [])]
+            else:
+                changed = tids
         except Exception as exc:
             print("[gmail] list() failed:", exc)
+            if provider_key:
+                raise
             continue
 
-        for th in resp.get("threads", []):
-            tid      = th["id"]
-            msg_key  = f"gmail-{address}-{tid}"        # globally unique ID
+        keys     = {f"gmail-{address}-{tid}": tid for tid in tids}   # globally unique IDs
+        cached   = get_msgs(user_id, keys, "MessageID, msgCount")
+        fresh: dict[str, dict]   = {}
+        updated: dict[str, dict] = {}
 
-            # already cached?
-            try:
-                dynamodb.Table("triagely-messages").get_item(
-                    Key={"UserID": user_id, "MessageID": msg_key}
-                )["Item"]
+        wanted   = {k: t for k, t in keys.items() if k not in cached or t in changed}
+
+        # envelopes of every wanted thread in a handful of batch round trips;
+        # bodies follow lazily (fill_bodies)
+        gone: set[str] = set()                   # deleted threads, drafts – never coming back
+        threads  = fetch_threads(g, list(wanted.values()), fmt="metadata",
+                                 metadata_headers=ENVELOPE_HEADERS, gone=gone)
+        for msg_key, tid in wanted.items():
+            if (meta := threads.get(tid)) is None:
                 continue
-            except KeyError:
-                pass
-
-            # pull full thread once
-            full = g.users().threads().get(userId="me", id=tid, format="full").execute()
-            msg0 = full["messages"][0]
-            hdr  = {h["name"]: h["value"] for h in msg0["payload"].get("headers", [])}
-            subj = hdr.get("Subject", "(no subject)")
-            sender = hdr.get("From", "(unknown)")
-            try:
-                date_iso = email.utils.parsedate_to_datetime(hdr.get("Date", "")).isoformat()
-            except Exception:
-                date_iso = dt.datetime.utcnow().isoformat()
-
-            plain, html = _mime_parts(msg0["payload"])
-            snippet = msg0.get("snippet", plain[:120])
-
-            body = {
-                "subject":   subj,
-                "snippet":   snippet,
-                "sender":    sender,
-                "dateISO":   date_iso,
-                "plain":     plain,
-                "html":      html,
-                "urgent":    bool(URGENT_RE.search(subj)),
-                "aiSummary": [],
-                "aiChecklist": [],
-            }
-
-            if put_msg(user_id, msg_key, body):
-                new_rows += 1
+            (updated if msg_key in cached else fresh)[msg_key] = _thread_row(meta, row["Provider"])
+
+        # envelope-level urgency for the whole batch in one pass (body rescored on enrichment)
+        batch = [*fresh.values(), *updated.values()]
+        for body, urgent in zip(batch, rules.rules_for(user_id).urgent_batch(
+                [{"subject": b["subject"], "sender": b["sender"], "body": b["snippet"]} for b in batch])):
+            body["urgent"] = urgent
+
+        new_rows += put_msgs(user_id, fresh)
+        grown = _refresh_envelopes(user_id, updated, cached)
+        jobs.enqueue(user_id, [*fresh, *grown])       # background AI enrichment
+        missing = [t for t in wanted.values() if t not in threads and t not in gone]
+        if not missing:                       # keep the old cursor so transient misses are retried
+            save_sync_cursor(user_id, row["Provider"], cursor)
 
     return new_rows
 
 
+# --------------------------------------------------------------------------- #
+# Second tier: bodies                                                         #
+# --------------------------------------------------------------------------- #
+def fill_bodies(user_id: str, items: list[dict]) -> int:
+    """
+    Fetch, decode and store the bodies of ``bodyPending`` rows (batched per
+    account, updating ``items`` in place).  Returns the number filled.
+    """
+    by_account: dict[str, list[dict]] = {}
+    for item in items:
+        if item.get("bodyPending"):
+            by_account.setdefault(item["account"], []).append(item)
+
+    filled = 0
+    for provider_key, pending in by_account.items():
+        row = tbl_oauth.get_item(Key={"UserID": user_id, "Provider": provider_key}).get("Item")
+        if row is None:                              # account disconnected
+            continue
+        # may run next to a scheduler sync of this account → own transport
+        msgs = fetch_messages(get_service(row), [i["bodyMsgId"] for i in pending],
+                              fields=BODY_FIELDS, http=fresh_http(row))
+        for item in pending:
+            if (msg := msgs.get(item["bodyMsgId"])) is None:
+                continue
+            plain, html = extract_bodies(msg.get("payload", {}))
+            packed = bodies.pack(user_id, plain, html)
+            try:
+                update_msg(user_id, item["MessageID"], {**packed, "bodyPending": False})
+            except ClientError:                      # row replaced / deleted meanwhile
+                continue
+            search.index_body(user_id, item["MessageID"], plain)
+            item.update(packed, bodyPending=False)
+            filled += 1
+    return filled
+
+
+def ensure_body(user_id: str, item: dict) -> dict:
+    """``item`` with its body loaded from Gmail first if still pending."""
+    if item.get("bodyPending"):
+        fill_bodies(user_id, [item])
+    return item
+
+
 # --------------------------------------------------------------------------- #
 # Helper for LLM layer                                                        #
 # --------------------------------------------------------------------------- #
+def load_thread(user_id: str, message_id: str) -> tuple[dict | None, str]:
+    """(cached row or None, its plain text – snippet if plain is empty)."""
+    item = get_msg(user_id, message_id)
+    if item is None:
+        return None, ""
+    plain, _html = bodies.load(ensure_body(user_id, item))
+    return item, plain or item.get("snippet", "")
+
+
 def load_thread_plain(user_id: str, message_id: str) -> str:
     """
     Return the cached plain-text body for a message/thread.
     Falls back to snippet if plain is empty.  Returns '' if not found.
     """
-    try:
-        item = dynamodb.Table("triagely-messages").get_item(
-            Key={"UserID": user_id, "MessageID": message_id}
-        )["Item"]
-        return item.get("plain") or item.get("snippet", "")
-    except KeyError:
-        return ""
+    return load_thread(user_id, message_id)[1]
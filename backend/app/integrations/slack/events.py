@@ -0,0 +1,175 @@
+"""
+Triagely · Slack Events API ingestion.
+
+``POST /slack/events`` (see router) verifies the request signature, answers
+``url_verification`` challenges and hands ``event_callback`` payloads to
+``buffer`` – then returns 200 straight away, well inside Slack's 3-second
+deadline.  Nothing on the request path touches DynamoDB.
+
+The buffer drops Slack retries by ``event_id`` and flushes every
+SLACK_EVENTS_FLUSH_SEC (or as soon as SLACK_EVENTS_BATCH events are
+waiting) on a worker thread: events are grouped by workspace, fanned out
+to every Triagely user who syncs that channel (the ``slack-teams`` index)
+and written through ``service.store_messages`` – the same dedup / rules /
+put_msgs path as polling.  Channel watermarks are left alone, so the
+scheduler's low-frequency reconciliation poll (SLACK_RECONCILE_SEC)
+still picks up anything an event missed – including a batch dropped
+after SLACK_EVENTS_RETRIES failed flushes.
+
+Ingestion is opt-in: it runs when SLACK_EVENTS=on, or by default when
+SLACK_SIGNING_SECRET is set.  Otherwise the endpoint answers 404 and
+Slack keeps its normal polling interval.
+"""
+from __future__ import annotations
+import asyncio, hashlib, hmac, logging, os, time
+from collections import OrderedDict, defaultdict
+
+from app.core.db import slack_team_members
+from app.core.secrets import get as get_secret
+from . import service
+
+log = logging.getLogger("slack.events")
+
+FLUSH_SEC  = float(os.getenv("SLACK_EVENTS_FLUSH_SEC", "2"))
+BATCH      = int(os.getenv("SLACK_EVENTS_BATCH", "200"))
+SEEN_MAX   = int(os.getenv("SLACK_EVENTS_SEEN", "50000"))     # event_ids remembered
+SEEN_TTL   = 3600                                              # Slack retries for ≈ 1 h
+MAX_SKEW   = 300                                               # replay window (seconds)
+MEMBER_TTL = 60
+RETRIES    = int(os.getenv("SLACK_EVENTS_RETRIES", "3"))       # failed flushes before a drop
+
+# message subtypes that carry a real message (edits, deletes, joins … are skipped)
+SUBTYPES = {None, "thread_broadcast", "bot_message", "file_share", "me_message"}
+
+
+# ───────────────────────── signatures ─────────────────────────────
+_secret: bytes | None = None
+
+
+def signing_secret() -> bytes | None:
+    """
+    The app's signing secret, or None if it is not configured.  Blocking
+    the first time (Secrets Manager) – call it off the event loop.
+    """
+    global _secret
+    if _secret is None:
+        raw = os.getenv("SLACK_SIGNING_SECRET") or get_secret("slack-oauth").get("signing_secret")
+        _secret = raw.encode() if raw else b""
+    return _secret or None
+
+
+def verify(body: bytes, timestamp: str | None, signature: str | None, secret: bytes) -> bool:
+    """Check ``X-Slack-Signature`` (v0 HMAC-SHA256) and reject stale requests."""
+    if not timestamp or not signature:
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > MAX_SKEW:
+            return False
+    except ValueError:
+        return False
+    base = b"v0:" + timestamp.encode() + b":" + body
+    want = "v0=" + hmac.new(secret, base, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(want, signature)
+
+
+# ───────────────────────── buffer ─────────────────────────────────
+class EventBuffer:
+    """In-process queue of Slack message events, flushed in batches."""
+
+    def __init__(self) -> None:
+        self._pending: list[tuple[str, dict, int]] = []            # (team_id, event, failures)
+        self._seen: OrderedDict[str, float] = OrderedDict()       # event_id → first seen
+        self._members: dict[str, tuple[float, list[dict]]] = {}
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()                                # one flush at a time
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _duplicate(self, event_id: str | None) -> bool:
+        if not event_id:
+            return False
+        now = time.time()
+        while self._seen and (len(self._seen) >= SEEN_MAX
+                              or next(iter(self._seen.values())) < now - SEEN_TTL):
+            self._seen.popitem(last=False)
+        if event_id in self._seen:
+            return True
+        self._seen[event_id] = now
+        return False
+
+    def add(self, payload: dict) -> bool:
+        """Queue one ``event_callback``; False if it is a retry or not a message."""
+        if self._duplicate(payload.get("event_id")):
+            return False
+        ev, team = payload.get("event") or {}, payload.get("team_id")
+        if ev.get("type") != "message" or ev.get("subtype") not in SUBTYPES \
+                or not team or "ts" not in ev or "channel" not in ev:
+            return False
+        self._pending.append((team, ev, 0))
+        if len(self._pending) >= BATCH:
+            self._full.set()
+        return True
+
+    # —— flushing ————————————————————————————————————————————
+    def _team_members(self, team: str) -> list[dict]:
+        hit = self._members.get(team)
+        if hit and hit[0] > time.time():
+            return hit[1]
+        rows = slack_team_members(team)
+        self._members[team] = (time.time() + MEMBER_TTL, rows)
+        return rows
+
+    def _write(self, batch: list[tuple[str, dict, int]]) -> int:
+        """Blocking: fan ``batch`` out to subscribed users → # rows written."""
+        by_team: dict[str, dict[str, list[dict]]] = defaultdict(lambda: defaultdict(list))
+        for team, ev, _ in batch:
+            by_team[team][ev["channel"]].append(ev)
+        written = 0
+        for team, channels in by_team.items():
+            for row in self._team_members(team):
+                synced = row.get("channelOldest") or {}
+                names  = row.get("channelNames") or {}
+                for ch, msgs in channels.items():
+                    if ch in synced:                   # only channels the user syncs
+                        written += service.store_messages(
+                            row["UserID"], {"id": ch, "name": names.get(ch)}, msgs)
+        return written
+
+    async def flush(self) -> int:
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            self._full.clear()
+            if not batch:
+                return 0
+            try:
+                n = await asyncio.to_thread(self._write, batch)
+            except Exception as exc:
+                retry = [(t, ev, k + 1) for t, ev, k in batch if k + 1 < RETRIES]
+                log.warning("Flushing %s Slack events failed (%s requeued, %s dropped "
+                            "for the reconciliation poll): %s",
+                            len(batch), len(retry), len(batch) - len(retry), exc)
+                self._pending[:0] = retry
+                return 0
+            if n:
+                log.info("%s Slack messages written from %s events", n, len(batch))
+            return n
+
+    async def run(self) -> None:
+        """Flush every FLUSH_SEC, or early when a batch fills up."""
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), FLUSH_SEC)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+
+buffer = EventBuffer()
+
+
+def enabled() -> bool:
+    flag = os.getenv("SLACK_EVENTS")
+    if flag:
+        return flag.lower() not in ("off", "0", "false", "no")
+    return bool(os.getenv("SLACK_SIGNING_SECRET"))
@@ -1,12 +1,15 @@
 # backend/app/integrations/slack/router.py
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import RedirectResponse
 import os, httpx
 from urllib.parse import urlencode
 
+from app.background   import scheduler
 from app.core.auth    import current_user
 from app.core.db      import save_token
 from app.core.secrets import get as get_secret
+from .events          import buffer, enabled as events_enabled, signing_secret, verify
 
 router = APIRouter(prefix="/slack", tags=["slack"])
 
@@ -30,7 +33,7 @@ async def connect(user=Depends(current_user)):
     return {"auth_url": f"{OAUTH_URL}?{qs}"}
 
 @router.get("/callback")
-async def callback(code: str, state: str):
+async def callback(code: str, state: str, background: BackgroundTasks):
     async with httpx.AsyncClient() as client:
         res = await client.post(TOKEN_URL, data={
             "code":          code,
@@ -43,4 +46,33 @@ async def callback(code: str, state: str):
         raise HTTPException(400, data.get("error"))
 
     save_token(state, "slack", data)
+    # first sync backfills every channel – run it after the redirect
+    background.add_task(scheduler.sync_account, state, "slack")
     return RedirectResponse(f"{FRONTEND_URL}/connected?provider=slack")
+
+@router.post("/fetch")
+async def fetch_now(user=Depends(current_user)):
+    """Sync the caller's Slack workspace now; returns the number of new messages."""
+    try:
+        return {"fetched": await scheduler.sync_account(user["sub"], "slack")}
+    except TimeoutError:
+        raise HTTPException(504, "Slack sync timed out; the next sync picks up where it stopped")
+
+@router.post("/events")
+async def events(request: Request):
+    """Slack Events API: verify, queue and acknowledge (writes happen in the buffer)."""
+    if not events_enabled():
+        raise HTTPException(404, "Slack event ingestion is off")
+    secret = await run_in_threadpool(signing_secret)
+    if secret is None:
+        raise HTTPException(503, "Slack signing secret is not configured")
+    body = await request.body()
+    if not verify(body, request.headers.get("X-Slack-Request-Timestamp"),
+                  request.headers.get("X-Slack-Signature"), secret):
+        raise HTTPException(401, "bad signature")
+    payload = await request.json()
+    if payload.get("type") == "url_verification":
+        return {"challenge": payload.get("challenge")}
+    if payload.get("type") == "event_callback":
+        buffer.add(payload)
+    return {"ok": True}
@@ -1,20 +1,211 @@
-import httpx, os, time
-from app.core.db import get_token, put_msg
+"""
+Triagely · Slack sync engine.
 
-SLACK_API = "https://slack.com/api/"
+One pooled ``httpx.AsyncClient`` serves every workspace.  A sync lists the
+workspace's conversations, then reads each channel's history concurrently
+(SLACK_CONCURRENCY per workspace), following ``next_cursor`` pagination
+and reading only messages newer than the channel's watermark
+(``channelOldest.<id>`` on the slack oauth row).  A channel seen for the
+first time is backfilled SLACK_BACKFILL_SEC.
 
-async def fetch_for_user(user_id: str):
-    tok = get_token(user_id, "slack")
-    if not tok: return
+History calls are tier-3 paced (~1.2 s each), so a large workspace cannot
+be swept inside one POLL_ACCOUNT_TIMEOUT.  A run therefore stops starting
+channels after SLACK_RUN_BUDGET seconds and records the first channel it
+did not reach (``syncFrom``); the next run starts there, so every channel
+comes round in turn.
+
+Calls are paced per workspace and method at Slack's tier limits; a 429
+(or ``ratelimited``) sleeps for ``Retry-After`` and retries.  New messages
+are deduplicated against the table in batches and written with put_msgs
+to the ``slack:<channel>`` by-date feed.  The scheduler polls workspaces
+next to Gmail accounts (see app.background.scheduler).
+"""
+from __future__ import annotations
+import asyncio, datetime as dt, json, logging, os, time
+
+import httpx
+
+from app.core.db import (
+    existing_msg_ids, init_slack_watermarks, put_msgs, save_slack_resume, save_slack_watermark,
+    t_oauth as tbl_oauth,
+)
+from app.nlp import rules
+
+log = logging.getLogger("slack.sync")
+
+SLACK_API    = "https://slack.com/api/"
+CONCURRENCY  = int(os.getenv("SLACK_CONCURRENCY", "4"))          # channels in flight / workspace
+BACKFILL_SEC = int(os.getenv("SLACK_BACKFILL_SEC", str(7 * 86400)))
+RUN_BUDGET   = float(os.getenv("SLACK_RUN_BUDGET", "45"))        # < POLL_ACCOUNT_TIMEOUT
+PAGE_SIZE    = 200
+MAX_RETRIES  = 5
+
+# requests per minute (https://api.slack.com/docs/rate-limits)
+TIERS = {
+    "conversations.list":    20,       # tier 2
+    "conversations.history": 50,       # tier 3
+    "conversations.replies": 50,       # tier 3
+}
+
+
+class SlackError(Exception):
+    """Slack answered ``ok: false``."""
+
+
+# ───────────────────────── pacing ─────────────────────────────────
+class _Pacer:
+    """Evenly spaced slots at ``per_min`` requests / minute (async-safe)."""
+    def __init__(self, per_min: int):
+        self.gap  = 60.0 / per_min
+        self.next = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self.lock:
+            now = time.monotonic()
+            delay, self.next = max(0.0, self.next - now), max(now, self.next) + self.gap
+        if delay:
+            await asyncio.sleep(delay)
+
+    def push_back(self, seconds: float) -> None:
+        self.next = max(self.next, time.monotonic() + seconds)
+
+
+_pacers: dict[tuple[str, str], _Pacer] = {}
+_client: httpx.AsyncClient | None = None
+
+
+def _http() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=SLACK_API, timeout=20,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        )
+    return _client
+
+
+async def _call(team: str, token: str, method: str, params: dict) -> dict:
+    pacer = _pacers.setdefault((team, method), _Pacer(TIERS.get(method, 20)))
+    for attempt in range(MAX_RETRIES + 1):
+        await pacer.wait()
+        res = await _http().get(method, params=params, headers={"Authorization": f"Bearer {token}"})
+        if res.status_code != 429:
+            res.raise_for_status()
+            data = res.json()
+        if res.status_code == 429 or data.get("error") == "ratelimited":
+            wait = float(res.headers.get("Retry-After", 2 ** attempt))
+            log.info("Slack %s rate-limited for %s, retrying in %.0fs", method, team, wait)
+            pacer.push_back(wait)
+            continue
+        if not data.get("ok"):
+            raise SlackError(f"{method}: {data.get('error')}")
+        return data
+    raise SlackError(f"{method}: still rate-limited after {MAX_RETRIES} retries")
+
+
+async def _pages(team: str, token: str, method: str, params: dict, key: str):
+    """Yield every item of ``key`` across all cursor pages."""
+    cursor = None
+    while True:
+        data = await _call(team, token, method, {**params, "limit": PAGE_SIZE,
+                                                 **({"cursor": cursor} if cursor else {})})
+        for item in data.get(key, []):
+            yield item
+        if not (cursor := data.get("response_metadata", {}).get("next_cursor")):
+            return
+
+
+# ───────────────────────── rows ───────────────────────────────────
+def msg_key(channel: str, ts: str) -> str:
+    return f"slack-{channel}-{ts.replace('.', '')}"
+
+
+def _row(channel: dict, msg: dict) -> dict:
+    text = msg.get("text", "")
+    return {
+        "subject":  f"#{channel.get('name') or channel['id']}",
+        "snippet":  text[:200],
+        "sender":   msg.get("user") or msg.get("username") or msg.get("bot_id", ""),
+        "dateISO":  dt.datetime.fromtimestamp(float(msg["ts"]), dt.timezone.utc).isoformat(),
+        "text":     text,
+        "channel":  channel["id"],
+        "ts":       msg["ts"],
+        "threadTs": msg.get("thread_ts", msg["ts"]),
+        "urgent":   False,
+    }
+
+
+def store_messages(uid: str, channel: dict, msgs: list[dict]) -> int:
+    """Dedup ``msgs`` against the table, score and write the new ones → # written."""
+    rows = {msg_key(channel["id"], m["ts"]): _row(channel, m) for m in msgs if "ts" in m}
+    for k in existing_msg_ids(uid, rows):
+        rows.pop(k)
+    if not rows:
+        return 0
+    for row, urgent in zip(rows.values(), rules.rules_for(uid).urgent_batch(
+            [{"subject": "", "sender": r["sender"], "body": r["text"]} for r in rows.values()])):
+        row["urgent"] = urgent
+    return put_msgs(uid, rows, source=f"slack:{channel['id']}")
+
+
+# ───────────────────────── sync ───────────────────────────────────
+async def _sync_channel(uid: str, team: str, token: str, channel: dict, oldest: str | None) -> int:
+    start = oldest or f"{time.time() - BACKFILL_SEC:.6f}"
+    msgs  = [m async for m in _pages(team, token, "conversations.history",
+                                     {"channel": channel["id"], "oldest": start}, "messages")
+             if m.get("subtype") not in ("channel_join", "channel_leave")]
+    if not msgs:
+        return 0
+    written = await asyncio.to_thread(store_messages, uid, channel, msgs)
+    newest  = max(msgs, key=lambda m: float(m["ts"]))["ts"]
+    await asyncio.to_thread(save_slack_watermark, uid, channel["id"], newest, channel.get("name"))
+    return written
+
+
+async def fetch_for_user(user_id: str) -> int:
+    """Sync the user's Slack workspace; returns the number of new messages."""
+    row = await asyncio.to_thread(
+        lambda: tbl_oauth.get_item(Key={"UserID": user_id, "Provider": "slack"}).get("Item")
+    )
+    if not row:
+        return 0
+    tok   = json.loads(row["token"])
     token = tok["access_token"]
-    async with httpx.AsyncClient() as c:
-        ch = (await c.get(SLACK_API+"conversations.list",
-                          params={"types":"public_channel,im"},
-                          headers={"Authorization": f"Bearer {token}"})).json().get("channels",[])
-        for channel in ch:
-            hist = (await c.get(SLACK_API+"conversations.history",
-                                params={"channel": channel["id"], "limit": 20},
-                                headers={"Authorization": f"Bearer {token}"})).json()
-            for msg in hist.get("messages", []):
-                ts = msg["ts"].replace(".","")
-                put_msg(user_id, f"slack-{channel['id']}-{ts}", "slack", msg)
+    team  = tok.get("team", {}).get("id", user_id)
+    marks = row.get("channelOldest")
+    if marks is None:
+        await asyncio.to_thread(init_slack_watermarks, user_id)
+        marks = {}
+
+    channels = [c async for c in _pages(team, token, "conversations.list",
+                                        {"types": "public_channel,private_channel,im,mpim",
+                                         "exclude_archived": "true"}, "channels")
+                if c.get("is_member", True) or c.get("is_im")]
+
+    # resume where the last run ran out of budget
+    channels.sort(key=lambda c: c["id"])
+    if start := row.get("syncFrom"):
+        i = next((n for n, c in enumerate(channels) if c["id"] >= start), 0)
+        channels = channels[i:] + channels[:i]
+
+    sem = asyncio.Semaphore(CONCURRENCY)
+    deadline = time.monotonic() + RUN_BUDGET
+
+    async def _one(ch: dict) -> int | None:
+        async with sem:
+            if time.monotonic() > deadline:           # out of budget – next run
+                return None
+            try:
+                return await _sync_channel(user_id, team, token, ch, marks.get(ch["id"]))
+            except SlackError as exc:                 # e.g. not_in_channel – skip just this one
+                log.warning("Slack sync of %s for %s failed: %s", ch["id"], user_id, exc)
+                return 0
+
+    results = await asyncio.gather(*(_one(c) for c in channels))
+    skipped = [c["id"] for c, r in zip(channels, results) if r is None]
+    if skipped or start:
+        await asyncio.to_thread(save_slack_resume, user_id, skipped[0] if skipped else None)
+    if skipped:
+        log.info("Slack sync of %s deferred %s of %s channels", user_id, len(skipped), len(channels))
+    return sum(r for r in results if r)
@@ -3,12 +3,19 @@ import logging
 import os
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 
 from app.core.auth import current_user
 from app.integrations.gmail.router import router as gmail_router
 from app.integrations.slack.router import router as slack_router
+from app.inbox.router import router as inbox_router
+from app.search.router import router as search_router
 from app.background.scheduler       import poll_gmail_forever   # 👈 NEW
 from app.nlp import router as nlp_router
+from app.nlp.enrich import run_enrichment
+from app.integrations.slack.events import (
+    buffer as slack_events, enabled as slack_events_on, signing_secret as slack_signing_secret,
+)
 
 
 
@@ -31,7 +38,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+# large list pages compress ~5-10×; small responses aren't worth the CPU
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_BYTES", "1024")))
 
 # Health-checks ---------------------------------------------------
 @app.get("/health")
@@ -46,6 +56,8 @@ async def protected_route(user=Depends(current_user)):
 # Routers ---------------------------------------------------------
 app.include_router(gmail_router)
 app.include_router(slack_router)
+app.include_router(inbox_router)
+app.include_router(search_router)
 app.include_router(nlp_router.router)
 
 # ───────── BACKGROUND POLLER – this was missing ─────────────────
@@ -54,6 +66,39 @@ async def _launch_poller() -> None:
     """
     Spawn one long-running asyncio-task that keeps every Gmail
     inbox in DynamoDB fresh.  Runs for the life of the process.
+
+    Set GMAIL_POLLER=off when the standalone sync workers
+    (python -m app.background.worker) own polling.
     """
+    if os.getenv("GMAIL_POLLER", "on").lower() in ("off", "0", "false", "no"):
+        logger.info("📭  Gmail poller disabled (GMAIL_POLLER=off)")
+        return
     asyncio.create_task(poll_gmail_forever())
-    logger.info("📬  Gmail poller task started")
\ No newline at end of file
+    logger.info("📬  Gmail poller task started")
+
+
+@app.on_event("startup")
+async def _launch_enrichment() -> None:
+    """Drain the AI enrichment queue in the background (AI_ENRICH=off to skip)."""
+    if os.getenv("AI_ENRICH", "on").lower() in ("off", "0", "false", "no"):
+        logger.info("AI enrichment disabled (AI_ENRICH=off)")
+        return
+    asyncio.create_task(run_enrichment())
+    logger.info("🧠  AI enrichment task started")
+
+
+@app.on_event("startup")
+async def _launch_slack_events() -> None:
+    """Flush pushed Slack events to DynamoDB (opt-in: SLACK_EVENTS=on / SLACK_SIGNING_SECRET)."""
+    if not slack_events_on():
+        logger.info("Slack Events API ingestion off (set SLACK_SIGNING_SECRET to enable)")
+        return
+    if await asyncio.to_thread(slack_signing_secret) is None:   # warm the cache off-loop
+        logger.warning("Slack events enabled but no signing secret – /slack/events answers 503")
+    asyncio.create_task(slack_events.run())
+    logger.info("💬  Slack event buffer started")
+
+
+@app.on_event("shutdown")
+async def _flush_slack_events() -> None:
+    await slack_events.flush()
@@ -0,0 +1,87 @@
+"""
+Background AI enrichment of newly ingested threads.
+
+fetch_for_user queues every inserted / updated thread in app.nlp.jobs;
+``run_enrichment`` drains that queue with ENRICH_CONCURRENCY workers and
+triages each thread with one model call (aiTriage, and from it aiSummary,
+aiChecklist and the urgent flag), so the first view of a thread needs no
+model round trip.  A provider rate limit pauses every
+worker (exponential backoff); other failures are retried a few times.
+"""
+from __future__ import annotations
+import asyncio, logging, os, random, time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.db import update_msg
+from app.integrations.gmail.service import load_thread
+from app.nlp import jobs, rules
+from app.nlp.llm import triage_thread
+from app.nlp.llm.triage import URGENT_SCORE
+from app.nlp.llm.provider import RateLimited, track_usage
+
+log = logging.getLogger("nlp.enrich")
+
+CONCURRENCY  = int(os.getenv("ENRICH_CONCURRENCY", "2"))
+MAX_ATTEMPTS = 5
+IDLE_SEC     = 5.0
+
+_pool = ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix="enrich")
+_paused_until = 0.0             # shared rate-limit pause
+
+
+def _backoff(attempts: int) -> float:
+    return min(600.0, 5.0 * 2 ** attempts) * (0.5 + random.random())
+
+
+def enrich_thread(uid: str, msg_id: str) -> None:
+    """Triage (cached / persisted by app.nlp.llm) and urgency."""
+    item, text = load_thread(uid, msg_id)
+    if item is None:                             # deleted since it was queued
+        return
+    with track_usage() as usage:
+        triage = triage_thread(uid, msg_id)
+    if usage.calls:
+        log.info("Enriched %s: %d calls, %d prompt + %d completion tokens",
+                 msg_id, usage.calls, usage.prompt_tokens, usage.completion_tokens)
+    urgent = triage.urgency >= URGENT_SCORE or rules.rules_for(uid).is_urgent(
+        {"subject": item.get("subject", ""), "sender": item.get("sender", ""), "body": text})
+    if urgent != item.get("urgent", False):
+        update_msg(uid, msg_id, {"urgent": urgent})
+
+
+async def _worker(stop: asyncio.Event) -> None:
+    global _paused_until
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        pause = max(_paused_until - time.time(), 0.0)
+        job = None if pause else await loop.run_in_executor(_pool, jobs.claim)
+        if job is None:
+            try:
+                await asyncio.wait_for(stop.wait(), pause or IDLE_SEC)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        uid, msg_id, attempts, gen = job
+        try:
+            await loop.run_in_executor(_pool, enrich_thread, uid, msg_id)
+        except RateLimited:
+            delay = _backoff(attempts)
+            _paused_until = max(_paused_until, time.time() + delay)
+            log.info("LLM rate-limited, pausing enrichment for %.0fs", delay)
+            await loop.run_in_executor(_pool, jobs.retry, uid, msg_id, delay)
+            continue
+        except Exception as exc:
+            if attempts + 1 >= MAX_ATTEMPTS:
+                log.warning("Giving up enriching %s: %s", msg_id, exc)
+                await loop.run_in_executor(_pool, jobs.done, uid, msg_id, gen)
+            else:
+                await loop.run_in_executor(_pool, jobs.retry, uid, msg_id, _backoff(attempts))
+            continue
+        await loop.run_in_executor(_pool, jobs.done, uid, msg_id, gen)
+
+
+async def run_enrichment(stop: asyncio.Event | None = None) -> None:
+    """Run CONCURRENCY enrichment workers until ``stop`` is set."""
+    stop = stop or asyncio.Event()
+    await asyncio.gather(*(_worker(stop) for _ in range(CONCURRENCY)))
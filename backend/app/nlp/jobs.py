@@ -0,0 +1,114 @@
+"""
+Durable work queue for AI enrichment (SQLite, survives restarts).
+
+One row per (UserID, MessageID).  Producers only ``enqueue``; the
+enrichment workers in app.nlp.enrich ``claim`` jobs, which leases them for
+LEASE_SEC so a crashed worker's jobs come back, and then ``done`` /
+``retry`` them.  Jobs of users who are active right now are claimed first.
+
+Every enqueue bumps the row's generation, and ``done`` only deletes the
+generation it claimed: a thread re-queued while it was being enriched
+(new messages arrived) is released for another run instead of lost.
+
+The file lives at ENRICH_QUEUE_DB; every process on the host that shares
+it (API, sync workers) can produce and consume safely.
+"""
+from __future__ import annotations
+import os, sqlite3, threading, time
+from typing import Iterable
+
+DB_PATH      = os.getenv("ENRICH_QUEUE_DB", ".enrich-queue.sqlite3")
+LEASE_SEC    = 300
+ACTIVE_SEC   = 15 * 60          # a user counts as active this long after a request
+
+_local = threading.local()
+_active: dict[str, float] = {}  # uid → last seen
+
+
+def _conn() -> sqlite3.Connection:
+    con = getattr(_local, "con", None)
+    if con is None:
+        con = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                uid         TEXT    NOT NULL,
+                msg_id      TEXT    NOT NULL,
+                priority    INTEGER NOT NULL DEFAULT 0,
+                not_before  REAL    NOT NULL DEFAULT 0,
+                attempts    INTEGER NOT NULL DEFAULT 0,
+                gen         INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (uid, msg_id)
+            )""")
+        if "gen" not in {r[1] for r in con.execute("PRAGMA table_info(jobs)")}:
+            try:                                    # queue files from before generations
+                con.execute("ALTER TABLE jobs ADD COLUMN gen INTEGER NOT NULL DEFAULT 0")
+            except sqlite3.OperationalError:        # another process just added it
+                pass
+        con.execute("CREATE INDEX IF NOT EXISTS jobs_next ON jobs (priority DESC, not_before)")
+        _local.con = con
+    return con
+
+
+def _is_active(uid: str) -> bool:
+    return time.time() - _active.get(uid, 0) < ACTIVE_SEC
+
+
+def enqueue(uid: str, msg_ids: Iterable[str]) -> None:
+    """Queue threads for enrichment (re-queueing one marks it for another run)."""
+    prio = 1 if _is_active(uid) else 0
+    _conn().executemany(
+        "INSERT INTO jobs (uid, msg_id, priority) VALUES (?, ?, ?) "
+        "ON CONFLICT (uid, msg_id) DO UPDATE SET gen = gen + 1, attempts = 0, "
+        "priority = max(priority, excluded.priority)",
+        [(uid, m, prio) for m in msg_ids],
+    )
+
+
+def mark_active(uid: str) -> None:
+    """Called when a user uses the app – their pending jobs jump the queue."""
+    was_active = _is_active(uid)
+    _active[uid] = time.time()
+    if not was_active:
+        _conn().execute("UPDATE jobs SET priority = 1 WHERE uid = ?", (uid,))
+
+
+def claim() -> tuple[str, str, int, int] | None:
+    """Lease the most urgent due job → (uid, msg_id, attempts, gen) or None."""
+    con, now = _conn(), time.time()
+    con.execute("BEGIN IMMEDIATE")                  # cross-process claim lock
+    try:
+        row = con.execute(
+            "SELECT uid, msg_id, attempts, gen FROM jobs WHERE not_before <= ? "
+            "ORDER BY priority DESC, not_before LIMIT 1",
+            (now,),
+        ).fetchone()
+        if row:
+            con.execute(
+                "UPDATE jobs SET not_before = ? WHERE uid = ? AND msg_id = ?",
+                (now + LEASE_SEC, row[0], row[1]),
+            )
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    return row
+
+
+def done(uid: str, msg_id: str, gen: int) -> None:
+    """Finish a claimed job – or, if it was re-queued meanwhile, make it due again."""
+    con = _conn()
+    if con.execute("DELETE FROM jobs WHERE uid = ? AND msg_id = ? AND gen = ?",
+                   (uid, msg_id, gen)).rowcount == 0:
+        con.execute("UPDATE jobs SET not_before = 0 WHERE uid = ? AND msg_id = ?", (uid, msg_id))
+
+
+def retry(uid: str, msg_id: str, delay: float) -> None:
+    _conn().execute(
+        "UPDATE jobs SET not_before = ?, attempts = attempts + 1 WHERE uid = ? AND msg_id = ?",
+        (time.time() + delay, uid, msg_id),
+    )
+
+
+def pending() -> int:
+    return _conn().execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
@@ -1,6 +1,8 @@
 """
 High-level LLM helpers (Bedrock / OpenAI).
 Exposed publicly as `from app.nlp.llm import summarise_thread, extract_checklist`.
+``triage_thread`` does both (plus urgency) in one structured call.
 """
-from .summarizer import summarise_thread
+from .summarizer import summarise_thread, asummarise_thread, stream_summary
 from .checklist  import extract_checklist     # <-- now exists
+from .triage     import triage_thread, atriage_thread, TriageError
@@ -0,0 +1,167 @@
+"""
+Content-addressed cache for LLM results.
+
+A result is fully determined by (task, prompt version, model, thread text),
+so the SHA-256 of those four is its key.  Lookups go:
+
+    in-process LRU  →  value persisted on the message row  →  model call
+
+The row stores the result next to ``<field>Key``; when a thread gains new
+messages the sync rewrites the row (dropping both) and the new text hashes
+differently anyway, so stale results are never served.  Concurrent callers – sync or async –
+asking for the same key wait on one shared model call.
+"""
+from __future__ import annotations
+import asyncio, hashlib, logging, os, threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable
+
+from botocore.exceptions import ClientError
+
+from app.core.db import update_msg
+from app.integrations.gmail.service import load_thread
+from .provider import model_name
+
+log = logging.getLogger("nlp.cache")
+
+CACHE_ITEMS = int(os.getenv("LLM_CACHE_ITEMS", "2048"))
+
+_lru: "OrderedDict[str, Any]" = OrderedDict()
+_inflight: dict[str, Future] = {}
+_lock = threading.Lock()
+
+
+def cache_key(task: str, prompt_version: str, text: str) -> str:
+    h = hashlib.sha256()
+    for part in (task, prompt_version, model_name(), text):
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _remember(key: str, value: Any) -> None:
+    with _lock:
+        _lru[key] = value
+        _lru.move_to_end(key)
+        while len(_lru) > CACHE_ITEMS:
+            _lru.popitem(last=False)
+
+
+MISS = object()
+
+
+def lookup(user_id: str, thread_id: str, *, task: str, prompt_version: str, field: str):
+    """(row, thread text, cache key, cached value or MISS)."""
+    item, text = load_thread(user_id, thread_id)
+    key = cache_key(task, prompt_version, text)
+
+    with _lock:
+        if key in _lru:
+            _lru.move_to_end(key)
+            return item, text, key, _lru[key]
+    if item is not None and item.get(f"{field}Key") == key:
+        _remember(key, item[field])                 # persisted by an earlier call
+        return item, text, key, item[field]
+    return item, text, key, MISS
+
+
+def store(user_id: str, thread_id: str, item: dict | None, *, field: str, key: str, value: Any,
+          derived: dict | None = None) -> None:
+    """
+    Remember ``value`` and persist it on the row (if there is one), along
+    with any ``derived`` attributes computed from it.
+    """
+    _remember(key, value)
+    if item is None:
+        return
+    try:
+        update_msg(user_id, thread_id, {field: value, f"{field}Key": key, **(derived or {})})
+    except ClientError as exc:                      # row vanished meanwhile – fine
+        log.debug("Could not persist %s for %s: %s", field, thread_id, exc)
+
+
+def _claim(key: str) -> tuple[Future, bool]:
+    with _lock:                                     # coalesce concurrent misses
+        fut = _inflight.get(key)
+        if fut is not None:
+            return fut, False
+        fut = _inflight[key] = Future()
+        return fut, True
+
+
+def _settle(key: str, fut: Future, value: Any = None, exc: BaseException | None = None) -> None:
+    with _lock:
+        _inflight.pop(key, None)
+    if exc is not None:
+        fut.set_exception(exc)
+    else:
+        fut.set_result(value)
+
+
+def cached_result(
+    user_id: str,
+    thread_id: str,
+    *,
+    task: str,
+    prompt_version: str,
+    field: str,
+    compute: Callable[[str], Any],
+    derived: Callable[[Any], dict] | None = None,
+) -> Any:
+    """
+    Result of ``compute(thread_text)`` for one thread, from cache when
+    possible.  The value is persisted on the row as ``field`` (e.g.
+    aiSummary) and must therefore be Dynamo-serialisable; ``derived(value)``
+    names further row attributes to write alongside it.
+    """
+    item, text, key, value = lookup(user_id, thread_id, task=task,
+                                    prompt_version=prompt_version, field=field)
+    if value is not MISS:
+        return value
+
+    fut, owner = _claim(key)
+    if not owner:
+        return fut.result()
+    try:
+        value = compute(text)
+    except BaseException as exc:
+        _settle(key, fut, exc=exc)
+        raise
+    _remember(key, value)
+    _settle(key, fut, value)
+    store(user_id, thread_id, item, field=field, key=key, value=value,
+          derived=derived(value) if derived else None)
+    return value
+
+
+async def acached_result(
+    user_id: str,
+    thread_id: str,
+    *,
+    task: str,
+    prompt_version: str,
+    field: str,
+    compute: Callable[[str], Awaitable[Any]],
+    derived: Callable[[Any], dict] | None = None,
+) -> Any:
+    """``cached_result`` for request handlers: ``compute`` is a coroutine."""
+    item, text, key, value = await asyncio.to_thread(
+        lookup, user_id, thread_id, task=task, prompt_version=prompt_version, field=field,
+    )
+    if value is not MISS:
+        return value
+
+    fut, owner = _claim(key)
+    if not owner:
+        return await asyncio.wrap_future(fut)
+    try:
+        value = await compute(text)
+    except BaseException as exc:
+        _settle(key, fut, exc=exc)
+        raise
+    _remember(key, value)
+    _settle(key, fut, value)
+    await asyncio.to_thread(store, user_id, thread_id, item, field=field, key=key, value=value,
+                            derived=derived(value) if derived else None)
+    return value
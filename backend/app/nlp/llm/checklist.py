@@ -1,21 +1,44 @@
 """
 LLM-powered checklist extractor.
-At the moment this is a *stub* that simply returns a mock list so the
-API starts; you can wire real LLM logic later.
+Results are cached per thread text (see .cache) and stored on the
+message row as aiChecklist: [{"text": ..., "done": False}, …].
+The cleaned thread is split into chunks (see .preprocess) whose items are
+extracted in parallel and concatenated, dropping duplicates.
 """
-from .provider import call, LLMRequest
-from app.integrations.gmail.service import load_thread_plain
+import asyncio
 
+from .cache import cached_result
+from .preprocess import chunks, clean
+from .provider import acall, run_sync, LLMRequest
+
+PROMPT_VERSION = "2"
 SYSTEM_PROMPT = """
 You are an email assistant. Extract a concise checklist of
 action items from the email thread.  Return each task on its own line
 starting with a dash (-).
 """
 
-def extract_checklist(user_id: str, thread_id: str) -> dict:
-    thread_text = load_thread_plain(user_id, thread_id)
-    prompt      = SYSTEM_PROMPT + "\n\n### THREAD:\n" + thread_text
-    raw         = call(LLMRequest(prompt=prompt))
+async def _aextract(thread_text: str) -> list[dict]:
+    parts = chunks(clean(thread_text)) or [""]
+    raws  = await asyncio.gather(*(
+        acall(LLMRequest(prompt=SYSTEM_PROMPT + "\n\n### THREAD:\n" + part)) for part in parts
+    ))
+    seen: set[str] = set()
+    items = []
+    for line in (l for raw in raws for l in raw.splitlines()):
+        if line.strip() and (k := line.strip().lower()) not in seen:
+            seen.add(k)
+            items.append({"text": line, "done": False})
+    return items
 
+def _extract(thread_text: str) -> list[dict]:
+    return run_sync(_aextract(thread_text))
+
+def extract_checklist(user_id: str, thread_id: str) -> dict:
+    items = cached_result(
+        user_id, thread_id,
+        task="checklist", prompt_version=PROMPT_VERSION,
+        field="aiChecklist", compute=_extract,
+    )
     # for now just echo whatever the model (or mock) returns
-    return {"thread_id": thread_id, "checklist": raw.splitlines()}
+    return {"thread_id": thread_id, "checklist": [i["text"] for i in items]}
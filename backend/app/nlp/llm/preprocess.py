@@ -0,0 +1,67 @@
+"""
+Thread text → model input.
+
+``clean`` drops what the model should not pay for: quoted replies
+(``> …`` lines, "On … wrote:" / Outlook "Original Message" blocks) and
+signatures ("-- " delimiter, "Sent from my …").  ``estimate_tokens`` is a
+cheap chars-per-token estimate, good enough for budgeting, and ``chunks``
+splits cleaned text on paragraph boundaries into pieces of at most
+``max_tokens``.
+"""
+from __future__ import annotations
+import os, re
+
+CHARS_PER_TOKEN = 4
+CHUNK_TOKENS    = int(os.getenv("LLM_CHUNK_TOKENS", "3000"))    # per map call
+
+_QUOTE_HEADER = re.compile(
+    r"^(On .{0,200}wrote:|-{2,}\s*Original Message\s*-{2,}|_{5,}|From: .+\n(Sent|Date): )",
+    re.M | re.I,
+)
+_SIGNATURE = re.compile(
+    r"^(-- ?|Sent from my \w+.*|Get Outlook for \w+.*|Best regards,?|Kind regards,?|Regards,?|Thanks,?|Cheers,?)\s*$",
+    re.M | re.I,
+)
+_SIG_MAX_LINES = 8                  # sign-offs further up are probably prose
+
+
+def clean(text: str) -> str:
+    """Text without quoted history, signatures and redundant blank lines."""
+    text = text.replace("\r\n", "\n")
+    if m := _QUOTE_HEADER.search(text):           # everything after is the quoted history
+        text = text[: m.start()]
+    lines = [l for l in text.split("\n") if not l.lstrip().startswith(">")]
+
+    for i in range(max(len(lines) - _SIG_MAX_LINES, 0), len(lines)):
+        if _SIGNATURE.match(lines[i]):
+            lines = lines[:i]
+            break
+    text = "\n".join(l.rstrip() for l in lines)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def chunks(text: str, max_tokens: int = CHUNK_TOKENS) -> list[str]:
+    """Greedy paragraph packing; paragraphs larger than a chunk are hard-split."""
+    limit = max_tokens * CHARS_PER_TOKEN
+    out: list[str] = []
+    buf = ""
+    for para in text.split("\n\n"):
+        while len(para) > limit:
+            if buf:
+                out.append(buf)
+                buf = ""
+            cut = para.rfind(" ", 0, limit)
+            cut = cut if cut > limit // 2 else limit
+            out.append(para[:cut])
+            para = para[cut:].lstrip()
+        if buf and len(buf) + 2 + len(para) > limit:
+            out.append(buf)
+            buf = ""
+        buf = f"{buf}\n\n{para}" if buf else para
+    if buf:
+        out.append(buf)
+    return out
@@ -1,39 +1,324 @@
-import os, json, boto3, httpx
+"""
+LLM provider layer (OpenAI / Bedrock / mock).
+
+Every model call – sync ``call``, async ``acall`` and streaming
+``astream`` – runs on one dedicated background event loop, which owns:
+
+• pooled clients, built once and reused (no per-call client construction,
+  no global ``openai.api_key`` mutation)
+• the global concurrency cap (LLM_CONCURRENCY in-flight calls per process)
+• per-call timeouts (LLM_TIMEOUT) and jittered exponential retries on
+  rate limits, timeouts and 5xx (LLM_RETRIES)
+
+so thread-pool callers (enrichment, cache) and request handlers share the
+same limits.  Token usage is added to the ``Usage`` opened by the caller's
+``track_usage()`` block (provider counts when given, estimates otherwise).
+"""
+from __future__ import annotations
+import asyncio, contextlib, contextvars, json, os, random, threading
+from concurrent.futures import Future
+from dataclasses import asdict, dataclass
+from typing import AsyncIterator, Iterator
+
+import boto3
+from botocore.config import Config
 from pydantic import BaseModel
 
+from .preprocess import estimate_tokens
+
+CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+TIMEOUT     = float(os.getenv("LLM_TIMEOUT", "60"))
+RETRIES     = int(os.getenv("LLM_RETRIES", "3"))
+
+
+class RateLimited(Exception):
+    """Provider asked us to slow down (HTTP 429 / ThrottlingException)."""
+
 class LLMRequest(BaseModel):
     prompt: str
     max_tokens: int = 1024
     temperature: float = 0.3
+    json_mode: bool = False         # ask for a single JSON object
+
+
+@dataclass
+class Usage:
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    def add(self, prompt: int, completion: int) -> None:
+        self.calls += 1
+        self.prompt_tokens += prompt
+        self.completion_tokens += completion
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+# Holds a mutable Usage: contexts copied onto the LLM loop share the object.
+_usage: contextvars.ContextVar[Usage | None] = contextvars.ContextVar("llm_usage", default=None)
+
+@contextlib.contextmanager
+def track_usage() -> Iterator[Usage]:
+    """Sum the tokens of every call made inside the block."""
+    usage = Usage()
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+def _record(prompt: int, completion: int) -> None:
+    if (usage := _usage.get()) is not None:
+        usage.add(prompt, completion)
+
 
-def _openai_call(req: LLMRequest) -> str:
-    import openai
-    openai.api_key = os.environ["OPENAI_API_KEY"]
-    resp = openai.chat.completions.create(
+def _provider() -> str:
+    return os.getenv("AI_PROVIDER", "mock")
+
+def model_name() -> str:
+    """Identifies who answers ``call`` – part of every LLM cache key."""
+    provider = _provider()
+    if provider == "openai":
+        return "openai:" + os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    if provider == "bedrock":
+        return "bedrock:" + os.getenv("BEDROCK_MODEL", "anthropic.claude-3-sonnet-20240229-v1:0")
+    return "mock"
+
+
+# ───────────────────────── pooled clients ─────────────────────────
+_openai = None
+_bedrock = None
+
+def _openai_client():
+    global _openai
+    if _openai is None:
+        import openai
+        _openai = openai.AsyncOpenAI(
+            api_key=os.environ["OPENAI_API_KEY"], timeout=TIMEOUT, max_retries=0,
+        )
+    return _openai
+
+def _bedrock_client():
+    global _bedrock
+    if _bedrock is None:
+        _bedrock = boto3.client(
+            "bedrock-runtime",
+            region_name=os.getenv("AWS_REGION", "us-east-1"),
+            config=Config(read_timeout=TIMEOUT, retries={"max_attempts": 0},
+                          max_pool_connections=CONCURRENCY),
+        )
+    return _bedrock
+
+def _bedrock_body(req: LLMRequest) -> str:
+    return json.dumps({"prompt": req.prompt,
+                       "max_tokens": req.max_tokens,
+                       "temperature": req.temperature})
+
+def _bedrock_model() -> str:
+    return os.getenv("BEDROCK_MODEL", "anthropic.claude-3-sonnet-20240229-v1:0")
+
+
+# ───────────────────────── one call, no retries ───────────────────
+#   each returns (text, prompt tokens, completion tokens)
+async def _openai_call(req: LLMRequest) -> tuple[str, int, int]:
+    resp = await _openai_client().chat.completions.create(
         model   = os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
         messages=[{"role": "user", "content": req.prompt}],
         temperature=req.temperature,
         max_tokens=req.max_tokens,
+        **({"response_format": {"type": "json_object"}} if req.json_mode else {}),
     )
-    return resp.choices[0].message.content
+    text = resp.choices[0].message.content
+    if resp.usage is None:
+        return text, estimate_tokens(req.prompt), estimate_tokens(text)
+    return text, resp.usage.prompt_tokens, resp.usage.completion_tokens
 
-def _bedrock_call(req: LLMRequest) -> str:
-    brt = boto3.client("bedrock-runtime", region_name=os.getenv("AWS_REGION", "us-east-1"))
-    body = json.dumps({"prompt": req.prompt,
-                       "max_tokens": req.max_tokens,
-                       "temperature": req.temperature})
-    resp = brt.invoke_model(
-        modelId = os.getenv("BEDROCK_MODEL", "anthropic.claude-3-sonnet-20240229-v1:0"),
-        body    = body,
+def _bedrock_call(req: LLMRequest) -> tuple[str, int, int]:
+    resp = _bedrock_client().invoke_model(
+        modelId = _bedrock_model(),
+        body    = _bedrock_body(req),
         contentType="application/json",
     )
-    return json.loads(resp["body"].read())["completion"]
+    text    = json.loads(resp["body"].read())["completion"]
+    headers = resp.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+    return (text,
+            int(headers.get("x-amzn-bedrock-input-token-count") or estimate_tokens(req.prompt)),
+            int(headers.get("x-amzn-bedrock-output-token-count") or estimate_tokens(text)))
 
-def call(req: LLMRequest) -> str:
-    provider = os.getenv("AI_PROVIDER", "mock")
+async def _dispatch(req: LLMRequest) -> tuple[str, int, int]:
+    provider = _provider()
     if provider == "openai":
-        return _openai_call(req)
+        return await _openai_call(req)
     if provider == "bedrock":
-        return _bedrock_call(req)
+        return await asyncio.to_thread(_bedrock_call, req)
     # mock fallback for offline/local dev
-    return "[MOCK] " + req.prompt[:60] + "..."
+    text = "[MOCK] " + req.prompt[:60] + "..."
+    if req.json_mode:
+        text = json.dumps({"bullets": [text], "questions": [], "action_items": [], "urgency": 0})
+    return text, estimate_tokens(req.prompt), estimate_tokens(text)
+
+
+# ───────────────────────── error classification ───────────────────
+_NETWORK_ERRORS = ("APIConnectionError", "APITimeoutError",          # openai
+                   "ReadTimeoutError", "ConnectTimeoutError", "EndpointConnectionError")
+
+def _boto_response(exc: Exception) -> dict:
+    resp = getattr(exc, "response", None)
+    return resp if isinstance(resp, dict) else {}
+
+def _is_rate_limit(exc: Exception) -> bool:
+    if getattr(exc, "status_code", None) == 429:                    # openai
+        return True
+    return _boto_response(exc).get("Error", {}).get("Code") in \
+        ("ThrottlingException", "TooManyRequestsException")
+
+def _is_transient(exc: Exception) -> bool:
+    status = getattr(exc, "status_code", None) or \
+        _boto_response(exc).get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return isinstance(exc, (asyncio.TimeoutError, ConnectionError)) or \
+        type(exc).__name__ in _NETWORK_ERRORS or \
+        (isinstance(status, int) and status >= 500)
+
+def _backoff(attempt: int) -> float:
+    return min(2 ** attempt, 20) * (0.5 + random.random())       # full jitter
+
+
+# ───────────────────────── the LLM loop ───────────────────────────
+_loop: asyncio.AbstractEventLoop | None = None
+_sem: asyncio.Semaphore | None = None
+_loop_lock = threading.Lock()
+
+def _submit(coro) -> Future:
+    """Run ``coro`` on the shared LLM loop (started on first use)."""
+    global _loop, _sem
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _sem = asyncio.Semaphore(CONCURRENCY)
+            threading.Thread(target=_loop.run_forever, name="llm-loop", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _loop)
+
+async def _call_with_retries(req: LLMRequest) -> str:
+    async with _sem:
+        for attempt in range(RETRIES + 1):
+            try:
+                text, prompt, completion = await asyncio.wait_for(_dispatch(req), TIMEOUT)
+                _record(prompt, completion)
+                return text
+            except Exception as exc:
+                limited = _is_rate_limit(exc)
+                if attempt == RETRIES or not (limited or _is_transient(exc)):
+                    if limited:
+                        raise RateLimited(str(exc)) from exc
+                    raise
+                await asyncio.sleep(_backoff(attempt))
+
+
+# ───────────────────────── public API ─────────────────────────────
+def call(req: LLMRequest) -> str:
+    """Blocking call for thread-pool code."""
+    return _submit(_call_with_retries(req)).result()
+
+async def acall(req: LLMRequest) -> str:
+    """Non-blocking call for request handlers."""
+    return await asyncio.wrap_future(_submit(_call_with_retries(req)))
+
+def run_sync(coro):
+    """Run a coroutine built from ``acall``s to completion from a plain thread."""
+    return _submit(coro).result()
+
+
+async def _openai_stream(req: LLMRequest) -> AsyncIterator[str]:
+    stream = await _openai_client().chat.completions.create(
+        model   = os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+        messages=[{"role": "user", "content": req.prompt}],
+        temperature=req.temperature,
+        max_tokens=req.max_tokens,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    async for chunk in stream:
+        if chunk.choices and (delta := chunk.choices[0].delta.content):
+            yield delta
+        if chunk.usage is not None:                 # final chunk
+            _record(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+
+async def _bedrock_stream(req: LLMRequest) -> AsyncIterator[str]:
+    loop, q, end = asyncio.get_running_loop(), asyncio.Queue(), object()
+
+    def pump():                                   # boto3 streams are blocking
+        try:
+            resp = _bedrock_client().invoke_model_with_response_stream(
+                modelId=_bedrock_model(), body=_bedrock_body(req), contentType="application/json",
+            )
+            for event in resp["body"]:
+                if "chunk" in event:
+                    text = json.loads(event["chunk"]["bytes"]).get("completion", "")
+                    loop.call_soon_threadsafe(q.put_nowait, text)
+        except Exception as exc:
+            loop.call_soon_threadsafe(q.put_nowait, exc)
+        finally:
+            loop.call_soon_threadsafe(q.put_nowait, end)
+
+    loop.run_in_executor(None, pump)
+    out = []
+    while (item := await q.get()) is not end:
+        if isinstance(item, Exception):
+            raise item
+        out.append(item)
+        yield item
+    _record(estimate_tokens(req.prompt), estimate_tokens("".join(out)))
+
+async def _mock_stream(req: LLMRequest) -> AsyncIterator[str]:
+    text = "[MOCK] " + req.prompt[:60] + "..."
+    for word in text.split(" "):
+        yield word + " "
+    _record(estimate_tokens(req.prompt), estimate_tokens(text))
+
+def _stream_for(req: LLMRequest) -> AsyncIterator[str]:
+    provider = _provider()
+    if provider == "openai":
+        return _openai_stream(req)
+    if provider == "bedrock":
+        return _bedrock_stream(req)
+    return _mock_stream(req)
+
+async def astream(req: LLMRequest) -> AsyncIterator[str]:
+    """
+    Yield text deltas as the model produces them.  Only the connection is
+    retried (before the first token); the concurrency slot is held for the
+    whole stream and released if the consumer goes away.
+    """
+    caller, q, end = asyncio.get_running_loop(), asyncio.Queue(), object()
+
+    async def pump():
+        try:
+            async with _sem:
+                for attempt in range(RETRIES + 1):
+                    started = False
+                    try:
+                        async for delta in _stream_for(req):
+                            started = True
+                            caller.call_soon_threadsafe(q.put_nowait, delta)
+                        break
+                    except Exception as exc:
+                        limited = _is_rate_limit(exc)
+                        if started or attempt == RETRIES or not (limited or _is_transient(exc)):
+                            if limited:
+                                raise RateLimited(str(exc)) from exc
+                            raise
+                        await asyncio.sleep(_backoff(attempt))
+        except Exception as exc:
+            caller.call_soon_threadsafe(q.put_nowait, exc)
+        finally:
+            caller.call_soon_threadsafe(q.put_nowait, end)
+
+    fut = _submit(pump())
+    try:
+        while (item := await asyncio.wait_for(q.get(), TIMEOUT)) is not end:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        fut.cancel()                              # consumer gone → free the slot
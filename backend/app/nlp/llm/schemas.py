@@ -0,0 +1,26 @@
+"""
+Structured LLM output.
+
+``Triage`` is what one triage call returns for a thread; its JSON schema
+is part of the prompt and every answer is validated against it.
+"""
+from typing import List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class ActionItem(BaseModel):
+    text: str
+    owner: Optional[str] = None           # who is asked to do it, if stated
+    due: Optional[str] = None             # deadline as written in the thread
+
+    model_config = ConfigDict(extra="ignore")
+
+
+class Triage(BaseModel):
+    bullets: List[str]           = Field(default_factory=list, max_length=8)
+    questions: List[str]         = Field(default_factory=list)
+    action_items: List[ActionItem] = Field(default_factory=list)
+    urgency: int                 = Field(0, ge=0, le=100)     # 0 = whenever, 100 = drop everything
+
+    model_config = ConfigDict(extra="ignore")
@@ -1,13 +1,109 @@
-from .provider import call, LLMRequest
-from app.integrations.gmail.service import load_thread_plain
+"""
+Thread summaries.
+
+Thread text is cleaned first (see .preprocess).  Anything that fits in one
+chunk is summarised with a single call; longer threads are map-reduced:
+every chunk is summarised in parallel, then the partial summaries are
+merged (recursively, if they are themselves too long).  Each reduce round
+at least halves the partials, and after REDUCE_ROUNDS rounds whatever is
+left is cut down to fit the final merge.
+"""
+import asyncio
+from typing import AsyncIterator
 
+from .cache import MISS, acached_result, cached_result, lookup, store
+from .preprocess import CHARS_PER_TOKEN, CHUNK_TOKENS, chunks, clean, estimate_tokens
+from .provider import acall, astream, run_sync, LLMRequest
+
+PROMPT_VERSION = "2"
+REDUCE_ROUNDS  = 4              # ≤ 2**4 × CHUNK_TOKENS of partials merged in full
 SYSTEM_PROMPT = """
 You are an email assistant. Summarise the thread in 5 bullet points
 (max 80 chars each) and list any explicit questions separately.
 """
+MAP_PROMPT = """
+You are an email assistant. This is one part of a long email thread.
+Summarise it in at most 5 bullet points (max 80 chars each) and list any
+explicit questions separately.
+"""
+REDUCE_PROMPT = """
+You are an email assistant. Below are summaries of consecutive parts of
+one email thread.  Merge them into 5 bullet points (max 80 chars each) and
+list any explicit questions separately.  Drop duplicates.
+"""
+
+def _request(thread_text: str) -> LLMRequest:
+    return LLMRequest(prompt=SYSTEM_PROMPT + "\n\n### THREAD:\n" + thread_text)
+
+def _map_request(part: str) -> LLMRequest:
+    return LLMRequest(prompt=MAP_PROMPT + "\n\n### PART:\n" + part)
+
+def _reduce_request(partials: list[str]) -> LLMRequest:
+    return LLMRequest(prompt=REDUCE_PROMPT + "\n\n### SUMMARIES:\n" + "\n\n".join(partials))
+
+def _groups(partials: list[str]) -> list[list[str]]:
+    """
+    Consecutive partials packed into groups of at most CHUNK_TOKENS – or
+    into pairs, when partials that large would each stay on their own.
+    """
+    groups: list[list[str]] = [[]]
+    size = 0
+    for p in partials:
+        if groups[-1] and size + estimate_tokens(p) > CHUNK_TOKENS:
+            groups.append([])
+            size = 0
+        groups[-1].append(p)
+        size += estimate_tokens(p)
+    if len(groups) == len(partials) > 1:                 # no progress: force pairwise merging
+        groups = [partials[i:i + 2] for i in range(0, len(partials), 2)]
+    return groups
+
+def _fit(partials: list[str]) -> list[str]:
+    """Trim every partial to an equal share of CHUNK_TOKENS."""
+    share = CHUNK_TOKENS * CHARS_PER_TOKEN // len(partials)
+    return [p[:share] for p in partials]
+
+async def _final_request(text: str) -> LLMRequest:
+    """The single request whose answer is the summary (map + partial reduces done)."""
+    if estimate_tokens(text) <= CHUNK_TOKENS:            # fast path: one call
+        return _request(text)
+    partials = list(await asyncio.gather(*(acall(_map_request(c)) for c in chunks(text))))
+    for _ in range(REDUCE_ROUNDS):                       # tree-reduce until one group fits
+        if len(groups := _groups(partials)) == 1:
+            return _reduce_request(partials)
+        partials = list(await asyncio.gather(*(acall(_reduce_request(g)) for g in groups)))
+    fits = sum(map(estimate_tokens, partials)) <= CHUNK_TOKENS
+    return _reduce_request(partials if fits else _fit(partials))
+
+async def _asummarise(thread_text: str) -> list[str]:
+    return (await acall(await _final_request(clean(thread_text)))).splitlines()
+
+def _summarise(thread_text: str) -> list[str]:
+    return run_sync(_asummarise(thread_text))
+
+_CACHE = dict(task="summary", prompt_version=PROMPT_VERSION, field="aiSummary")
 
 def summarise_thread(user_id: str, thread_id: str) -> dict:
-    thread_text = load_thread_plain(user_id, thread_id)
-    prompt      = SYSTEM_PROMPT + "\n\n### THREAD:\n" + thread_text
-    summary_txt = call(LLMRequest(prompt=prompt))
-    return {"thread_id": thread_id, "summary": summary_txt}
+    lines = cached_result(user_id, thread_id, compute=_summarise, **_CACHE)
+    return {"thread_id": thread_id, "summary": "\n".join(lines)}
+
+async def asummarise_thread(user_id: str, thread_id: str) -> dict:
+    lines = await acached_result(user_id, thread_id, compute=_asummarise, **_CACHE)
+    return {"thread_id": thread_id, "summary": "\n".join(lines)}
+
+async def stream_summary(user_id: str, thread_id: str) -> AsyncIterator[str]:
+    """
+    Summary text as it is generated; a cached summary arrives in one piece.
+    Long threads stream only the final (reduce) step.
+    """
+    item, text, key, lines = await asyncio.to_thread(lookup, user_id, thread_id, **_CACHE)
+    if lines is not MISS:
+        yield "\n".join(lines)
+        return
+    req = await _final_request(clean(text))
+    parts: list[str] = []
+    async for delta in astream(req):
+        parts.append(delta)
+        yield delta
+    await asyncio.to_thread(store, user_id, thread_id, item, field="aiSummary",
+                            key=key, value="".join(parts).splitlines())
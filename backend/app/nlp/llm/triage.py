@@ -0,0 +1,119 @@
+"""
+One-call thread triage: bullets, questions, action items and an urgency
+score from a single model call that must answer with JSON matching
+``schemas.Triage``.
+
+Malformed answers are sent back with the validation error for repair
+(TRIAGE_REPAIRS attempts, without resending the thread) before the call
+fails.  Long threads are triaged chunk by chunk in parallel and the
+partial results merged with one more structured call.  The result is
+cached like the other LLM results and also fills aiSummary / aiChecklist
+on the row, so the older endpoints and the web app read the same data.
+"""
+from __future__ import annotations
+import asyncio, json, logging, os, re
+
+from pydantic import ValidationError
+
+from .cache import acached_result, cached_result
+from .preprocess import CHUNK_TOKENS, chunks, clean, estimate_tokens
+from .provider import acall, run_sync, LLMRequest
+from .schemas import Triage
+
+log = logging.getLogger("nlp.triage")
+
+PROMPT_VERSION = "1"
+REPAIRS        = int(os.getenv("TRIAGE_REPAIRS", "2"))
+URGENT_SCORE   = int(os.getenv("TRIAGE_URGENT_SCORE", "70"))
+
+_SCHEMA = json.dumps(Triage.model_json_schema())
+SYSTEM_PROMPT = f"""
+You are an email assistant.  Triage the email thread and answer with ONE
+JSON object and nothing else, matching this JSON schema:
+{_SCHEMA}
+bullets: at most 5 summary points (max 80 chars each).
+questions: explicit questions asked of the reader.
+action_items: concrete tasks for the reader.
+urgency: 0 (no rush) to 100 (needs action within the hour).
+"""
+MERGE_PROMPT = f"""
+You are an email assistant.  Below are triage results for consecutive
+parts of one email thread.  Merge them into ONE JSON object matching this
+JSON schema, dropping duplicates and keeping at most 5 bullets:
+{_SCHEMA}
+"""
+REPAIR_PROMPT = f"""
+Your previous answer was not valid.  Return ONLY the corrected JSON
+object, matching this JSON schema:
+{_SCHEMA}
+"""
+
+
+class TriageError(Exception):
+    """The model kept answering with output that does not fit the schema."""
+
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.M)
+
+def _parse(raw: str) -> Triage:
+    text = _FENCE.sub("", raw.strip())
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        text = text[start:end + 1]
+    return Triage.model_validate_json(text)
+
+
+async def _structured(prompt: str) -> Triage:
+    raw = await acall(LLMRequest(prompt=prompt, json_mode=True, temperature=0.0))
+    for attempt in range(REPAIRS + 1):
+        try:
+            return _parse(raw)
+        except (ValidationError, ValueError) as exc:
+            if attempt == REPAIRS:
+                raise TriageError(str(exc)) from exc
+            log.info("Repairing malformed triage output (%s)", str(exc).splitlines()[0])
+            raw = await acall(LLMRequest(
+                prompt=f"{REPAIR_PROMPT}\n### ERROR:\n{exc}\n\n### PREVIOUS ANSWER:\n{raw}",
+                json_mode=True, temperature=0.0,
+            ))
+
+
+async def _atriage(thread_text: str) -> dict:
+    text = clean(thread_text)
+    if estimate_tokens(text) <= CHUNK_TOKENS:                  # fast path: one call
+        result = await _structured(SYSTEM_PROMPT + "\n\n### THREAD:\n" + text)
+    else:
+        partials = await asyncio.gather(*(
+            _structured(SYSTEM_PROMPT + "\n\n### THREAD (part):\n" + part) for part in chunks(text)
+        ))
+        merged = json.dumps([p.model_dump() for p in partials])
+        result = await _structured(MERGE_PROMPT + "\n\n### PARTS:\n" + merged)
+    return result.model_dump()
+
+def _triage(thread_text: str) -> dict:
+    return run_sync(_atriage(thread_text))
+
+
+def _row_fields(value: dict) -> dict:
+    """
+    aiSummary / aiChecklist (and a raised urgent flag) from a triage result.
+    Their cache keys are cleared with them: these are not the summary /
+    checklist tasks' own answers, so neither cache may serve them as such.
+    """
+    fields = {
+        "aiSummary":      value["bullets"] + [f"Q: {q}" for q in value["questions"]],
+        "aiSummaryKey":   None,
+        "aiChecklist":    [{"text": a["text"], "done": False} for a in value["action_items"]],
+        "aiChecklistKey": None,
+    }
+    if value["urgency"] >= URGENT_SCORE:
+        fields["urgent"] = True
+    return fields
+
+_CACHE = dict(task="triage", prompt_version=PROMPT_VERSION, field="aiTriage", derived=_row_fields)
+
+def triage_thread(user_id: str, thread_id: str) -> Triage:
+    return Triage.model_validate(cached_result(user_id, thread_id, compute=_triage, **_CACHE))
+
+async def atriage_thread(user_id: str, thread_id: str) -> Triage:
+    return Triage.model_validate(await acached_result(user_id, thread_id, compute=_atriage, **_CACHE))
@@ -1,14 +1,82 @@
-from fastapi import APIRouter, Depends
+import json
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from app.core.auth import current_user
-from .llm import summarise_thread
+from app.core.db import get_triage_rules, save_triage_rules
+from . import rules
+from .llm import (
+    asummarise_thread, atriage_thread, extract_checklist, stream_summary, TriageError,
+)
+from .llm.provider import RateLimited, track_usage
 
 router = APIRouter(prefix="/nlp", tags=["nlp"])
 
 @router.post("/summaries/{thread_id}")
-def create_summary(thread_id: str, user=Depends(current_user)):
+async def create_summary(thread_id: str, user=Depends(current_user)):
     # change from user.id to user["sub"]
-    return summarise_thread(user["sub"], thread_id)
+    with track_usage() as usage:
+        try:
+            result = await asummarise_thread(user["sub"], thread_id)
+        except RateLimited:
+            raise HTTPException(503, "AI provider is rate-limiting, try again shortly")
+    return {**result, "usage": usage.as_dict()}
+
+@router.post("/summaries/{thread_id}/stream")
+async def stream_summary_events(thread_id: str, user=Depends(current_user)):
+    """Server-sent events: ``data: {"delta": …}`` per chunk, then ``event: done`` with token usage."""
+    async def events():
+        try:
+            with track_usage() as usage:
+                async for delta in stream_summary(user["sub"], thread_id):
+                    yield f"data: {json.dumps({'delta': delta})}\n\n"
+        except RateLimited:
+            yield f"event: error\ndata: {json.dumps({'detail': 'rate limited'})}\n\n"
+            return
+        except Exception:
+            yield f"event: error\ndata: {json.dumps({'detail': 'summary failed'})}\n\n"
+            raise
+        yield f"event: done\ndata: {json.dumps(usage.as_dict())}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @router.post("/checklists/{thread_id}")
 async def create_checklist(thread_id: str, user=Depends(current_user)):
-    return await extract_checklist(user.id, thread_id)
+    try:
+        return await run_in_threadpool(extract_checklist, user["sub"], thread_id)
+    except RateLimited:
+        raise HTTPException(503, "AI provider is rate-limiting, try again shortly")
+
+@router.post("/triage/{thread_id}")
+async def create_triage(thread_id: str, user=Depends(current_user)):
+    """Bullets, questions, action items and urgency from one model call."""
+    with track_usage() as usage:
+        try:
+            triage = await atriage_thread(user["sub"], thread_id)
+        except TriageError:
+            raise HTTPException(502, "Model returned malformed triage output")
+        except RateLimited:
+            raise HTTPException(503, "AI provider is rate-limiting, try again shortly")
+    return {"thread_id": thread_id, **triage.model_dump(), "usage": usage.as_dict()}
+
+@router.get("/rules", response_model=rules.RuleConfig)
+async def get_rules(user=Depends(current_user)):
+    """The caller's urgency rules (defaults only until they save their own)."""
+    cfg = await run_in_threadpool(get_triage_rules, user["sub"])
+    return rules.RuleConfig.model_validate(cfg) if cfg else rules.RuleConfig()
+
+@router.put("/rules", response_model=rules.RuleConfig)
+async def put_rules(cfg: rules.RuleConfig, user=Depends(current_user)):
+    """
+    Replace the caller's urgency rules.  Used from the next sync /
+    enrichment on (other processes within RULES_CACHE_TTL).
+    """
+    rules.RuleSet.from_config(cfg)                  # compiles → fails fast on bad input
+    await run_in_threadpool(save_triage_rules, user["sub"], cfg.model_dump())
+    rules.invalidate(user["sub"])
+    return cfg
@@ -0,0 +1,230 @@
+"""
+Rule-based urgency scoring.
+
+A rule set is a list of weighted rules plus a threshold:
+
+    {"kind": "phrase", "value": "action required", "weight": 1, "field": "any"}
+    {"kind": "sender", "value": "ceo@acme.com",    "weight": 2}
+    {"kind": "domain", "value": "mybank.com",      "weight": 0.5}
+
+Phrase rules (case-insensitive, whole words, any whitespace between words)
+are compiled into ONE trie-shaped regex, so matching cost does not grow
+with the number of phrases; sender / domain rules are dict lookups.
+``score_batch`` joins the subjects and body prefixes of a whole batch with
+NUL separators and runs that regex once over the lot.  Each phrase counts
+once per field; a message whose score reaches the threshold is urgent.
+
+Per-user rule sets live in the oauth table (see db.get_triage_rules);
+with ``extend_defaults`` they are layered over DEFAULT_RULES.
+
+    python -m app.nlp.rules --bench          # throughput on synthetic mail
+"""
+from __future__ import annotations
+import argparse, bisect, os, random, re, threading, time
+from email.utils import parseaddr
+from typing import Literal, Mapping, Sequence
+
+from pydantic import BaseModel, Field
+
+BODY_SCAN = int(os.getenv("RULES_BODY_SCAN", "4096"))     # body characters scored
+CACHE_TTL = int(os.getenv("RULES_CACHE_TTL", "300"))
+
+
+class Rule(BaseModel):
+    kind: Literal["phrase", "sender", "domain"]
+    value: str = Field(min_length=1, max_length=200)
+    weight: float = 1.0
+    field: Literal["subject", "body", "any"] = "any"        # phrase rules only
+
+
+class RuleConfig(BaseModel):
+    rules: list[Rule] = Field(default_factory=list, max_length=5000)
+    threshold: float = 1.0
+    extend_defaults: bool = True
+
+
+DEFAULT_RULES = [
+    Rule(kind="phrase", value=v)
+    for v in ("urgent", "overdrawn", "asap", "immediately", "action required")
+]
+
+
+# ───────────────────────── compilation ─────────────────────────────
+def _norm(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _trie_pattern(phrases: list[str]) -> str:
+    """Alternation of ``phrases`` factored into a character trie (longest first)."""
+    trie: dict = {}
+    for p in phrases:
+        node = trie
+        for ch in p:
+            node = node.setdefault(ch, {})
+        node[""] = None                              # a phrase ends here
+
+    def build(node: dict) -> str:
+        ends = "" in node
+        alts = [(r"\s+" if ch == " " else re.escape(ch)) + build(child)
+                for ch, child in sorted((k, v) for k, v in node.items() if k)]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"(?:{body})?" if ends else body       # greedy → longest phrase wins
+
+    return build(trie)
+
+
+_SUBJECT, _BODY = 0, 1
+
+
+class RuleSet:
+    def __init__(self, rules: Sequence[Rule], threshold: float = 1.0):
+        self.threshold = threshold
+        self._phrases: dict[str, list[float]] = {}   # phrase → [subject weight, body weight]
+        self._senders: dict[str, float] = {}
+        self._domains: dict[str, float] = {}
+        for r in rules:
+            value = _norm(r.value)
+            if not value:
+                continue
+            if r.kind == "phrase":
+                w = self._phrases.setdefault(value, [0.0, 0.0])
+                if r.field != "body":
+                    w[_SUBJECT] += r.weight
+                if r.field != "subject":
+                    w[_BODY] += r.weight
+            elif r.kind == "sender":
+                self._senders[value] = self._senders.get(value, 0.0) + r.weight
+            else:
+                value = value.lstrip("@")
+                self._domains[value] = self._domains.get(value, 0.0) + r.weight
+        # phrases are lower-case and so is the scanned text: no re.I (≈40 % faster)
+        self._re = re.compile(r"(?<!\w)" + _trie_pattern(list(self._phrases)) + r"(?!\w)") \
+            if self._phrases else None
+
+    @classmethod
+    def from_config(cls, cfg: RuleConfig) -> "RuleSet":
+        return cls([*(DEFAULT_RULES if cfg.extend_defaults else []), *cfg.rules], cfg.threshold)
+
+    def _sender_score(self, sender: str) -> float:
+        addr = parseaddr(sender)[1].lower()
+        score = self._senders.get(addr, 0.0)
+        if self._domains and "@" in addr:
+            labels = addr.rsplit("@", 1)[1].split(".")
+            for i in range(len(labels)):              # a.b.example.com → … example.com, com
+                score += self._domains.get(".".join(labels[i:]), 0.0)
+        return score
+
+    def score_batch(self, msgs: Sequence[Mapping]) -> list[float]:
+        """
+        Scores for messages given as mappings with ``subject``, ``sender``
+        and (optionally) ``body``; only the first BODY_SCAN body characters
+        are read.
+        """
+        scores = [self._sender_score(m.get("sender") or "") if (self._senders or self._domains)
+                  else 0.0 for m in msgs]
+        if self._re is None or not msgs:
+            return scores
+
+        parts: list[str] = []
+        for m in msgs:
+            parts.append((m.get("subject") or "").lower())
+            parts.append((m.get("body") or "")[:BODY_SCAN].lower())
+        starts, pos = [], 0
+        for p in parts:
+            starts.append(pos)
+            pos += len(p) + 1                         # + the NUL separator
+        text = "\0".join(parts)
+
+        seen: set[tuple[int, str]] = set()
+        for hit in self._re.finditer(text):
+            part = bisect.bisect_right(starts, hit.start()) - 1
+            phrase = " ".join(hit.group().split())
+            if (part, phrase) in seen:
+                continue
+            seen.add((part, phrase))
+            idx, field = divmod(part, 2)
+            scores[idx] += self._phrases[phrase][field]
+        return scores
+
+    def urgent_batch(self, msgs: Sequence[Mapping]) -> list[bool]:
+        return [s >= self.threshold for s in self.score_batch(msgs)]
+
+    def is_urgent(self, msg: Mapping) -> bool:
+        return self.urgent_batch([msg])[0]
+
+
+DEFAULT = RuleSet(DEFAULT_RULES)
+
+
+# ───────────────────────── per-user rule sets ──────────────────────
+_cache: dict[str, tuple[float, RuleSet]] = {}
+_lock = threading.Lock()
+
+
+def rules_for(uid: str) -> RuleSet:
+    """The user's compiled rule set (DEFAULT if they have none), cached briefly."""
+    with _lock:
+        hit = _cache.get(uid)
+    if hit and hit[0] > time.time():
+        return hit[1]
+    from app.core.db import get_triage_rules          # keeps --bench free of AWS
+    cfg = get_triage_rules(uid)
+    rs = RuleSet.from_config(RuleConfig.model_validate(cfg)) if cfg else DEFAULT
+    with _lock:
+        _cache[uid] = (time.time() + CACHE_TTL, rs)
+    return rs
+
+
+def invalidate(uid: str) -> None:
+    with _lock:
+        _cache.pop(uid, None)
+
+
+# ───────────────────────── benchmark ───────────────────────────────
+def _bench(n_msgs: int, n_rules: int, batch: int) -> None:
+    rnd = random.Random(7)
+    def word() -> str:
+        return "".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rnd.randint(2, 9)))
+    filler   = [word() for _ in range(20000)]
+    keywords = [word() + "x" for _ in range(2000)]  # never collide with filler words
+    rules = [*DEFAULT_RULES,
+             *(Rule(kind="phrase", value=" ".join(rnd.sample(keywords, rnd.randint(1, 3))),
+                    weight=rnd.random(), field=rnd.choice(["subject", "body", "any"]))
+               for _ in range(n_rules)),
+             *(Rule(kind="domain", value=f"d{i}.com", weight=0.5) for i in range(100)),
+             *(Rule(kind="sender", value=f"u{i}@d{i}.com", weight=2) for i in range(0, n_msgs, 97))]
+    t0 = time.perf_counter()
+    rs = RuleSet(rules)
+    compile_ms = (time.perf_counter() - t0) * 1000
+
+    def text(k: int) -> str:                        # ~2 % keywords
+        return " ".join(rnd.choice(keywords) if rnd.random() < .02 else rnd.choice(filler)
+                        for _ in range(k))
+    msgs = [{"subject": text(8) + (" urgent" if i % 50 == 0 else ""),
+             "sender":  f"User {i} <u{i}@d{i % 300}.com>",
+             "body":    text(800)}                  # ≈ 5 KB, BODY_SCAN of it is read
+            for i in range(n_msgs)]
+
+    t0 = time.perf_counter()
+    urgent = 0
+    for i in range(0, n_msgs, batch):
+        urgent += sum(rs.urgent_batch(msgs[i:i + batch]))
+    secs = time.perf_counter() - t0
+    print(f"{len(rules)} rules compiled in {compile_ms:.0f} ms")
+    print(f"{n_msgs} messages in {secs:.2f} s → {n_msgs / secs:,.0f} msg/s "
+          f"(batch {batch}, {urgent} urgent)")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Triagely urgency rules")
+    ap.add_argument("--bench", action="store_true", help="score synthetic mail and report msg/s")
+    ap.add_argument("--messages", type=int, default=20000)
+    ap.add_argument("--rules", type=int, default=1000)
+    ap.add_argument("--batch", type=int, default=500)
+    args = ap.parse_args()
+    if args.bench:
+        _bench(args.messages, args.rules, args.batch)
+    else:
+        ap.print_help()
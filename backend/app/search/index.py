@@ -0,0 +1,475 @@
+"""
+Full-text search over cached messages (SQLite FTS5, one database per user).
+
+    SEARCH_DIR/<hh>/<sha1(UserID)>.db
+        msgs   id (MessageID) · source · sender · date (dateKey) · urgent · full
+        fts    FTS5(subject, sender, body), rowid = msgs.rowid
+
+DynamoDB stays the source of truth; the index is a derived, host-local
+cache.  SEARCH_DIR must be local disk – WAL-mode SQLite does not work on
+network / shared volumes – so every API host keeps its own index:
+
+• rows written in-process are indexed on the write path (``db.put_msgs`` /
+  ``put_msg`` call ``index_items``, the Gmail body fill ``index_body``)
+• rows written anywhere else – the standalone sync workers (which run
+  with SEARCH_INDEX=off and never touch the index), another API host – are
+  pulled in by ``catch_up`` before a search: the user's by-date feeds are
+  read from a little before the newest indexed dateKey (at most every
+  SEARCH_CATCHUP_SEC; an empty index loads the user in full).  A row
+  dated more than an hour behind the newest one waits for a rebuild.
+  The by-date index only carries a Gmail row's snippet, so ``full`` marks
+  rows whose body is indexed; catch-up also loads the bodies the workers
+  have filled since for the newest SEARCH_BODY_CATCHUP snippet-only rows.
+• ``rebuild`` re-indexes from triagely-messages in bulk, streaming one
+  user at a time:
+
+    python -m app.search.index rebuild [--user UID] [--no-bodies]
+    python -m app.search.index --bench                  # p50 / p95 at 100k msgs
+
+Queries are words (AND-ed), "quoted phrases" and ``prefix*`` terms,
+ranked with bm25 (subject > sender > body), optionally filtered by sender
+(substring of the From address) and a dateKey range.  Indexing never
+raises into the write path – a failure is logged and healed by a rebuild.
+"""
+from __future__ import annotations
+import argparse, calendar, hashlib, itertools, logging, os, random, re, sqlite3, tempfile, threading, time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator
+
+log = logging.getLogger("search")
+
+SEARCH_DIR = os.getenv("SEARCH_DIR", ".search")
+OPEN_MAX   = int(os.getenv("SEARCH_OPEN_MAX", "256"))          # cached connections
+CATCHUP    = float(os.getenv("SEARCH_CATCHUP_SEC", "10"))
+LOOKBACK   = 3600                                                # s re-read below the newest row
+FLUSH_ROWS = 500                                                 # rebuild batch per commit
+BODY_CATCHUP = int(os.getenv("SEARCH_BODY_CATCHUP", "100"))     # snippet-only rows re-checked
+BODY_MAX   = int(os.getenv("SEARCH_BODY_MAX", str(64 * 1024)))  # body characters indexed
+WEIGHTS    = (5.0, 2.0, 1.0)                                     # bm25: subject, sender, body
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS msgs (
+    id     TEXT NOT NULL UNIQUE,
+    source TEXT NOT NULL,
+    sender TEXT NOT NULL DEFAULT '',
+    date   TEXT NOT NULL DEFAULT '',
+    urgent INTEGER NOT NULL DEFAULT 0,
+    full   INTEGER NOT NULL DEFAULT 0     -- body indexed (not just the snippet)
+);
+CREATE INDEX IF NOT EXISTS msgs_date ON msgs(date);
+CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5(
+    subject, sender, body,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix   = '2 3'
+);
+"""
+
+
+def enabled() -> bool:
+    return os.getenv("SEARCH_INDEX", "on").lower() not in ("off", "0", "false", "no")
+
+
+# ───────────────────────── connections ─────────────────────────────
+def _path(uid: str) -> Path:
+    h = hashlib.sha1(uid.encode()).hexdigest()
+    return Path(SEARCH_DIR) / h[:2] / f"{h}.db"
+
+
+def _open(uid: str) -> sqlite3.Connection:
+    path = _path(uid)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=5, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")       # readers never block the writer
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    if "full" not in {r[1] for r in conn.execute("PRAGMA table_info(msgs)")}:
+        conn.execute("ALTER TABLE msgs ADD COLUMN full INTEGER NOT NULL DEFAULT 0")
+    return conn
+
+
+class _Conn:
+    __slots__ = ("conn", "lock", "refs", "evicted")
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn, self.lock = conn, threading.Lock()
+        self.refs, self.evicted = 0, False
+
+
+_conns: "OrderedDict[str, _Conn]" = OrderedDict()
+_conns_lock = threading.Lock()
+
+
+@contextmanager
+def _db(uid: str) -> Iterator[sqlite3.Connection]:
+    """
+    The user's index connection, held exclusively for the block.  LRU
+    eviction only closes a connection once no caller holds a reference.
+    """
+    with _conns_lock:
+        c = _conns.get(uid)
+        if c is None:
+            c = _conns[uid] = _Conn(_open(uid))
+        _conns.move_to_end(uid)
+        c.refs += 1
+        idle = []
+        while len(_conns) > OPEN_MAX:
+            _, old = _conns.popitem(last=False)
+            old.evicted = True
+            if old.refs == 0:
+                idle.append(old)
+    for old in idle:
+        old.conn.close()
+    try:
+        with c.lock:
+            yield c.conn
+    finally:
+        with _conns_lock:
+            c.refs -= 1
+            close = c.evicted and c.refs == 0
+        if close:                               # evicted while we used it
+            c.conn.close()
+
+
+# ───────────────────────── writes ──────────────────────────────────
+def _fields(item: dict) -> tuple:
+    """(id, source, sender, date, urgent, subject, body, full) of a triagely-messages row."""
+    source = (item.get("Feed") or "#gmail").split("#", 1)[1]
+    body   = item.get("text") or item.get("snippet") or ""        # slack text | gmail snippet
+    return (item["MessageID"], source, item.get("sender") or "", item.get("dateKey") or "",
+            int(bool(item.get("urgent"))), item.get("subject") or "", body[:BODY_MAX],
+            int("text" in item))
+
+
+def _upsert(conn: sqlite3.Connection, rows: Iterable[tuple]) -> int:
+    n = 0
+    for mid, source, sender, date, urgent, subject, body, full in rows:
+        rowid, had_body = conn.execute(
+            "INSERT INTO msgs(id, source, sender, date, urgent, full) VALUES (?,?,?,?,?,?) "
+            "ON CONFLICT(id) DO UPDATE SET source=excluded.source, sender=excluded.sender, "
+            "date=excluded.date, urgent=excluded.urgent, full=max(full, excluded.full) "
+            "RETURNING rowid, full",
+            (mid, source, sender, date, urgent, full),
+        ).fetchone()
+        if had_body and not full:               # a snippet never replaces an indexed body
+            body = conn.execute("SELECT body FROM fts WHERE rowid = ?", (rowid,)).fetchone()[0]
+        conn.execute("DELETE FROM fts WHERE rowid = ?", (rowid,))
+        conn.execute("INSERT INTO fts(rowid, subject, sender, body) VALUES (?,?,?,?)",
+                     (rowid, subject, sender, body))
+        n += 1
+    return n
+
+
+def index_items(uid: str, items: Iterable[dict]) -> int:
+    """Add / refresh rows just written to triagely-messages (never raises)."""
+    if not enabled():
+        return 0
+    try:
+        rows = [_fields(i) for i in items]
+    except Exception as exc:
+        log.warning("Search indexing for %s failed: %s", uid, exc)
+        return 0
+    return _index_rows(uid, rows)
+
+
+def _index_rows(uid: str, rows: list[tuple]) -> int:
+    """``index_items`` for rows already in ``_fields`` form (never raises)."""
+    if not rows:
+        return 0
+    try:
+        with _db(uid) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                n = _upsert(conn, rows)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return n
+    except Exception as exc:
+        log.warning("Search indexing of %s rows for %s failed: %s", len(rows), uid, exc)
+        return 0
+
+
+def index_body(uid: str, msg_id: str, plain: str) -> None:
+    """Replace the snippet indexed for ``msg_id`` with its full plain body (never raises)."""
+    if not enabled() or not plain:
+        return
+    try:
+        with _db(uid) as conn:
+            conn.execute("UPDATE fts SET body = ? WHERE rowid = (SELECT rowid FROM msgs WHERE id = ?)",
+                         (plain[:BODY_MAX], msg_id))
+            conn.execute("UPDATE msgs SET full = 1 WHERE id = ?", (msg_id,))
+    except Exception as exc:
+        log.warning("Search body indexing of %s for %s failed: %s", msg_id, uid, exc)
+
+
+# ───────────────────────── queries ─────────────────────────────────
+_TOKEN = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def match_expr(query: str) -> str:
+    """User query → safe FTS5 MATCH string (terms AND-ed, phrases, ``prefix*``)."""
+    terms = []
+    for phrase, word in _TOKEN.findall(query):
+        if phrase:
+            words = re.findall(r"\w+", phrase)
+            if words:
+                terms.append('"' + " ".join(words) + '"')
+            continue
+        prefix = word.endswith("*")
+        for w in re.findall(r"\w+", word):              # punctuation splits like unicode61
+            terms.append(f'"{w}"')
+        if prefix and terms and terms[-1].endswith('"'):
+            terms[-1] += "*"
+    return " AND ".join(terms)
+
+
+def search(
+    uid: str,
+    query: str,
+    *,
+    sender: str | None = None,
+    after: str | None = None,
+    before: str | None = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> list[dict]:
+    """
+    Best matches first.  ``after`` / ``before`` are dateKeys (inclusive /
+    exclusive); ``sender`` matches anywhere in the From header.
+    """
+    expr = match_expr(query)
+    if not expr:
+        return []
+    sql = ("SELECT m.id, m.source, m.sender, m.date, m.urgent, fts.subject, "
+           "snippet(fts, 2, '[', ']', '…', 12), bm25(fts, ?, ?, ?) AS score "
+           "FROM fts JOIN msgs m ON m.rowid = fts.rowid WHERE fts MATCH ?")
+    args: list = [*WEIGHTS, expr]
+    if sender:
+        sql += " AND instr(lower(m.sender), ?) > 0"
+        args.append(sender.lower())
+    if after:
+        sql += " AND m.date >= ?"
+        args.append(after)
+    if before:
+        sql += " AND m.date < ?"
+        args.append(before)
+    sql += " ORDER BY score LIMIT ? OFFSET ?"
+    args += [limit, offset]
+    with _db(uid) as conn:
+        rows = conn.execute(sql, args).fetchall()
+    return [
+        {"MessageID": mid, "source": source.split(":")[0], "sender": snd, "dateKey": date,
+         "urgent": bool(urg), "subject": subj, "snippet": snip, "score": -score}
+        for mid, source, snd, date, urg, subj, snip, score in rows
+    ]
+
+
+# ───────────────────────── catch-up ────────────────────────────────
+_caught: dict[str, float] = {}
+
+
+def _since(mark: str | None) -> str | None:
+    if not mark:
+        return None
+    t = calendar.timegm(time.strptime(mark, "%Y-%m-%dT%H:%M:%SZ")) - LOOKBACK
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(t))
+
+
+def catch_up(uid: str) -> int:
+    """
+    Index the user's rows written by other processes since shortly before
+    the newest indexed one (throttled per user; never raises).  Returns
+    # rows (re)indexed.
+    """
+    if not enabled() or _caught.get(uid, 0.0) > time.monotonic():
+        return 0
+    _caught[uid] = time.monotonic() + CATCHUP
+    try:
+        fresh = _fresh(uid)
+    except Exception as exc:
+        log.warning("Search catch-up for %s failed: %s", uid, exc)
+        return 0
+    return _index_rows(uid, fresh)
+
+
+def _fresh(uid: str) -> list[tuple]:
+    """Rows of the user's feeds from the catch-up mark on, minus those indexed as-is."""
+    from boto3.dynamodb.conditions import Key
+    from app.core.db import DATE_INDEX, slack_channels, t_msg
+
+    with _db(uid) as conn:
+        since = _since(conn.execute("SELECT max(date) FROM msgs").fetchone()[0])
+    fresh: list[tuple] = []
+    for src in ["gmail", *(f"slack:{ch}" for ch in slack_channels(uid))]:
+        cond = Key("Feed").eq(f"{uid}#{src}")
+        args: dict = {"IndexName": DATE_INDEX,
+                      "KeyConditionExpression": cond & Key("dateKey").gte(since) if since else cond}
+        while True:
+            page = t_msg.query(**args)
+            fresh.extend(_fields(i) for i in page.get("Items", []))
+            if not (start := page.get("LastEvaluatedKey")):
+                break
+            args["ExclusiveStartKey"] = start
+    known: dict[str, str] = {}
+    with _db(uid) as conn:
+        for i in range(0, len(fresh), 500):
+            ids = [r[0] for r in fresh[i:i + 500]]
+            known.update(conn.execute(
+                f"SELECT id, date FROM msgs WHERE id IN ({','.join('?' * len(ids))})", ids))
+        bare = [mid for (mid,) in conn.execute(
+            "SELECT id FROM msgs WHERE full = 0 AND source = 'gmail' ORDER BY date DESC LIMIT ?",
+            (BODY_CATCHUP,))]
+    rows = {r[0]: r for r in fresh if known.get(r[0]) != r[3]}
+    for r in _filled(uid, [*bare, *(m for m, r in rows.items() if not r[7])]):
+        rows[r[0]] = r
+    return list(rows.values())
+
+
+def _filled(uid: str, msg_ids: list[str]) -> list[tuple]:
+    """Body-indexed rows for those of ``msg_ids`` whose body has been filled in DynamoDB."""
+    from app.core import bodies
+    from app.core.db import get_msgs
+
+    if not msg_ids:
+        return []
+    done = [m for m, i in get_msgs(uid, msg_ids, "MessageID, bodyPending").items()
+            if not i.get("bodyPending")]
+    out = []
+    for item in get_msgs(uid, done).values():
+        try:
+            plain = bodies.load(item)[0]
+        except Exception as exc:
+            log.warning("Body of %s unreadable: %s", item["MessageID"], exc)
+            continue
+        r = _fields(item)
+        out.append((*r[:6], (plain or r[6])[:BODY_MAX], 1))     # nothing more will come
+    return out
+
+
+# ───────────────────────── bulk rebuild ────────────────────────────
+def _scan(uid: str | None) -> Iterator[dict]:
+    from boto3.dynamodb.conditions import Key
+    from app.core.db import t_msg
+    args: dict = {}
+    if uid:
+        args["KeyConditionExpression"] = Key("UserID").eq(uid)
+    read = t_msg.query if uid else t_msg.scan
+    while True:
+        page = read(**args)
+        yield from page.get("Items", [])
+        if not (start := page.get("LastEvaluatedKey")):
+            return
+        args["ExclusiveStartKey"] = start
+
+
+def _replace(user: str, rows: Iterator[tuple], clear: bool = True) -> int:
+    """Swap the user's index for ``rows`` in one transaction, FLUSH_ROWS at a time."""
+    n, batch = 0, []
+    with _db(user) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if clear:
+                conn.execute("DELETE FROM msgs")
+                conn.execute("DELETE FROM fts")
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= FLUSH_ROWS:
+                    n += _upsert(conn, batch)
+                    batch.clear()
+            n += _upsert(conn, batch)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("INSERT INTO fts(fts) VALUES ('optimize')")
+    return n
+
+
+def rebuild(uid: str | None = None, *, with_bodies: bool = True) -> int:
+    """
+    Re-index ``uid`` (or every user) from triagely-messages, replacing the
+    old index.  Rows stream straight into SQLite: a scan returns each
+    user's items contiguously, so only one batch is held in memory (a user
+    met again later is appended to, not cleared).
+    """
+    from app.core import bodies
+
+    def row(item: dict) -> tuple:
+        r = _fields(item)
+        if with_bodies:
+            try:
+                plain = bodies.load(item)[0]
+            except Exception as exc:
+                log.warning("Body of %s unreadable: %s", item["MessageID"], exc)
+                return r
+            if plain or not item.get("bodyPending"):
+                r = (*r[:6], (plain or r[6])[:BODY_MAX], 1)
+        return r
+
+    items = (i for i in _scan(uid) if "Feed" in i)       # older rows predate by-date
+    total, seen = 0, set()
+    for user, group in itertools.groupby(items, key=lambda i: i["UserID"]):
+        total += _replace(user, (row(i) for i in group), clear=user not in seen)
+        seen.add(user)
+    return total
+
+
+# ───────────────────────── benchmark ───────────────────────────────
+def _bench(n_msgs: int, n_queries: int) -> None:
+    global SEARCH_DIR
+    rnd = random.Random(7)
+    vocab = ["".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rnd.randint(3, 9)))
+             for _ in range(30000)]
+    stream = rnd.choices(vocab, [1 / (i + 1) for i in range(len(vocab))], k=1 << 20)   # Zipf
+
+    def words(k: int) -> str:
+        at = rnd.randrange(len(stream) - k)
+        return " ".join(stream[at:at + k])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        SEARCH_DIR = tmp
+        items = [{"MessageID": f"gmail-x-{i}", "Feed": "bench#gmail", "subject": words(6),
+                  "sender": f"User {i % 500} <u{i % 500}@d{i % 40}.com>", "text": words(120),
+                  "dateKey": f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}T00:00:00Z"}
+                 for i in range(n_msgs)]
+        t0 = time.perf_counter()
+        for i in range(0, n_msgs, 500):
+            index_items("bench", items[i:i + 500])
+        print(f"indexed {n_msgs} messages in {time.perf_counter() - t0:.1f} s")
+
+        queries = []
+        for _ in range(n_queries):
+            q = " ".join(rnd.choices(vocab[50:5000], k=rnd.randint(1, 2)))
+            kind = rnd.random()
+            if kind < .25:
+                q = q[:3] + "*"
+            queries.append((q, {"sender": "d7.com"} if kind > .8 else
+                               {"after": "2024-06-01T00:00:00Z"} if kind > .6 else {}))
+        times = []
+        for q, kw in queries:
+            t0 = time.perf_counter()
+            search("bench", q, **kw)
+            times.append((time.perf_counter() - t0) * 1000)
+        times.sort()
+        print(f"{n_queries} queries: p50 {times[len(times) // 2]:.1f} ms, "
+              f"p95 {times[int(len(times) * .95)]:.1f} ms, max {times[-1]:.1f} ms")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Triagely search index")
+    ap.add_argument("command", nargs="?", choices=["rebuild"])
+    ap.add_argument("--user", help="rebuild one user only")
+    ap.add_argument("--no-bodies", action="store_true", help="index snippets, skip body loads")
+    ap.add_argument("--bench", action="store_true", help="synthetic index, report query latency")
+    ap.add_argument("--messages", type=int, default=100_000)
+    ap.add_argument("--queries", type=int, default=500)
+    args = ap.parse_args()
+    if args.bench:
+        _bench(args.messages, args.queries)
+    elif args.command == "rebuild":
+        print("indexed:", rebuild(args.user, with_bodies=not args.no_bodies))
+    else:
+        ap.print_help()
@@ -0,0 +1,50 @@
+"""
+Full-text search across every connected source.
+
+GET /search?q=… → ranked hits from the caller's search index (app.search.index)
+"""
+from __future__ import annotations
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+
+from app.core.auth import current_user
+from app.core.db import date_key
+from . import index
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+
+class SearchHit(BaseModel):
+    MessageID: str
+    source: str                       # "gmail" | "slack"
+    subject: str = ""
+    sender: str = ""
+    dateKey: str = ""
+    urgent: bool = False
+    snippet: str = ""                 # best-matching body fragment, matches in [brackets]
+    score: float = 0.0
+
+
+@router.get("", response_model=List[SearchHit])
+async def search(
+    q: str = Query(..., min_length=1, max_length=500,
+                   description='words, "exact phrases" and prefix* terms'),
+    sender: Optional[str] = Query(None, description="substring of the From address"),
+    after: Optional[str] = Query(None, description="ISO date/time, inclusive"),
+    before: Optional[str] = Query(None, description="ISO date/time, exclusive"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    user=Depends(current_user),
+):
+    """Best matches first (bm25; subject hits outrank sender, then body hits)."""
+    await run_in_threadpool(index.catch_up, user["sub"])     # rows synced elsewhere
+    return await run_in_threadpool(
+        index.search, user["sub"], q,
+        sender=sender,
+        after=date_key(after) if after else None,
+        before=date_key(before) if before else None,
+        limit=limit, offset=offset,
+    )
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+httplib2 = pytest.importorskip("httplib2")
+pytest.importorskip("googleapiclient")
+from googleapiclient.errors import HttpError
+
+from app.integrations.gmail import batch
+
+
+def _error(status: int) -> HttpError:
+    body = json.dumps({"error": {"code": status, "message": "x", "errors": []}}).encode()
+    return HttpError(httplib2.Response({"status": status}), body)
+
+
+class FakeBatch:
+    def __init__(self, callback, errors):
+        self.callback, self.errors, self.ids = callback, errors, []
+
+    def add(self, request, request_id):
+        self.ids.append(request_id)
+
+    def execute(self, http=None):
+        for rid in self.ids:
+            exc = self.errors.get(rid)
+            self.callback(rid, None if exc else {"id": rid}, exc)
+
+
+class FakeGmail:
+    def __init__(self, errors):
+        self.errors = errors
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(callback, self.errors)
+
+
+def test_404_is_reported_as_gone(monkeypatch):
+    monkeypatch.setattr(batch.time, "sleep", lambda s: None)
+    g, gone = FakeGmail({"t2": _error(404)}), set()
+
+    out = batch._batch_get(g, ["t1", "t2", "t3"], lambda tid: tid, "threads", 25, gone=gone)
+
+    assert set(out) == {"t1", "t3"}
+    assert gone == {"t2"}
+
+
+def test_transient_failure_is_not_gone(monkeypatch):
+    monkeypatch.setattr(batch.time, "sleep", lambda s: None)
+    g, gone = FakeGmail({"t1": _error(503)}), set()
+
+    out = batch._batch_get(g, ["t1", "t2"], lambda tid: tid, "threads", 25, gone=gone)
+
+    assert set(out) == {"t2"}
+    assert gone == set()
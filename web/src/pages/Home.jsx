@@ -10,6 +10,7 @@ export default function Home() {
   const { signOut, user, getIdToken } = useAuth();
   const [sidebarTab, setSidebarTab] = useState("Priority");
   const [selected, setSelected]     = useState(null);
+  const [detail, setDetail]         = useState(null);
 
   // For AI summary/checklist
   const [aiSummary, setAISummary] = useState("");
@@ -24,7 +25,27 @@ export default function Home() {
     setLoadingSummary(false);
   }, [sidebarTab]);
 
-  // Fetch AI summary for the selected message
+  // The list only carries envelopes – load bodies for the selected thread
+  useEffect(() => {
+    setDetail(null);
+    if (!selected?.MessageID) return;
+    let cancelled = false;
+    (async () => {
+      try {
+        const token = await getIdToken();
+        const res = await fetch(
+          `${process.env.REACT_APP_API_BASE_URL}/gmail/messages/${encodeURIComponent(selected.MessageID)}`,
+          { headers: { Authorization: `Bearer ${token}` } }
+        );
+        if (res.ok && !cancelled) setDetail(await res.json());
+      } catch (e) {
+        console.error("Failed to load message body:", e);
+      }
+    })();
+    return () => { cancelled = true; };
+  }, [selected, getIdToken]);
+
+  // Fetch AI triage (summary + action items) for the selected message
   useEffect(() => {
     if (
       selected &&
@@ -34,9 +55,9 @@ export default function Home() {
       (async () => {
         try {
           const token = await getIdToken();
-          // POST to backend to trigger/fetch summary
+          // POST to backend to trigger/fetch triage (one model call)
           const res = await fetch(
-            `${process.env.REACT_APP_API_BASE_URL}/nlp/summaries/${encodeURIComponent(selected.MessageID)}`,
+            `${process.env.REACT_APP_API_BASE_URL}/nlp/triage/${encodeURIComponent(selected.MessageID)}`,
             {
               method: "POST",
               headers: {
@@ -47,8 +68,8 @@ export default function Home() {
             }
           );
           const data = await res.json();
-          setAISummary(data.summary || "");
-          setAIChecklist(data.checklist || []);
+          setAISummary([...(data.bullets || []), ...(data.questions || []).map((q) => `Q: ${q}`)]);
+          setAIChecklist((data.action_items || []).map((a) => ({ text: a.text, checked: false })));
         } catch (e) {
           setAISummary("AI summary could not be fetched.");
           setAIChecklist([]);
@@ -100,7 +121,7 @@ export default function Home() {
       <aside className={styles.detailPane}>
         {selected ? (
           <MessageDetail
-            message={selected}
+            message={detail || selected}
             aiSummary={aiSummary}
             aiChecklist={aiChecklist}
             loadingAISummary={loadingSummary}